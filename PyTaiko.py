@@ -1,9 +1,10 @@
 import argparse
 import logging
+import multiprocessing
 import os
-import sqlite3
 import sys
 from pathlib import Path
+from typing import Optional
 
 import pyray as ray
 from pypresence.presence import Presence
@@ -14,44 +15,13 @@ from raylib.defines import (
     RL_SRC_ALPHA,
 )
 
-from libs.audio import audio
 from libs.config import get_config
-from libs.global_data import PlayerNum, ScoreMethod
-from libs.screen import Screen
-from libs.song_hash import DB_VERSION
+from libs.global_data import PlayerNum, global_data
+from libs.song_hash import create_song_db, get_score_db
 from libs.tja import TJAParser
-from libs.utils import (
-    force_dedicated_gpu,
-    get_current_ms,
-    global_data,
-    global_tex,
-)
-from scenes.dan.dan_result import DanResultScreen
-from scenes.dan.dan_select import DanSelectScreen
-from scenes.dan.game_dan import DanGameScreen
-from scenes.devtest import DevScreen
-from scenes.entry import EntryScreen
-from scenes.game import GameScreen
-from scenes.loading import LoadScreen
-from scenes.practice.game import PracticeGameScreen
-from scenes.practice.song_select import PracticeSongSelectScreen
-from scenes.result import ResultScreen
-from scenes.settings import SettingsScreen
-from scenes.song_select import SongSelectScreen
-from scenes.title import TitleScreen
-from scenes.two_player.game import TwoPlayerGameScreen
-from scenes.two_player.result import TwoPlayerResultScreen
-from scenes.two_player.song_select import TwoPlayerSongSelectScreen
 
 logger = logging.getLogger(__name__)
 DISCORD_APP_ID = '1451423960401973353'
-try:
-    RPC = Presence(DISCORD_APP_ID)
-    RPC.connect()
-    discord_connected = True
-except Exception as e:
-    discord_connected = False
-    logger.warning(f"Could not connect to Discord: {e}")
 
 class Screens:
     TITLE = "TITLE"
@@ -123,42 +93,6 @@ def handle_exception(exc_type, exc_value, exc_traceback):
         return
     logger.critical("Uncaught exception", exc_info=(exc_type, exc_value, exc_traceback))
 
-def create_song_db():
-    """Create the scores database if it doesn't exist"""
-    with sqlite3.connect(global_data.score_db) as con:
-        cursor = con.cursor()
-
-        cursor.execute('''
-        SELECT name FROM sqlite_master
-        WHERE type='table' AND name='Scores'
-        ''')
-        table_exists = cursor.fetchone() is not None
-
-        create_table_query = '''
-        CREATE TABLE IF NOT EXISTS Scores (
-            hash TEXT PRIMARY KEY,
-            en_name TEXT NOT NULL,
-            jp_name TEXT NOT NULL,
-            diff INTEGER,
-            score INTEGER,
-            good INTEGER,
-            ok INTEGER,
-            bad INTEGER,
-            drumroll INTEGER,
-            combo INTEGER,
-            clear INTEGER
-        );
-        '''
-        cursor.execute(create_table_query)
-
-        if not table_exists:
-            cursor.execute(f'PRAGMA user_version = {DB_VERSION}')
-            logger.info(f"Scores database created successfully with version {DB_VERSION}")
-        else:
-            logger.info("Scores database already exists")
-
-        con.commit()
-
 def update_camera_for_window_size(camera, virtual_width, virtual_height):
     """Update camera zoom, offset, scale, and rotation to maintain aspect ratio"""
     screen_width = ray.get_screen_width()
@@ -193,14 +127,43 @@ def update_camera_for_window_size(camera, virtual_width, virtual_height):
 
     camera.rotation = global_data.camera.rotation
 
+def connect_discord() -> Optional[Presence]:
+    """Connect to Discord rich presence, returning None if Discord is not running."""
+    try:
+        rpc = Presence(DISCORD_APP_ID)
+        rpc.connect()
+        return rpc
+    except Exception as e:
+        logger.warning(f"Could not connect to Discord: {e}")
+        return None
+
 def main():
+    # The game modules are imported here rather than at the top of the file because
+    # the song indexing workers are spawned processes that re-import this module,
+    # and they must not build the audio engine or load every scene.
+    from libs.audio import audio
+    from libs.screen import Screen
+    from libs.utils import force_dedicated_gpu, get_current_ms, global_tex
+    from scenes.dan.dan_result import DanResultScreen
+    from scenes.dan.dan_select import DanSelectScreen
+    from scenes.dan.game_dan import DanGameScreen
+    from scenes.devtest import DevScreen
+    from scenes.entry import EntryScreen
+    from scenes.game import GameScreen
+    from scenes.loading import LoadScreen
+    from scenes.practice.game import PracticeGameScreen
+    from scenes.practice.song_select import PracticeSongSelectScreen
+    from scenes.result import ResultScreen
+    from scenes.settings import SettingsScreen
+    from scenes.song_select import SongSelectScreen
+    from scenes.title import TitleScreen
+    from scenes.two_player.game import TwoPlayerGameScreen
+    from scenes.two_player.result import TwoPlayerResultScreen
+    from scenes.two_player.song_select import TwoPlayerSongSelectScreen
+
     force_dedicated_gpu()
     global_data.config = get_config()
-    match global_data.config["general"]["score_method"]:
-        case ScoreMethod.GEN3:
-            global_data.score_db = 'scores_gen3.db'
-        case ScoreMethod.SHINUCHI:
-            global_data.score_db = 'scores.db'
+    global_data.score_db = get_score_db(global_data.config["general"]["score_method"])
     log_level = global_data.config["general"]["log_level"]
     if sys.platform == 'win32':
         import io
@@ -220,6 +183,7 @@ def main():
     )
     sys.excepthook = handle_exception
     logger.info("Starting PyTaiko")
+    rpc = connect_discord()
 
     logger.debug(f"Loaded config: {global_data.config}")
     screen_width = global_tex.screen_width
@@ -293,6 +257,7 @@ def main():
     logger.info("Audio device initialized")
 
     create_song_db()
+    global_data.score_repository.open(global_data.score_db)
 
     title_screen = TitleScreen('title')
     entry_screen = EntryScreen('entry')
@@ -345,12 +310,12 @@ def main():
     last_color = ray.BLACK
 
     while not ray.window_should_close():
-        if discord_connected:
+        if rpc is not None:
             if global_data.session_data[global_data.player_num].selected_song != Path():
                 details = f"Playing Song: {global_data.session_data[global_data.player_num].song_title}"
             else:
                 details = "Idling"
-            RPC.update(
+            rpc.update(
                 state=f"In Screen {current_screen}",
                 details=details,
                 large_text="PyTaiko",
@@ -409,9 +374,11 @@ def main():
 
     ray.close_window()
     audio.close_audio_device()
-    if discord_connected:
-        RPC.close()
+    global_data.score_repository.close()
+    if rpc is not None:
+        rpc.close()
     logger.info("Window closed and audio device shut down")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
@@ -2,6 +2,8 @@ import json
 import sys
 from pathlib import Path
 
+from libs.song_index import SongIndex
+
 
 def create_dan(cache_path: Path):
     dan_data = {}
@@ -20,16 +22,17 @@ def create_dan(cache_path: Path):
         exam.pop("gold_value")
         dan_data["exams"].append(exam)
     dan_data["charts"] = []
+    song_index = SongIndex(cache_path / "song_index.db")
     for i in range(3):
         chart = dict()
         chart_path = Path(input(f"Enter chart path {i+1}: "))
-        with open(f"{cache_path}/path_to_hash.json", encoding='utf-8') as f:
-            hash_directory = json.load(f)
-            chart["hash"] = hash_directory.get(chart_path)
-        with open(f"{cache_path}/song_hashes.json", encoding='utf-8') as f:
-            hash_directory = json.load(f)
-            chart["title"] = hash_directory[chart["hash"]][0]["title"]["en"]
-            chart["subtitle"] = hash_directory[chart["hash"]][0]["subtitle"]["en"]
+        entry = song_index.get_entry(chart_path)
+        if entry is None:
+            print(f"{chart_path} is not in the song index, start the game once to index it.")
+            return
+        chart["hash"] = song_index.get_hash(chart_path)
+        chart["title"] = entry["title"]["en"]
+        chart["subtitle"] = entry["subtitle"]["en"]
         chart["difficulty"] = int(input(f"Enter chart difficulty {i+1}: "))
         dan_data["charts"].append(chart)
     with open("dan.json", "w", encoding="utf-8") as f:
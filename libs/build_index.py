@@ -0,0 +1,57 @@
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+from libs.config import get_config
+from libs.font_cache import build_font_atlas
+from libs.song_hash import IndexStats, build_song_hashes, create_song_db, get_score_db
+from libs.global_data import global_data
+
+logger = logging.getLogger(__name__)
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Build the song index, import scores and build the font atlas without a window, audio device or skin."""
+    parser = argparse.ArgumentParser(prog='python -m libs.build_index',
+                                     description='Scan the song folders and pre-build the caches the loading screen would build')
+    parser.add_argument('--cache', type=Path, default=Path('cache'), help='Folder to write the song index to')
+    parser.add_argument('--skip-font', action='store_true', help='Do not build the font atlas of the song titles')
+    args = parser.parse_args(argv)
+
+    global_data.config = get_config()
+    logging.basicConfig(level=global_data.config["general"]["log_level"], format='[%(levelname)s] %(name)s: %(message)s')
+    global_data.score_db = get_score_db(global_data.config["general"]["score_method"])
+    create_song_db()
+    global_data.score_repository.open(global_data.score_db)
+
+    stats = IndexStats()
+    start = time.perf_counter()
+    global_data.song_index = build_song_hashes(args.cache, stats=stats)
+    phases = dict(stats.phase_seconds)
+
+    phase_start = time.perf_counter()
+    global_data.font_codepoints.update(global_data.song_index.codepoints())
+    phases["font codepoints"] = time.perf_counter() - phase_start
+    if not args.skip_font:
+        phase_start = time.perf_counter()
+        build_font_atlas(global_data.font_codepoints, global_data.song_index.codepoints_hash())
+        phases["font atlas"] = time.perf_counter() - phase_start
+    total_seconds = time.perf_counter() - start
+
+    # Closing the last connection folds the write-ahead log back into the database file
+    global_data.song_index.close()
+    global_data.score_repository.close()
+
+    for phase, seconds in phases.items():
+        print(f"{phase:>16} {seconds * 1000:10.1f} ms")
+    print(f"{'total':>16} {total_seconds * 1000:10.1f} ms")
+    parse_seconds = stats.phase_seconds.get("parse", 0)
+    files_per_second = stats.files_parsed / parse_seconds if parse_seconds > 0 else 0
+    print(f"Parsed {stats.files_parsed} of {stats.files_found} TJA files at {files_per_second:.1f} files/sec, "
+          f"imported {stats.score_files} score.ini files, {len(global_data.font_codepoints)} font codepoints")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,6 +20,9 @@ class GeneralConfig(TypedDict):
     fake_online: bool
     practice_mode_bar_delay: int
     score_method: str
+    index_workers: int
+    hot_reload: bool
+    watch_songs: bool
 
 class NameplateConfig(TypedDict):
     name: str
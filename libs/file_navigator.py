@@ -1,7 +1,6 @@
 import json
 import logging
 import random
-import sqlite3
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from enum import IntEnum
@@ -14,6 +13,7 @@ from raylib import SHADER_UNIFORM_VEC3
 from libs.animation import Animation, MoveAnimation
 from libs.audio import audio
 from libs.global_data import Crown, Difficulty, ScoreMethod
+from libs.song_hash import get_song_encoding
 from libs.texture import tex
 from libs.tja import TJAParser, test_encodings
 from libs.utils import OutlinedText, get_current_ms, global_data
@@ -223,28 +223,22 @@ class SongBox(BaseBox):
         self.text_loaded = True
 
     def get_scores(self):
-        with sqlite3.connect(global_data.score_db) as con:
-            cursor = con.cursor()
-            # Batch database query for all diffs at once
-            if self.tja.metadata.course_data:
-                hash_values = [self.hash[diff] for diff in self.tja.metadata.course_data if diff in self.hash]
-                placeholders = ','.join('?' * len(hash_values))
-
-                batch_query = f"""
-                    SELECT hash, score, good, ok, bad, drumroll, clear
-                    FROM Scores
-                    WHERE hash IN ({placeholders})
-                """
-                cursor.execute(batch_query, hash_values)
-
-                hash_to_score = {row[0]: row[1:] for row in cursor.fetchall()}
-
-                for diff in self.tja.metadata.course_data:
-                    if diff not in self.hash:
-                        continue
-                    diff_hash = self.hash[diff]
-                    self.scores[diff] = hash_to_score.get(diff_hash)
-                self.score_history = None
+        if self.tja.metadata.course_data:
+            # Updated in place, the SongFile this box belongs to shares the dict
+            self.scores.update(global_data.score_repository.get_many({diff: self.hash[diff] for diff in self.tja.metadata.course_data if diff in self.hash}))
+            self.score_history = None
+
+    def unload_text(self):
+        """Free the textures and shaders created by load_text and by opening the box"""
+        if self.text_loaded:
+            self.name.unload()
+            if self.shader is not None:
+                ray.unload_shader(self.shader)
+                self.shader = None
+            self.text_loaded = False
+        if self.yellow_box is not None and self.yellow_box.subtitle is not None:
+            self.yellow_box.subtitle.unload()
+        self.yellow_box = None
 
     def update(self, current_time: float, is_diff_select: bool):
         super().update(current_time, is_diff_select)
@@ -1056,18 +1050,62 @@ class Directory(FileSystemItem):
             self.box = FolderBox(name, back_color, fore_color, texture_index, genre_index, tja_count=tja_count, box_texture=box_texture)
 
 class SongFile(FileSystemItem):
-    """Represents a song file (TJA) in the navigation system"""
+    """Represents a song file (TJA) in the navigation system.
+    Only holds what the song index knows about the song, the TJAParser, SongBox and scores
+    are created when first used and dropped again with release."""
     def __init__(self, path: Path, name: str, back_color: Optional[tuple[int, int, int]], fore_color: Optional[tuple[int, int, int]], texture_index: TextureIndex):
         super().__init__(path, name)
-        self.is_recent = (datetime.now() - datetime.fromtimestamp(path.stat().st_mtime)) <= timedelta(days=7)
-        self.tja = TJAParser(path)
-        if self.is_recent:
-            self.tja.ex_data.new = True
-        title = self.tja.metadata.title.get(global_data.config['general']['language'].lower(), self.tja.metadata.title['en'])
-        self.hash = global_data.song_paths[path]
-        self.box = SongBox(title, back_color, fore_color, texture_index, self.tja)
-        self.box.hash = global_data.song_hashes[self.hash][0]["diff_hashes"]
-        self.box.get_scores()
+        entry = global_data.song_index.get_entry(path)
+        if entry is None:
+            raise Exception(f"{path} is not in the song index")
+        self.hash = global_data.song_index.get_hash(path)
+        self.diff_hashes: dict[int, str] = entry["diff_hashes"]
+        self.levels: dict[int, int] = entry["levels"]
+        self.is_recent = (datetime.now() - datetime.fromtimestamp(entry["last_modified"])) <= timedelta(days=7)
+        self.back_color = back_color
+        self.fore_color = fore_color
+        self.texture_index = texture_index
+        self.is_favorite = False
+        self._tja: Optional[TJAParser] = None
+        self._box: Optional[SongBox] = None
+        self._scores: Optional[dict[int, Optional[tuple]]] = None
+
+    @property
+    def tja(self) -> TJAParser:
+        if self._tja is None:
+            self._tja = TJAParser(self.path, encoding=get_song_encoding(self.path), header_only=True)
+            if self.is_recent:
+                self._tja.ex_data.new = True
+        return self._tja
+
+    @property
+    def box(self) -> SongBox:
+        if self._box is None:
+            title = self.tja.metadata.title.get(global_data.config['general']['language'].lower(), self.tja.metadata.title['en'])
+            self._box = SongBox(title, self.back_color, self.fore_color, self.texture_index, self.tja)
+            self._box.hash = self.diff_hashes
+            self._box.scores = self.scores
+            self._box.is_favorite = self.is_favorite
+        return self._box
+
+    @property
+    def scores(self) -> dict[int, Optional[tuple]]:
+        """Get the scores of the song by difficulty from the score repository, without creating the box"""
+        if self._scores is None:
+            self._scores = global_data.score_repository.get_many(self.diff_hashes)
+        return self._scores
+
+    @property
+    def is_materialized(self) -> bool:
+        return self._box is not None
+
+    def release(self):
+        """Drop the TJAParser and SongBox along with their textures, they are created again when next used"""
+        if self._box is not None:
+            self.is_favorite = self._box.is_favorite
+            self._box.unload_text()
+        self._box = None
+        self._tja = None
 
 @dataclass
 class Exam:
@@ -1091,23 +1129,18 @@ class DanCourse(FileSystemItem):
                 chart_title = chart["title"]
                 chart_subtitle = chart["subtitle"]
                 difficulty = chart["difficulty"]
-                if hash in global_data.song_hashes:
-                    path = Path(global_data.song_hashes[hash][0]["file_path"])
-                else:
-                    for key, value in global_data.song_hashes.items():
-                        for i in range(len(value)):
-                            song = value[i]
-                            if (song["title"]["en"].strip() == chart_title and
-                                song["subtitle"]["en"].strip() == chart_subtitle.removeprefix('--') and
-                                Path(song["file_path"]).exists()):
-                                hash_val = key
-                                path = Path(global_data.song_hashes[hash_val][i]["file_path"])
-                                break
+                entries = global_data.song_index.get_entries(hash)
+                if not entries:
+                    entries = [song for _, song in global_data.song_index.lookup_title(chart_title, chart_subtitle.removeprefix('--'))
+                               if Path(song["file_path"]).exists()]
+                if not entries:
+                    raise Exception(f"No song found for the chart {chart_title} {chart_subtitle} of {self.title}")
+                path = Path(entries[0]["file_path"])
                 if (path.parent.parent / "box.def").exists():
                     genre_index = parse_box_def(path.parent.parent)[2]
                 else:
                     genre_index = GenreIndex.NAMCO
-                tja = TJAParser(path)
+                tja = TJAParser(path, encoding=get_song_encoding(path))
                 self.charts.append((tja, genre_index, difficulty, tja.metadata.course_data[difficulty].level))
             self.exams = []
             for exam in data["exams"]:
@@ -1147,6 +1180,8 @@ class FileNavigator:
 
     def initialize(self, root_dirs: list[Path]):
         self.root_dirs = [Path(p) if not isinstance(p, Path) else p for p in root_dirs]
+        # Every song reads its scores from here, load them all with one query first
+        global_data.score_repository.load()
         self._generate_all_objects()
         self._create_virtual_root()
         self.load_current_directory()
@@ -1198,11 +1233,13 @@ class FileNavigator:
             song_list = self._read_song_list(self.favorite_folder.path)
             for song_obj in song_list:
                 if str(song_obj) in self.all_song_files:
-                    box = self.all_song_files[str(song_obj)].box
-                    if isinstance(box, DanBox):
+                    favorite = self.all_song_files[str(song_obj)]
+                    if isinstance(favorite, DanCourse):
                         logger.warning(f"Cannot favorite DanCourse: {song_obj}")
                     else:
-                        box.is_favorite = True
+                        favorite.is_favorite = True
+                        if favorite.is_materialized:
+                            favorite.box.is_favorite = True
 
         logging.info(f"Object generation complete. "
                     f"Directories: {len(self.all_directories)}, "
@@ -1232,12 +1269,7 @@ class FileNavigator:
             if box_png_path.exists():
                 box_texture = str(box_png_path)
 
-            # Count TJA files for this directory
-            tja_count = self._count_tja_files(dir_path)
-            if collection == Directory.COLLECTIONS[4]:
-                tja_count = 10
-            elif collection == Directory.COLLECTIONS[0]:
-                tja_count = len(self.new_items)
+            tja_count = self._get_tja_count(dir_path, collection)
 
             # Create Directory object
             directory_obj = Directory(
@@ -1272,52 +1304,7 @@ class FileNavigator:
                 if child_key in self.all_directories:
                     content_items.append(self.all_directories[child_key])
 
-            # Get TJA files for this directory
-            tja_files = self._get_tja_files_for_directory(dir_path)
-
-            # Create SongFile objects
-            for tja_path in sorted(tja_files):
-                song_key = str(tja_path)
-                if song_key not in self.all_song_files and tja_path.name == "dan.json":
-                    try:
-                        song_obj = DanCourse(tja_path, tja_path.name)
-                        self.all_song_files[song_key] = song_obj
-                    except Exception as e:
-                        logger.error(f"Error creating DanCourse object for {tja_path}: {e}")
-                elif song_key not in self.all_song_files and tja_path in global_data.song_paths:
-                    song_obj = SongFile(tja_path, tja_path.name, back_color, fore_color, texture_index)
-                    song_obj.box.get_scores()
-                    for course in song_obj.tja.metadata.course_data:
-                        level = song_obj.tja.metadata.course_data[course].level
-
-                        scores = song_obj.box.scores.get(course)
-                        if scores is not None:
-                            is_cleared = scores[4] >= Crown.CLEAR if scores[4] is not None else False
-                            is_full_combo = scores[4] == Crown.FC if scores[4] is not None else False
-                        else:
-                            is_cleared = False
-                            is_full_combo = False
-
-                        if course not in self.diff_sort_statistics:
-                            self.diff_sort_statistics[course] = {}
-
-                        if level not in self.diff_sort_statistics[course]:
-                            self.diff_sort_statistics[course][level] = [1, int(is_full_combo), int(is_cleared)]
-                        else:
-                            self.diff_sort_statistics[course][level][0] += 1
-                            if is_full_combo:
-                                self.diff_sort_statistics[course][level][1] += 1
-                            elif is_cleared:
-                                self.diff_sort_statistics[course][level][2] += 1
-                    if song_obj.is_recent:
-                        self.new_items.append(SongFile(tja_path, tja_path.name, back_color, fore_color, texture_index))
-                    self.song_count += 1
-                    global_data.song_progress = self.song_count / global_data.total_songs
-                    self.all_song_files[song_key] = song_obj
-
-                if song_key in self.all_song_files:
-                    content_items.append(self.all_song_files[song_key])
-
+            content_items.extend(self._generate_song_files(dir_path, back_color, fore_color, texture_index))
             self.directory_contents[dir_key] = content_items
 
         else:
@@ -1340,6 +1327,178 @@ class FileNavigator:
                         logger.error(f"Error creating SongFile for {tja_path}: {e}")
                         continue
 
+    def _get_tja_count(self, dir_path: Path, collection: Optional[str]) -> int:
+        """Get the song count shown on the box of a folder"""
+        if collection == Directory.COLLECTIONS[4]:
+            return 10
+        elif collection == Directory.COLLECTIONS[0]:
+            return len(self.new_items)
+        return self._count_tja_files(dir_path)
+
+    def _generate_song_files(self, dir_path: Path, back_color: Optional[tuple[int, int, int]], fore_color: Optional[tuple[int, int, int]], texture_index: TextureIndex) -> list[Union[SongFile, DanCourse]]:
+        """Generate the SongFile and DanCourse objects of a folder with box.def that don't exist yet, and return all of them"""
+        content_items = []
+
+        # Get TJA files for this directory
+        tja_files = self._get_tja_files_for_directory(dir_path)
+
+        # Create SongFile objects
+        for tja_path in sorted(tja_files):
+            song_key = str(tja_path)
+            if song_key not in self.all_song_files and tja_path.name == "dan.json":
+                try:
+                    song_obj = DanCourse(tja_path, tja_path.name)
+                    self.all_song_files[song_key] = song_obj
+                except Exception as e:
+                    logger.error(f"Error creating DanCourse object for {tja_path}: {e}")
+            elif song_key not in self.all_song_files and global_data.song_index.get_hash(tja_path) is not None:
+                song_obj = SongFile(tja_path, tja_path.name, back_color, fore_color, texture_index)
+                self._count_diff_sort_statistics(song_obj, 1)
+                if song_obj.is_recent:
+                    self.new_items.append(SongFile(tja_path, tja_path.name, back_color, fore_color, texture_index))
+                self.song_count += 1
+                if global_data.total_songs:
+                    global_data.song_progress = self.song_count / global_data.total_songs
+                self.all_song_files[song_key] = song_obj
+
+            if song_key in self.all_song_files:
+                content_items.append(self.all_song_files[song_key])
+
+        return content_items
+
+    def _count_diff_sort_statistics(self, song_obj: SongFile, amount: int):
+        """Add a song to the difficulty sort statistics, or take it out again with a negative amount"""
+        for course, level in song_obj.levels.items():
+            scores = song_obj.scores.get(course)
+            if scores is not None:
+                # Scores are (score, good, ok, bad, drumroll, clear), the crown is the last one
+                is_cleared = scores[5] >= Crown.CLEAR if scores[5] is not None else False
+                is_full_combo = scores[5] == Crown.FC if scores[5] is not None else False
+            else:
+                is_cleared = False
+                is_full_combo = False
+
+            if course not in self.diff_sort_statistics:
+                self.diff_sort_statistics[course] = {}
+
+            if level not in self.diff_sort_statistics[course]:
+                self.diff_sort_statistics[course][level] = [amount, int(is_full_combo) * amount, int(is_cleared) * amount]
+            else:
+                self.diff_sort_statistics[course][level][0] += amount
+                if is_full_combo:
+                    self.diff_sort_statistics[course][level][1] += amount
+                elif is_cleared:
+                    self.diff_sort_statistics[course][level][2] += amount
+
+    def _find_box_directory(self, path: Path) -> Optional[Path]:
+        """Get the nearest existing folder with box.def that contains a path, or None if there is none below a root folder"""
+        for parent in (path, *path.parents):
+            if (parent / "box.def").exists():
+                return parent
+            if parent in self.root_dirs:
+                return None
+        return None
+
+    def refresh_songs(self, changed_paths: set[Path]):
+        """Update the navigator after TJA files were added, changed or removed while the game is running.
+        Only the folders containing those files are regenerated, the rest of the tree is left as it is."""
+        box_dirs: set[Path] = set()
+        refresh_root = False
+        for path in changed_paths:
+            song_obj = self.all_song_files.pop(str(path), None)
+            if isinstance(song_obj, SongFile):
+                self._count_diff_sort_statistics(song_obj, -1)
+                self.new_items = [item for item in self.new_items if item.path != path]
+                self.song_count -= 1
+            box_dir = self._find_box_directory(path.parent)
+            if box_dir is None:
+                refresh_root = True
+            else:
+                box_dirs.add(box_dir)
+
+        for dir_key in [key for key in self.all_directories if not Path(key).exists()]:
+            del self.all_directories[dir_key]
+            self.directory_contents.pop(dir_key, None)
+
+        # Deepest first, so a new folder exists before the folder around it is regenerated
+        pending = sorted(box_dirs, key=lambda box_dir: len(box_dir.parts), reverse=True)
+        regenerated: set[Path] = set()
+        while pending:
+            box_dir = pending.pop(0)
+            if str(box_dir) not in self.all_directories:
+                self._generate_objects_recursive(box_dir)
+                parent_dir = self._find_box_directory(box_dir.parent)
+                if parent_dir is None:
+                    refresh_root = True
+                elif parent_dir not in pending:
+                    pending.append(parent_dir)
+                continue
+            self._regenerate_directory(box_dir)
+            regenerated.add(box_dir)
+
+        if refresh_root:
+            # Songs outside of any box.def folder are shown directly at the root
+            for root_path in self.root_dirs:
+                if not root_path.exists() or (root_path / "box.def").exists():
+                    continue
+                for tja_path in self._find_tja_files_recursive(root_path):
+                    if str(tja_path) not in self.all_song_files and global_data.song_index.get_hash(tja_path) is not None:
+                        self.all_song_files[str(tja_path)] = SongFile(tja_path, tja_path.name, None, None, TextureIndex.DEFAULT)
+            self._create_virtual_root()
+
+        if not self.box_open and ((refresh_root and self.is_at_root()) or self.current_dir in regenerated):
+            self._reload_current_directory()
+        else:
+            self._drop_removed_items()
+        logger.info(f"Refreshed {len(box_dirs)} folders for {len(changed_paths)} changed songs")
+
+    def _reload_current_directory(self):
+        """Load the folder on screen again, keeping the selection on the same item if it still exists"""
+        selected_path = self.items[self.selected_index].path if 0 <= self.selected_index < len(self.items) else None
+        self.load_current_directory()
+        for i, item in enumerate(self.items):
+            if item.path == selected_path:
+                self.selected_index = i
+                break
+        else:
+            self.selected_index = min(self.selected_index, max(0, len(self.items) - 1))
+        self.calculate_box_positions()
+
+    def _regenerate_directory(self, dir_path: Path):
+        """Rebuild the contents of an existing folder with box.def and mark its crowns for recalculation"""
+        dir_key = str(dir_path)
+        directory_obj = self.all_directories[dir_key]
+        _, texture_index, _, collection, back_color, fore_color = parse_box_def(dir_path)
+        content_items = []
+        for child_path in sorted(dir_path.iterdir()):
+            if child_path.is_dir() and str(child_path) in self.all_directories:
+                content_items.append(self.all_directories[str(child_path)])
+        content_items.extend(self._generate_song_files(dir_path, back_color, fore_color, texture_index))
+        self.directory_contents[dir_key] = content_items
+        if isinstance(directory_obj.box, FolderBox):
+            directory_obj.box.tja_count = self._get_tja_count(dir_path, collection)
+        for parent in (dir_path, *dir_path.parents):
+            self.crown_cache_dirty.add(str(parent))
+
+    def _drop_removed_items(self):
+        """Take songs and folders that no longer exist out of the items currently on screen"""
+        selected_item = self.items[self.selected_index] if 0 <= self.selected_index < len(self.items) else None
+        kept_items = []
+        for item in self.items:
+            if isinstance(item, SongFile) and str(item.path) not in self.all_song_files:
+                continue
+            if isinstance(item, Directory) and not item.back and str(item.path) not in self.all_directories:
+                continue
+            kept_items.append(item)
+        if len(kept_items) == len(self.items):
+            return
+        self.items = kept_items
+        if selected_item in self.items:
+            self.selected_index = self.items.index(selected_item)
+        else:
+            self.selected_index = min(self.selected_index, max(0, len(self.items) - 1))
+        self.calculate_box_positions()
+
     def is_at_root(self) -> bool:
         """Check if currently at the virtual root"""
         return self.current_dir == Path()
@@ -1375,7 +1534,7 @@ class FileNavigator:
                 if sibling_key in self.directory_contents:
                     for item in self.directory_contents[sibling_key]:
                         if isinstance(item, SongFile) and item:
-                            if self.diff_sort_diff in item.tja.metadata.course_data and item.tja.metadata.course_data[self.diff_sort_diff].level == self.diff_sort_level:
+                            if item.levels.get(self.diff_sort_diff) == self.diff_sort_level:
                                 if item not in content_items:
                                     content_items.append(item)
         return content_items
@@ -1395,6 +1554,7 @@ class FileNavigator:
     def load_current_directory(self, selected_item: Optional[Directory] = None):
         """Load pre-generated items for the current directory (unified for root and subdirs)"""
         dir_key = str(self.current_dir)
+        previous_items = list(self.items)
 
         # Determine if current directory has child directories with box.def
         has_children = False
@@ -1486,6 +1646,15 @@ class FileNavigator:
                     hori_name = OutlinedText(diffs[min(Difficulty.ONI, self.diff_sort_diff)], tex.skin_config["song_hori_name"].font_size, ray.WHITE, outline_thickness=5)
                 self.genre_bg = GenreBG(start_box, end_box, hori_name, diff_sort)
 
+        self._release_left_songs(previous_items)
+
+    def _release_left_songs(self, previous_items: list[Union[Directory, SongFile]]):
+        """Release the songs of the directory that was just left, keeping the ones still on screen"""
+        current_items = set(map(id, self.items))
+        for item in previous_items:
+            if isinstance(item, SongFile) and id(item) not in current_items:
+                item.release()
+
     def select_current_item(self):
         """Select the currently highlighted item"""
         if not self.items or self.selected_index >= len(self.items):
@@ -1558,12 +1727,12 @@ class FileNavigator:
         for item in tja_files:
             has_crown = False
             if isinstance(item, SongFile):
-                has_crown = any((item.box.scores.get(d) or (None,)*6)[5] is not None
+                has_crown = any((item.scores.get(d) or (None,)*6)[5] is not None
                               for d in [Difficulty.EASY, Difficulty.NORMAL, Difficulty.HARD, Difficulty.ONI])
-                for diff in item.box.scores:
+                for diff in item.scores:
                     if diff not in all_scores:
                         all_scores[diff] = []
-                    all_scores[diff].append(item.box.scores[diff])
+                    all_scores[diff].append(item.scores[diff])
             elif isinstance(item, Directory):
                 child_key = str(item.path)
                 child_crowns = self._get_directory_crowns_cached(child_key)
@@ -1664,22 +1833,19 @@ class FileNavigator:
                 hash_val, title, subtitle = parts[0], parts[1], parts[2]
                 original_hash = hash_val
 
-                if hash_val in global_data.song_hashes:
-                    for entry in global_data.song_hashes[hash_val]:
+                entries = global_data.song_index.get_entries(hash_val)
+                if entries:
+                    for entry in entries:
                         file_path = Path(entry["file_path"])
                         if file_path.exists() and file_path not in tja_files:
                             tja_files.append(file_path)
                 else:
-                    # Try to find by title and subtitle
-                    for key, value in global_data.song_hashes.items():
-                        for i in range(len(value)):
-                            song = value[i]
-                            if (song["title"]["en"].strip() == title and
-                                song["subtitle"]["en"].strip() == subtitle.removeprefix('--') and
-                                Path(song["file_path"]).exists()):
-                                hash_val = key
-                                tja_files.append(Path(global_data.song_hashes[hash_val][i]["file_path"]))
-                                break
+                    # Try to find by title and subtitle, the match is written back to the list
+                    for key, song in global_data.song_index.lookup_title(title, subtitle.removeprefix('--')):
+                        if Path(song["file_path"]).exists():
+                            hash_val = key
+                            tja_files.append(Path(song["file_path"]))
+                            break
 
                 if hash_val != original_hash:
                     file_updated = True
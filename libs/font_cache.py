@@ -0,0 +1,127 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Optional
+
+import pyray as ray
+
+from libs.global_data import global_data
+
+logger = logging.getLogger(__name__)
+
+FONT_SIZE = 40
+# Same padding LoadFontEx uses around every glyph in the atlas
+FONT_GLYPH_PADDING = 4
+FONT_CACHE_DIR = Path('cache/font')
+
+def get_font_path() -> Path:
+    """Get the font file of the current skin used for song titles and other text."""
+    return Path(f'Skins/{global_data.config["paths"]["skin"]}/Graphics/Modified-DFPKanteiryu-XB.ttf')
+
+def _get_atlas_key(font_path: Path, codepoints_hash: str) -> str:
+    """Get the cache key of a font atlas, which changes with the codepoints, the font file and the font size."""
+    font_stat = font_path.stat()
+    key = f"{font_path}|{font_stat.st_size}|{font_stat.st_mtime_ns}|{FONT_SIZE}|{FONT_GLYPH_PADDING}|{codepoints_hash}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def _generate_atlas(font_path: Path, codepoints: str) -> tuple[ray.Image, list[list[float]]]:
+    """Rasterize the glyphs and pack them into an atlas image the same way LoadFontEx does, without needing a window.
+    Returns the atlas and the value, offsetX, offsetY, advanceX and atlas rectangle of every glyph."""
+    if not codepoints:
+        # LoadFontEx falls back to the printable ASCII characters as well
+        codepoints = ''.join(chr(codepoint) for codepoint in range(32, 127))
+    data_size = ray.ffi.new('int *', 0)
+    file_data = ray.load_file_data(str(font_path), data_size)
+    codepoint_count = ray.ffi.new('int *', 0)
+    codepoint_values = ray.load_codepoints(codepoints, codepoint_count)
+    glyph_count = codepoint_count[0]
+    glyphs = ray.load_font_data(file_data, data_size[0], FONT_SIZE, codepoint_values, glyph_count, ray.FontType.FONT_DEFAULT)
+    ray.unload_codepoints(codepoint_values)
+    ray.unload_file_data(file_data)
+    recs = ray.ffi.new('Rectangle **')
+    atlas = ray.gen_image_font_atlas(glyphs, recs, glyph_count, FONT_SIZE, FONT_GLYPH_PADDING, 0)
+    metrics = []
+    for i in range(glyph_count):
+        glyph = glyphs[i]
+        rec = recs[0][i]
+        metrics.append([glyph.value, glyph.offsetX, glyph.offsetY, glyph.advanceX, rec.x, rec.y, rec.width, rec.height])
+    ray.unload_font_data(glyphs, glyph_count)
+    ray.mem_free(recs[0])
+    return atlas, metrics
+
+def _font_from_atlas(atlas: ray.Image, metrics: list[list[float]]) -> ray.Font:
+    """Build a font from an atlas image and its glyph metrics.
+    The glyph arrays are allocated by raylib, so unload_font can free the font like one from load_font_ex."""
+    glyph_count = len(metrics)
+    recs = ray.ffi.cast('Rectangle *', ray.mem_alloc(glyph_count * ray.ffi.sizeof('Rectangle')))
+    glyphs = ray.ffi.cast('GlyphInfo *', ray.mem_alloc(glyph_count * ray.ffi.sizeof('GlyphInfo')))
+    for i, (value, offset_x, offset_y, advance_x, x, y, width, height) in enumerate(metrics):
+        recs[i].x, recs[i].y, recs[i].width, recs[i].height = x, y, width, height
+        glyphs[i].value = int(value)
+        glyphs[i].offsetX = int(offset_x)
+        glyphs[i].offsetY = int(offset_y)
+        glyphs[i].advanceX = int(advance_x)
+        # image_text_ex draws from the glyph images, LoadFontEx cuts them out of the atlas the same way
+        glyphs[i].image = ray.image_from_image(atlas, recs[i])
+    texture = ray.load_texture_from_image(atlas)
+    return ray.Font(FONT_SIZE, glyph_count, FONT_GLYPH_PADDING, texture, recs, glyphs)
+
+def _save_atlas(key: str, atlas: ray.Image, metrics: list[list[float]]):
+    """Write an atlas and its glyph metrics to the cache, replacing the atlases of older codepoint sets."""
+    FONT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for old_file in FONT_CACHE_DIR.iterdir():
+        if old_file.stem != key:
+            old_file.unlink(missing_ok=True)
+    ray.export_image(atlas, str(FONT_CACHE_DIR / f'{key}.png'))
+    # The metrics are written last, an atlas without them is never loaded
+    with open(FONT_CACHE_DIR / f'{key}.json', 'w', encoding='utf-8') as f:
+        json.dump({"base_size": FONT_SIZE, "padding": FONT_GLYPH_PADDING, "glyphs": metrics}, f)
+
+def _load_cached_atlas(key: str) -> Optional[tuple[ray.Image, list[list[float]]]]:
+    """Load an atlas and its glyph metrics from the cache, or None if they aren't there."""
+    atlas_path = FONT_CACHE_DIR / f'{key}.png'
+    metrics_path = FONT_CACHE_DIR / f'{key}.json'
+    if not atlas_path.exists() or not metrics_path.exists():
+        return None
+    try:
+        with open(metrics_path, 'r', encoding='utf-8') as f:
+            metrics = json.load(f)["glyphs"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Could not read the cached font metrics {metrics_path}, rebuilding them: {e}")
+        return None
+    atlas = ray.load_image(str(atlas_path))
+    if atlas.data == ray.ffi.NULL:
+        return None
+    return atlas, metrics
+
+def build_font_atlas(codepoints: set[str], codepoints_hash: str) -> bool:
+    """Write the font atlas of a codepoint set to the cache if it isn't there yet, without needing a window.
+    Returns whether a new atlas was built."""
+    font_path = get_font_path()
+    key = _get_atlas_key(font_path, codepoints_hash)
+    if (FONT_CACHE_DIR / f'{key}.json').exists():
+        return False
+    atlas, metrics = _generate_atlas(font_path, ''.join(sorted(codepoints)))
+    _save_atlas(key, atlas, metrics)
+    ray.unload_image(atlas)
+    logger.info(f"Built font atlas with {len(metrics)} codepoints")
+    return True
+
+def load_font(codepoints: set[str], codepoints_hash: Optional[str] = None) -> ray.Font:
+    """Load the font with the given codepoints.
+    With the content hash of the codepoints the atlas is loaded from the cache in one step, or built and cached.
+    Without one it is built in memory only, for the occasional reload when new characters show up."""
+    font_path = get_font_path()
+    key = _get_atlas_key(font_path, codepoints_hash) if codepoints_hash is not None else None
+    cached = _load_cached_atlas(key) if key is not None else None
+    if cached is not None:
+        atlas, metrics = cached
+        logger.info(f"Loaded cached font atlas with {len(metrics)} codepoints")
+    else:
+        atlas, metrics = _generate_atlas(font_path, ''.join(sorted(codepoints)))
+        if key is not None:
+            _save_atlas(key, atlas, metrics)
+    font = _font_from_atlas(atlas, metrics)
+    ray.unload_image(atlas)
+    return font
@@ -1,11 +1,14 @@
+import random
 from dataclasses import dataclass, field
 from enum import IntEnum
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 import pyray as ray
 
 from libs.config import Config
+from libs.score_repository import ScoreRepository
+from libs.song_index import SongIndex
 
 
 class PlayerNum(IntEnum):
@@ -113,7 +116,8 @@ class SessionData:
     dan_color: int: The emblem color of the selected dan
     selected_difficulty: The difficulty level selected by the user.
     song_title: The title of the song being played.
-    genre_index: The index of the genre being played."""
+    genre_index: The index of the genre being played.
+    modifier_seed: The seed the random modifier uses, so a retry gets the same chart."""
     selected_song: Path = Path()
     song_hash: str = ""
     selected_dan: list[tuple[Any, int, int, int]] = field(default_factory=lambda: [])
@@ -122,6 +126,7 @@ class SessionData:
     selected_difficulty: int = 0
     song_title: str = "default_title"
     genre_index: int = 0
+    modifier_seed: int = field(default_factory=lambda: random.getrandbits(32))
     result_data: ResultData = field(default_factory=lambda: ResultData())
     dan_result_data: DanResultData = field(default_factory=lambda: DanResultData())
 
@@ -141,8 +146,9 @@ class GlobalData:
     Attributes:
         songs_played (int): The number of songs played.
         config (dict): The configuration settings.
-        song_hashes (dict[str, list[dict]]): A dictionary mapping song hashes to their metadata.
-        song_paths (dict[Path, str]): A dictionary mapping song paths to their hashes.
+        song_index (SongIndex): The index of every song, by hash and by path. None until the loading screen opens it.
+        score_repository (ScoreRepository): The best scores of the scores database, by course hash. Opened at startup.
+        pending_codepoints (set[str]): Characters drawn this screen that the font atlas lacks, saved to the song index when the screen ends.
         song_progress (float): The progress of the loading bar.
         total_songs (int): The total number of songs.
         hit_sound (list[int]): The indices of the hit sounds currently used.
@@ -155,10 +161,11 @@ class GlobalData:
     camera: Camera = Camera()
     font: ray.Font = ray.get_font_default()
     font_codepoints = set()
+    pending_codepoints: set[str] = field(default_factory=set)
     config: Config = field(default_factory=dict)
-    song_hashes: dict[str, list[dict]] = field(default_factory=lambda: dict()) #Hash to path
-    song_paths: dict[Path, str] = field(default_factory=lambda: dict()) #path to hash
+    song_index: Optional[SongIndex] = None
     score_db: str = ""
+    score_repository: ScoreRepository = field(default_factory=ScoreRepository)
     song_progress: float = 0.0
     total_songs: int = 0
     hit_sound: list[int] = field(default_factory=lambda: [0, 0, 0])
@@ -0,0 +1,102 @@
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Score, good, ok, bad, drumroll and clear of the best play of a course
+ScoreRow = tuple[Optional[int], Optional[int], Optional[int], Optional[int], Optional[int], Optional[int]]
+
+class ScoreRepository:
+    """In-memory map of the best score of every course in the scores database, keyed by course hash.
+    Scores are read with one query over a single long-lived connection, either for the whole library
+    or for the courses that were asked for, and the map is updated in place when a new score is written.
+    The connection is shared between the loading threads and the main thread, every access holds the lock."""
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.con: Optional[sqlite3.Connection] = None
+        self.scores: dict[str, Optional[ScoreRow]] = dict()
+        self.loaded_all = False
+
+    def open(self, path: Path | str):
+        """Connect to a scores database, forgetting the scores of the previous one."""
+        with self.lock:
+            self.close()
+            self.con = sqlite3.connect(path, check_same_thread=False)
+
+    def close(self):
+        with self.lock:
+            if self.con is not None:
+                self.con.close()
+                self.con = None
+            self.scores.clear()
+            self.loaded_all = False
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.con is None:
+            raise Exception("The scores database is not open")
+        return self.con
+
+    def load(self, hashes: Optional[Iterable[str]] = None):
+        """Read the scores of the given course hashes, or of every course if none are given, with one query.
+        Scores written by other connections, like the score import of the song index, show up after loading again."""
+        with self.lock:
+            con = self._connection()
+            if hashes is None:
+                rows = con.execute('SELECT hash, score, good, ok, bad, drumroll, clear FROM Scores').fetchall()
+                self.scores = {row[0]: row[1:] for row in rows}
+                self.loaded_all = True
+                logger.info(f"Loaded {len(self.scores)} scores")
+                return
+            hashes = list(hashes)
+            if not hashes:
+                return
+            # A single JSON parameter avoids the limit on the number of bound variables
+            rows = con.execute("""
+                SELECT hash, score, good, ok, bad, drumroll, clear FROM Scores
+                WHERE hash IN (SELECT value FROM json_each(?))
+            """, (json.dumps(hashes),)).fetchall()
+            found = {row[0]: row[1:] for row in rows}
+            # Unplayed courses are remembered too, so they aren't queried again
+            for hash_val in hashes:
+                self.scores[hash_val] = found.get(hash_val)
+
+    def get(self, hash_val: str) -> Optional[ScoreRow]:
+        """Get the best score of a course, or None if it was never played."""
+        return self.get_many({0: hash_val})[0]
+
+    def get_many(self, diff_hashes: dict[int, str]) -> dict[int, Optional[ScoreRow]]:
+        """Get the best score of every course of a song by difficulty, or None if unplayed.
+        Courses that aren't in the map yet are read with one query."""
+        with self.lock:
+            if not self.loaded_all:
+                self.load([hash_val for hash_val in diff_hashes.values() if hash_val not in self.scores])
+            return {diff: self.scores.get(hash_val) for diff, hash_val in diff_hashes.items()}
+
+    def write_score(self, hash_val: str, en_name: str, jp_name: str, diff: int, score: int, good: int, ok: int,
+                    bad: int, drumroll: int, combo: int, crown: int) -> Optional[int]:
+        """Record a play of a course, keeping the best score and the best crown separately.
+        Returns the previous best score, or None if the course was never played."""
+        with self.lock:
+            con = self._connection()
+            existing = self.get(hash_val)
+            existing_score = existing[0] if existing is not None else None
+            existing_crown = existing[5] if existing is not None and existing[5] is not None else 0
+            logger.info(f"Existing score: {existing_score}, Existing crown: {existing_crown}, New score: {score}, New crown: {crown}")
+            best_crown = max(crown, existing_crown)
+            with con:
+                if existing is None or (existing_score is not None and score > existing_score):
+                    con.execute("""
+                        INSERT OR REPLACE INTO Scores (hash, en_name, jp_name, diff, score, good, ok, bad, drumroll, combo, clear)
+                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (hash_val, en_name, jp_name, diff, score, good, ok, bad, drumroll, combo, best_crown))
+                    existing = (score, good, ok, bad, drumroll, best_crown)
+                    logger.info(f"Wrote score {score} for {en_name}")
+                elif crown > existing_crown:
+                    con.execute('UPDATE Scores SET clear = ? WHERE hash = ?', (crown, hash_val))
+                    existing = existing[:5] + (crown,)
+            self.scores[hash_val] = existing
+            return existing_score
@@ -2,6 +2,7 @@ import logging
 from typing import Any
 
 from libs.audio import audio
+from libs.global_data import global_data
 from libs.texture import tex
 
 logger = logging.getLogger(__name__)
@@ -31,6 +32,10 @@ class Screen:
         logger.info(f"Unloaded sounds for screen: {next_screen}")
         tex.unload_textures()
         logger.info(f"Unloaded textures for screen: {next_screen}")
+        if global_data.pending_codepoints and global_data.song_index is not None:
+            # One write for every character the font atlas lacked, instead of one while drawing each text
+            global_data.song_index.add_codepoints(''.join(global_data.pending_codepoints))
+            global_data.pending_codepoints.clear()
         return next_screen
 
     def update(self) -> Any:
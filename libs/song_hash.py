@@ -2,17 +2,42 @@ import configparser
 import csv
 import json
 import logging
+import multiprocessing
+import os
 import sqlite3
+import subprocess
 import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Iterable, Optional
 
 from libs.config import get_config
-from libs.global_data import Crown
-from libs.tja import NoteList, TJAParser, test_encodings
-from libs.utils import global_data
+from libs.global_data import Crown, ScoreMethod
+from libs.song_index import SongIndex, scan_tja_files
+from libs.tja import HASH_VERSION, NoteList, TJAParser, detect_encoding
+from libs.global_data import global_data
 
 logger = logging.getLogger(__name__)
-DB_VERSION = 1
+DB_VERSION = 2
+
+# Hash, English name, Japanese name, difficulty, score, crown and bad count of an imported score
+ScoreRecord = tuple[str, str, str, int, int, int, Optional[int]]
+
+@dataclass
+class IndexStats:
+    """Counts and timings of one build_song_hashes run.
+
+    Attributes:
+        files_found (int): TJA files found in the song folders.
+        files_parsed (int): New or changed TJA files that were parsed.
+        score_files (int): TJAPlayer3 score.ini files that were imported.
+        phase_seconds (dict[str, float]): Time spent in each phase, in the order they ran.
+    """
+    files_found: int = 0
+    files_parsed: int = 0
+    score_files: int = 0
+    phase_seconds: dict[str, float] = field(default_factory=lambda: dict())
 
 def diff_hashes_object_hook(obj):
     if "diff_hashes" in obj:
@@ -38,277 +63,549 @@ def update_db_version():
         cursor = con.cursor()
         cursor.execute(f'PRAGMA user_version = {DB_VERSION}')
 
+def get_score_db(score_method: str) -> str:
+    """Get the scores database file used with a score method."""
+    match score_method:
+        case ScoreMethod.GEN3:
+            return 'scores_gen3.db'
+        case _:
+            return 'scores.db'
+
+def create_song_db():
+    """Create the scores database if it doesn't exist"""
+    with sqlite3.connect(global_data.score_db) as con:
+        cursor = con.cursor()
+
+        cursor.execute('''
+        SELECT name FROM sqlite_master
+        WHERE type='table' AND name='Scores'
+        ''')
+        table_exists = cursor.fetchone() is not None
+
+        create_table_query = '''
+        CREATE TABLE IF NOT EXISTS Scores (
+            hash TEXT PRIMARY KEY,
+            en_name TEXT NOT NULL,
+            jp_name TEXT NOT NULL,
+            diff INTEGER,
+            score INTEGER,
+            good INTEGER,
+            ok INTEGER,
+            bad INTEGER,
+            drumroll INTEGER,
+            combo INTEGER,
+            clear INTEGER
+        );
+        '''
+        cursor.execute(create_table_query)
+
+        if not table_exists:
+            cursor.execute(f'PRAGMA user_version = {DB_VERSION}')
+            logger.info(f"Scores database created successfully with version {DB_VERSION}")
+        else:
+            logger.info("Scores database already exists")
+
+        con.commit()
+
+def load_hash_migration(path: Path) -> dict[str, str]:
+    """Load the old hash to new hash mapping recorded by previous hash version bumps."""
+    if not path.exists():
+        return dict()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def resolve_hash_migration(hash_migration: dict[str, str]) -> dict[str, str]:
+    """Follow the chains of a hash migration recorded over several hash versions, so every old hash maps to its current value."""
+    resolved = dict()
+    for old_hash in hash_migration:
+        new_hash = hash_migration[old_hash]
+        seen = {old_hash}
+        while new_hash in hash_migration and new_hash not in seen:
+            seen.add(new_hash)
+            new_hash = hash_migration[new_hash]
+        if new_hash != old_hash:
+            resolved[old_hash] = new_hash
+    return resolved
+
+def remap_score_hashes(con: sqlite3.Connection, remap: Iterable[tuple[str, str]]) -> int:
+    """Rename score hashes from (old_hash, new_hash) pairs with a temp mapping table and set-based statements.
+    A score whose new hash already has a row is merged into it: the higher score wins and the best crown is kept.
+    Runs inside the transaction of the given connection and returns how many scores were renamed or merged.
+    Use it whenever the hashing scheme changes and stored scores have to follow."""
+    con.execute('CREATE TEMP TABLE hash_remap (old_hash TEXT PRIMARY KEY, new_hash TEXT NOT NULL)')
+    try:
+        con.executemany('INSERT OR REPLACE INTO hash_remap (old_hash, new_hash) VALUES (?, ?)', remap)
+        con.execute('DELETE FROM hash_remap WHERE old_hash = new_hash')
+        count = con.execute('SELECT COUNT(*) FROM scores JOIN hash_remap ON scores.hash = hash_remap.old_hash').fetchone()[0]
+        # A better crown under the old hash carries over even when its score is lower
+        con.execute("""
+            UPDATE scores SET clear = old.clear
+            FROM hash_remap JOIN scores AS old ON old.hash = hash_remap.old_hash
+            WHERE scores.hash = hash_remap.new_hash AND old.clear > COALESCE(scores.clear, 0)
+        """)
+        # WHERE true lets SQLite tell the upsert clause apart from a join constraint
+        con.execute("""
+            INSERT INTO scores (hash, en_name, jp_name, diff, score, good, ok, bad, drumroll, combo, clear)
+            SELECT hash_remap.new_hash, old.en_name, old.jp_name, old.diff, old.score, old.good, old.ok,
+                   old.bad, old.drumroll, old.combo, old.clear
+            FROM hash_remap JOIN scores AS old ON old.hash = hash_remap.old_hash
+            WHERE true
+            ON CONFLICT (hash) DO UPDATE SET
+                en_name = excluded.en_name, jp_name = excluded.jp_name, diff = excluded.diff,
+                score = excluded.score, good = excluded.good, ok = excluded.ok, bad = excluded.bad,
+                drumroll = excluded.drumroll, combo = excluded.combo,
+                clear = MAX(COALESCE(excluded.clear, 0), COALESCE(scores.clear, 0))
+            WHERE excluded.score > scores.score
+        """)
+        con.execute("""
+            DELETE FROM scores
+            WHERE hash IN (SELECT old_hash FROM hash_remap) AND hash NOT IN (SELECT new_hash FROM hash_remap)
+        """)
+        return count
+    finally:
+        con.execute('DROP TABLE temp.hash_remap')
+
+def migrate_score_hashes(hash_migration: dict[str, str]):
+    """Rewrite score hashes from an older hash version to their current value."""
+    if not hash_migration or not global_data.score_db or not Path(global_data.score_db).exists():
+        return
+    with sqlite3.connect(global_data.score_db) as con:
+        count = remap_score_hashes(con, resolve_hash_migration(hash_migration).items())
+        logger.info(f"Migrated {count} score hashes to hash version {HASH_VERSION}")
+
+def get_tracked_files(root: Path) -> set[Path]:
+    """Get the files under a folder that are tracked by git, or an empty set outside of a git checkout."""
+    try:
+        result = subprocess.run(['git', 'ls-files', '-z'], cwd=root, capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return set()
+    return {(root / name).resolve() for name in result.stdout.decode('utf-8', errors='replace').split('\0') if name}
+
+def migrate_song_list_hashes(roots: Iterable[Path | str], hash_migration: dict[str, str]):
+    """Rewrite the song hashes of every song_list.txt and dan.json under the song folders to their current value.
+    Files shipped with PyTaiko are kept up to date in the repository and left alone."""
+    remap = resolve_hash_migration(hash_migration)
+    if not remap:
+        return
+    for root in roots:
+        root = Path(root)
+        if not root.exists():
+            continue
+        shipped = get_tracked_files(root)
+        for song_list_path in root.rglob('song_list.txt'):
+            if song_list_path.resolve() in shipped:
+                continue
+            try:
+                with open(song_list_path, 'r', encoding='utf-8-sig') as f:
+                    lines = f.read().splitlines()
+                updated_lines = []
+                for line in lines:
+                    hash_val, separator, rest = line.partition('|')
+                    updated_lines.append(remap.get(hash_val, hash_val) + separator + rest)
+                if updated_lines != lines:
+                    with open(song_list_path, 'w', encoding='utf-8-sig') as f:
+                        f.writelines(line + '\n' for line in updated_lines)
+                    logger.info(f"Migrated the song hashes of {song_list_path}")
+            except OSError as e:
+                logger.error(f"Could not migrate the song hashes of {song_list_path}: {e}")
+        for dan_path in root.rglob('dan.json'):
+            if dan_path.resolve() in shipped:
+                continue
+            try:
+                with open(dan_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                updated = False
+                for chart in data.get("charts", []):
+                    if chart.get("hash") in remap:
+                        chart["hash"] = remap[chart["hash"]]
+                        updated = True
+                if updated:
+                    with open(dan_path, 'w', encoding='utf-8') as f:
+                        json.dump(data, f, indent=4, ensure_ascii=False)
+                    logger.info(f"Migrated the song hashes of {dan_path}")
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not migrate the song hashes of {dan_path}: {e}")
+
+def relink_scores_by_name(con: sqlite3.Connection, songs: Iterable[tuple[str, str, str, int]]) -> int:
+    """Point scores at the current hash of their song from (hash, en_name, jp_name, diff) rows, matching by name and difficulty.
+    A name that already has a score under one of the given hashes is left alone. Otherwise its best score
+    (highest clear, then highest score) is renamed and any other duplicates are deleted.
+    Runs inside the transaction of the given connection and returns how many scores were renamed."""
+    con.execute('CREATE TEMP TABLE song_names (hash TEXT PRIMARY KEY, en_name TEXT, jp_name TEXT, diff INTEGER)')
+    try:
+        con.executemany('INSERT OR IGNORE INTO song_names (hash, en_name, jp_name, diff) VALUES (?, ?, ?, ?)', songs)
+        # The first hash given for a name wins, MIN(rowid) makes SQLite take the other columns from that row
+        con.execute("""
+            CREATE TEMP TABLE name_remap AS
+            SELECT scores.hash AS old_hash, current.hash AS new_hash,
+                   ROW_NUMBER() OVER (PARTITION BY scores.en_name, scores.jp_name, scores.diff
+                                      ORDER BY scores.clear DESC, scores.score DESC) AS rank
+            FROM scores
+            JOIN (SELECT hash, en_name, jp_name, diff, MIN(rowid) FROM song_names GROUP BY en_name, jp_name, diff) AS current
+                ON scores.en_name = current.en_name AND scores.jp_name = current.jp_name AND scores.diff = current.diff
+            WHERE (scores.en_name, scores.jp_name, scores.diff) NOT IN (
+                SELECT linked.en_name, linked.jp_name, linked.diff
+                FROM scores AS linked JOIN song_names ON linked.hash = song_names.hash
+            )
+        """)
+        cursor = con.execute('DELETE FROM scores WHERE hash IN (SELECT old_hash FROM name_remap WHERE rank > 1)')
+        if cursor.rowcount > 0:
+            logger.info(f"Deleted {cursor.rowcount} duplicate scores, keeping the best score of each song")
+        remap = con.execute('SELECT old_hash, new_hash FROM name_remap WHERE rank = 1').fetchall()
+        return remap_score_hashes(con, remap)
+    finally:
+        con.execute('DROP TABLE IF EXISTS temp.name_remap')
+        con.execute('DROP TABLE temp.song_names')
+
 def read_tjap3_score(input_file: Path):
     """Read a TJAPlayer3 score.ini file and return the scores and clears."""
     score_ini = configparser.ConfigParser()
-    encoding = test_encodings(input_file)
-    score_ini.read(input_file, encoding=encoding)
-    scores = [int(score_ini['HiScore.Drums']['HiScore1']),
-              int(score_ini['HiScore.Drums']['HiScore2']),
-              int(score_ini['HiScore.Drums']['HiScore3']),
-              int(score_ini['HiScore.Drums']['HiScore4']),
-              int(score_ini['HiScore.Drums']['HiScore5'])]
-    clears = [int(score_ini['HiScore.Drums'].get('Clear0', 0)),
-              int(score_ini['HiScore.Drums'].get('Clear1', 0)),
-              int(score_ini['HiScore.Drums'].get('Clear2', 0)),
-              int(score_ini['HiScore.Drums'].get('Clear3', 0)),
-              int(score_ini['HiScore.Drums'].get('Clear4', 0))]
-    if score_ini['HiScore.Drums']['PerfectRange'] != 25:
+    score_ini.read_string(detect_encoding(input_file.read_bytes())[0])
+    hiscore = score_ini['HiScore.Drums']
+    scores = [hiscore.getint(f'HiScore{i}') for i in range(1, 6)]
+    clears = [hiscore.getint(f'Clear{i}', fallback=0) for i in range(5)]
+    # Scores played with other judgement windows than the defaults are not comparable
+    if hiscore.getint('PerfectRange', fallback=25) != 25:
         return [0],[0], None
-    if score_ini['HiScore.Drums']['GoodRange'] != 75:
+    if hiscore.getint('GoodRange', fallback=75) != 75:
         return [0],[0], None
-    if score_ini['HiScore.Drums']['PoorRange'] != 108:
+    if hiscore.getint('PoorRange', fallback=108) != 108:
         return [0],[0], None
-    if score_ini['HiScore.Drums']['Perfect'] != 0:
-        good = score_ini['HiScore.Drums'].get('Perfect', 0)
-        ok = score_ini['HiScore.Drums'].get('Great', 0)
-        bad = score_ini['HiScore.Drums'].get('Miss', 0)
+    if hiscore.getint('Perfect', fallback=0) != 0:
+        good = hiscore.getint('Perfect', fallback=0)
+        ok = hiscore.getint('Great', fallback=0)
+        bad = hiscore.getint('Miss', fallback=0)
         return scores, clears, [good, ok, bad]
     else:
         return scores, clears, None
 
-def build_song_hashes(output_dir=Path("cache")):
-    """Build a dictionary of song hashes and save it to a file."""
+def get_entry_names(entry: dict) -> tuple[str, str]:
+    """Get the English and Japanese title of a song index entry, as stored with its scores."""
+    if isinstance(entry["title"], dict):
+        return entry["title"].get('en', ''), entry["title"].get('ja', '')
+    return str(entry["title"]), ''
+
+def get_tjap3_score_records(score_ini_path: Path, diff_hashes: dict[int, str], en_name: str, jp_name: str) -> list[ScoreRecord]:
+    """Turn the scores of a TJAPlayer3 score.ini file into records for import_tjap3_scores."""
+    imported_scores, imported_clears, _ = read_tjap3_score(score_ini_path)
+    records = []
+    for i in range(len(imported_scores)):
+        if i not in diff_hashes or imported_scores[i] == 0:
+            continue
+        if imported_clears[i] == 2:
+            bads = 0
+            clear = Crown.FC
+        elif imported_clears[i] == 1:
+            bads = None
+            clear = Crown.CLEAR
+        else:
+            bads = None
+            clear = Crown.NONE
+        records.append((diff_hashes[i], en_name, jp_name, i, imported_scores[i], clear, bads))
+    return records
+
+def import_tjap3_scores(records: list[ScoreRecord], db_path: Path):
+    """Write imported scores over one connection and in one transaction.
+    A record only replaces an existing score for the same hash if it is higher."""
+    if not records:
+        return
+    with sqlite3.connect(db_path) as con:
+        cursor = con.cursor()
+        # Replaces the whole row like INSERT OR REPLACE would, but only when the imported score is higher
+        cursor.executemany("""
+            INSERT INTO scores (hash, en_name, jp_name, diff, score, clear, bad)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (hash) DO UPDATE SET
+                en_name = excluded.en_name, jp_name = excluded.jp_name, diff = excluded.diff,
+                score = excluded.score, clear = excluded.clear, bad = excluded.bad,
+                good = NULL, ok = NULL, drumroll = NULL, combo = NULL
+            WHERE excluded.score > scores.score
+        """, records)
+        logger.info(f"Imported {cursor.rowcount} of {len(records)} TJAPlayer3 scores")
+
+def get_song_encoding(path: Path) -> Optional[str]:
+    """Get the encoding remembered in the song index for a TJA file, if any."""
+    if global_data.song_index is None:
+        return None
+    return global_data.song_index.get_encoding(path)
+
+def import_legacy_song_hashes(song_index: SongIndex, legacy_path: Path):
+    """Copy the entries of a song_hashes.json from before the SQLite index into it."""
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        song_hashes: dict[str, list[dict]] = json.load(f, cls=DiffHashesDecoder)
+    for hash_val, entries in song_hashes.items():
+        for entry in entries:
+            song_index.put(hash_val, entry)
+    logger.info(f"Imported {len(song_index)} songs from {legacy_path}")
+
+def hash_tja_file(tja_path: Path, encoding: Optional[str] = None) -> Optional[tuple[str, dict]]:
+    """Parse and hash a single TJA file for the song index.
+    Runs in the indexing worker processes, so it only returns data and never touches global_data.
+    Returns the song hash and its index entry, or None if the file has no notes."""
+    tja = TJAParser(tja_path, encoding=encoding)
+    all_notes = NoteList()
+    diff_hashes = dict()
+
+    for diff, (diff_notes, branch_m, branch_e, branch_n) in tja.all_notes_to_position().items():
+        diff_hashes[diff] = tja.hash_note_data(diff_notes)
+        all_notes.play_notes.extend(diff_notes.play_notes)
+        if branch_m:
+            for branch in branch_m:
+                all_notes.play_notes.extend(branch.play_notes)
+                all_notes.bars.extend(branch.bars)
+        if branch_e:
+            for branch in branch_e:
+                all_notes.play_notes.extend(branch.play_notes)
+                all_notes.bars.extend(branch.bars)
+        if branch_n:
+            for branch in branch_n:
+                all_notes.play_notes.extend(branch.play_notes)
+                all_notes.bars.extend(branch.bars)
+        all_notes.bars.extend(diff_notes.bars)
+
+    if all_notes == NoteList():
+        return None
+
+    return tja.hash_note_data(all_notes), {
+        "file_path": str(tja_path),
+        "last_modified": tja_path.stat().st_mtime,
+        "title": tja.metadata.title,
+        "subtitle": tja.metadata.subtitle,
+        "genre": tja.metadata.genre,
+        "diff_hashes": diff_hashes,
+        "levels": {diff: course.level for diff, course in tja.metadata.course_data.items()},
+        "encoding": tja.encoding
+    }
+
+def _end_phase(stats: IndexStats, phase: str, phase_start: float) -> float:
+    """Record the time since phase_start for a phase of build_song_hashes and return the start of the next one."""
+    now = time.perf_counter()
+    stats.phase_seconds[phase] = now - phase_start
+    return now
+
+def get_index_workers() -> int:
+    """Get the number of processes used to index the song library, defaulting to the core count."""
+    workers = get_config()["general"].get("index_workers", 0)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+def build_song_hashes(output_dir=Path("cache"), song_index: Optional[SongIndex] = None, stats: Optional[IndexStats] = None) -> SongIndex:
+    """Bring the song index up to date with the song folders and return it.
+    An already open song index can be passed in to update it in place, and stats filled in with counts and timings."""
+    if stats is None:
+        stats = IndexStats()
+    phase_start = time.perf_counter()
     if not output_dir.exists():
         output_dir.mkdir()
-    song_hashes: dict[str, list[dict]] = dict()
-    path_to_hash: dict[str, str] = dict()  # New index for O(1) path lookups
-    output_path = Path(output_dir / "song_hashes.json")
-    index_path = Path(output_dir / "path_to_hash.json")
+    if song_index is None:
+        song_index = SongIndex(output_dir / "song_index.db")
+    legacy_path = Path(output_dir / "song_hashes.json")
+    migration_path = Path(output_dir / "hash_migration.json")
     # Prepare database connection for updates
-    db_path = Path("scores.db")
+    db_path = Path(global_data.score_db)
+    db_exists = bool(global_data.score_db) and db_path.exists()
     db_updates = []  # Store updates to batch process later
 
-    # Load existing data
-    if output_path.exists():
-        with open(output_path, "r", encoding="utf-8") as f:
-            song_hashes = json.load(f, cls=DiffHashesDecoder)
-            if get_db_version() != DB_VERSION:
-                update_db_version()
-                for hash in song_hashes:
-                    entry = song_hashes[hash][0]
-                    for diff in entry["diff_hashes"]:
-                        db_updates.append((entry["diff_hashes"][diff], entry["title"]["en"], entry["title"].get("ja", ""), int(diff)))
-
-    if index_path.exists():
-        with open(index_path, "r", encoding="utf-8") as f:
-            path_to_hash = json.load(f)
-
-    saved_timestamp = 0.0
-    current_timestamp = time.time()
-    if (output_dir / 'timestamp.txt').exists():
-        with open(output_dir / 'timestamp.txt', 'r') as f:
-            saved_timestamp = float(f.read())
-
-    tja_paths = get_config()["paths"]["tja_path"]
-    all_tja_files: list[Path] = []
-    for root_dir in tja_paths:
-        root_path = Path(root_dir)
-        found_tja_files = root_path.rglob("*.tja", recurse_symlinks=True)
-        all_tja_files.extend(found_tja_files)
+    saved_hash_version = 1
+    if (output_dir / 'hash_version.txt').exists():
+        with open(output_dir / 'hash_version.txt', 'r') as f:
+            saved_hash_version = int(f.read())
+    hash_migration = load_hash_migration(migration_path)
+    migrate_scores = False
 
-    global_data.total_songs = len(all_tja_files)
-    files_to_process = []
+    rescan_all = False
+    if song_index.created:
+        if legacy_path.exists():
+            import_legacy_song_hashes(song_index, legacy_path)
+        # The old index has no genres or levels and a new one is empty, parse everything once
+        rescan_all = True
 
-    for tja_path in all_tja_files:
-        tja_path_str = str(tja_path)
-        current_modified = tja_path.stat().st_mtime
-        if current_modified <= saved_timestamp:
-            current_hash = path_to_hash.get(tja_path_str)
-            if current_hash is not None:
-                global_data.song_paths[tja_path] = current_hash
-                continue
+    # Load existing data
+    if len(song_index) and get_db_version() != DB_VERSION:
+        update_db_version()
+        migrate_scores = True
+        for hash_val, entry in song_index.all_entries():
+            for diff in entry["diff_hashes"]:
+                db_updates.append((entry["diff_hashes"][diff], entry["title"]["en"], entry["title"].get("ja", ""), int(diff)))
+
+    if saved_hash_version != HASH_VERSION:
+        # Every stored hash is stale, rehash all songs and remember what they used to be
+        logger.info(f"Hash version changed from {saved_hash_version} to {HASH_VERSION}, rehashing all songs")
+        rescan_all = True
+        migrate_scores = True
+
+    found_score_files: dict[str, int] = dict()
+    found_files = scan_tja_files(get_config()["paths"]["tja_path"], found_score_files)
+    manifest = song_index.manifest()
+    path_to_hash = song_index.paths()
+    deleted_paths = (manifest.keys() | path_to_hash.keys()) - found_files.keys()
+    for deleted_path in deleted_paths:
+        song_index.remove(deleted_path)
+    if deleted_paths:
+        logger.info(f"Removed {len(deleted_paths)} deleted songs from the song index")
+
+    global_data.total_songs = len(found_files)
+    files_to_process: list[Path] = []
+    known_encodings: dict[str, str] = dict()
+    old_hashes: dict[str, tuple[str, dict[int, str]]] = dict()
+
+    for tja_path_str in sorted(found_files):
+        if not rescan_all and manifest.get(tja_path_str) == found_files[tja_path_str]:
+            continue
+        files_to_process.append(Path(tja_path_str))
         current_hash = path_to_hash.get(tja_path_str)
-        if current_hash is None:
-            files_to_process.append(tja_path)
-        else:
-            files_to_process.append(tja_path)
-            if current_hash in song_hashes:
-                del song_hashes[current_hash]
-            del path_to_hash[tja_path_str]
+        if current_hash is not None:
+            entry = song_index.get_entry(tja_path_str)
+            if entry is None:
+                continue
+            if entry["encoding"] is not None:
+                known_encodings[tja_path_str] = entry["encoding"]
+            if saved_hash_version != HASH_VERSION:
+                old_hashes[tja_path_str] = (current_hash, entry["diff_hashes"])
 
     song_count = 0
     total_songs = len(files_to_process)
     if total_songs > 0:
         global_data.total_songs = total_songs
-
-    for tja_path in files_to_process:
-        try:
-            tja_path_str = str(tja_path)
-            current_modified = tja_path.stat().st_mtime
-            tja = TJAParser(tja_path)
-            all_notes = NoteList()
-            diff_hashes = dict()
-
-            for diff in tja.metadata.course_data:
-                diff_notes, branch_m, branch_e, branch_n = TJAParser.notes_to_position(TJAParser(tja.file_path), diff)
-                diff_hashes[diff] = tja.hash_note_data(diff_notes)
-                all_notes.play_notes.extend(diff_notes.play_notes)
-                if branch_m:
-                    for branch in branch_m:
-                        all_notes.play_notes.extend(branch.play_notes)
-                        all_notes.bars.extend(branch.bars)
-                if branch_e:
-                    for branch in branch_e:
-                        all_notes.play_notes.extend(branch.play_notes)
-                        all_notes.bars.extend(branch.bars)
-                if branch_n:
-                    for branch in branch_n:
-                        all_notes.play_notes.extend(branch.play_notes)
-                        all_notes.bars.extend(branch.bars)
-                all_notes.bars.extend(diff_notes.bars)
-        except Exception as e:
-            logger.error(f"Failed to parse TJA {tja_path}: {e}")
-            continue
-
-        if all_notes == NoteList():
+    stats.files_found = len(found_files)
+    stats.files_parsed = total_songs
+    phase_start = _end_phase(stats, "scan", phase_start)
+
+    results = []
+    if files_to_process:
+        # Parsing is pure CPU work, so spread it over processes and merge the results here in order.
+        # The workers are spawned, forking a process that already runs GL and audio threads can deadlock
+        with ProcessPoolExecutor(max_workers=min(get_index_workers(), total_songs),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(hash_tja_file, tja_path, known_encodings.get(str(tja_path)))
+                       for tja_path in files_to_process]
+            for tja_path, future in zip(files_to_process, futures):
+                try:
+                    results.append((tja_path, future.result()))
+                except Exception as e:
+                    logger.error(f"Failed to parse TJA {tja_path}: {e}")
+                    results.append((tja_path, None))
+                song_count += 1
+                global_data.song_progress = song_count / total_songs
+    phase_start = _end_phase(stats, "parse", phase_start)
+
+    for tja_path, result in results:
+        tja_path_str = str(tja_path)
+        if result is None:
+            song_index.remove(tja_path_str, found_files[tja_path_str])
             continue
+        hash_val, entry = result
+        diff_hashes = entry["diff_hashes"]
+        song_index.put(hash_val, entry, found_files[tja_path_str])
 
-        hash_val = tja.hash_note_data(all_notes)
-        if hash_val not in song_hashes:
-            song_hashes[hash_val] = []
-
-        song_hashes[hash_val].append({
-            "file_path": tja_path_str,
-            "last_modified": current_modified,
-            "title": tja.metadata.title,
-            "subtitle": tja.metadata.subtitle,
-            "diff_hashes": diff_hashes
-        })
-
-        # Update both indexes
-        path_to_hash[tja_path_str] = hash_val
-        global_data.song_paths[tja_path] = hash_val
+        if tja_path_str in old_hashes:
+            old_hash, old_diff_hashes = old_hashes[tja_path_str]
+            hash_migration[old_hash] = hash_val
+            for diff, diff_hash in diff_hashes.items():
+                if diff in old_diff_hashes:
+                    hash_migration[old_diff_hashes[diff]] = diff_hash
 
         # Prepare database updates for each difficulty
-        en_name = tja.metadata.title.get('en', '') if isinstance(tja.metadata.title, dict) else str(tja.metadata.title)
-        jp_name = tja.metadata.title.get('ja', '') if isinstance(tja.metadata.title, dict) else ''
-
-        score_ini_path = tja_path.with_suffix('.tja.score.ini')
-        if score_ini_path.exists():
-            imported_scores, imported_clears, _ = read_tjap3_score(score_ini_path)
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            for i in range(len(imported_scores)):
-                if i not in diff_hashes or imported_scores[i] == 0:
-                    continue
-                cursor.execute("SELECT score FROM scores WHERE hash = ?", (diff_hashes[i],))
-                existing_record = cursor.fetchone()
-                if existing_record and existing_record[0] >= imported_scores[i]:
-                    continue
-                if imported_clears[i] == 2:
-                    bads = 0
-                    clear = Crown.FC
-                elif imported_clears[i] == 1:
-                    bads = None
-                    clear = Crown.CLEAR
-                else:
-                    bads = None
-                    clear = Crown.NONE
-                cursor.execute("""
-                    INSERT OR REPLACE INTO scores (hash, en_name, jp_name, diff, score, clear, bad)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (diff_hashes[i], en_name, jp_name, i, imported_scores[i], clear, bads))
-                if cursor.rowcount > 0:
-                    action = "Added" if not existing_record else "Updated"
-                    logger.info(f"{action} entry for {en_name} ({i}) - Score: {imported_scores[i]}")
-            conn.commit()
-            conn.close()
-
+        en_name, jp_name = get_entry_names(entry)
         for diff, diff_hash in diff_hashes.items():
             db_updates.append((diff_hash, en_name, jp_name, diff))
+    phase_start = _end_phase(stats, "index", phase_start)
+
+    # TJAPlayer3 score.ini files that are new or changed since their last import, whether or not their song changed.
+    # Their scores are written to scores.db in one go
+    imported_score_files = song_index.imported_score_files()
+    new_score_files: dict[str, int] = dict()
+    score_records: list[ScoreRecord] = []
+    for score_ini_path, score_ini_mtime in sorted(found_score_files.items()):
+        if imported_score_files.get(score_ini_path) == score_ini_mtime:
+            continue
+        # A score.ini without an indexed song is retried once the song can be indexed
+        entry = song_index.get_entry(score_ini_path.removesuffix('.score.ini'))
+        if entry is None:
+            continue
+        en_name, jp_name = get_entry_names(entry)
+        try:
+            score_records.extend(get_tjap3_score_records(Path(score_ini_path), entry["diff_hashes"], en_name, jp_name))
+        except Exception as e:
+            # Left unstamped, so it is read again on the next scan
+            logger.warning(f"Could not read TJAPlayer3 scores from {score_ini_path}: {e}")
+            continue
+        new_score_files[score_ini_path] = score_ini_mtime
+
+    if new_score_files:
+        if db_exists:
+            try:
+                import_tjap3_scores(score_records, db_path)
+                song_index.mark_scores_imported(new_score_files)
+            except sqlite3.Error as e:
+                logger.error(f"Database error: {e}")
+        else:
+            logger.warning(f"Warning: {global_data.score_db or 'scores.db'} not found, skipping the scores of {len(new_score_files)} score.ini files")
+    stats.score_files = len(new_score_files)
+    phase_start = _end_phase(stats, "score import", phase_start)
 
-        song_count += 1
-        global_data.song_progress = song_count / total_songs
+    if migrate_scores:
+        try:
+            migrate_score_hashes(hash_migration)
+        except sqlite3.Error as e:
+            logger.error(f"Database error: {e}")
+    if saved_hash_version != HASH_VERSION:
+        migrate_song_list_hashes(get_config()["paths"]["tja_path"], hash_migration)
 
     # Update database with new difficulty hashes
-    if db_updates and db_path.exists():
-        total_updates = 0
+    if db_updates and db_exists:
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            seen_hashes = set()
-
-            for diff_hash, en_name, jp_name, diff in db_updates:
-                if diff_hash not in seen_hashes:
-                    seen_hashes.add(diff_hash)
-                else:
-                    continue
-
-                # Find all entries that match by name and difficulty
-                cursor.execute("""
-                    SELECT hash, clear, score
-                    FROM scores
-                    WHERE (en_name = ? AND jp_name = ?) AND diff = ?
-                    ORDER BY clear DESC, score DESC
-                """, (en_name, jp_name, diff))
-
-                entries = cursor.fetchall()
-                if any(entry[0] == diff_hash for entry in entries):
-                    continue
-
-                if len(entries) > 1:
-                    # Keep the first entry (highest clear/score), delete the rest
-                    keep_hash = entries[0][0]
-                    keep_crown = entries[0][1]
-                    keep_score = entries[0][2]
-
-                    delete_entries = entries[1:]
-
-                    logger.info(f"Found {len(entries)} duplicate entries for {en_name} ({diff}). Keeping entry with crown={keep_crown}, score={keep_score}, deleting {len(delete_entries)} duplicates.")
-
-                    for entry in delete_entries:
-                        cursor.execute("""
-                            DELETE FROM scores
-                            WHERE (en_name = ? AND jp_name = ?) AND diff = ? AND hash = ?
-                        """, (en_name, jp_name, diff, entry[0]))
-
-                    cursor.execute("""
-                        UPDATE scores
-                        SET hash = ?
-                        WHERE (en_name = ? AND jp_name = ?) AND diff = ? AND hash = ?
-                    """, (diff_hash, en_name, jp_name, diff, keep_hash))
-                    total_updates += 1
-                    logger.info(f"Deleted {len(delete_entries)} duplicate entries and updated hash for {en_name} ({diff})")
-                else:
-                    cursor.execute("""
-                        UPDATE scores
-                        SET hash = ?
-                        WHERE (en_name = ? AND jp_name = ?) AND diff = ?
-                    """, (diff_hash, en_name, jp_name, diff))
-
-                    if cursor.rowcount > 0:
-                        total_updates += 1
-                        logger.info(f"Updated hash for {en_name} ({diff})")
-
-                conn.commit()
-
-            conn.close()
+            with sqlite3.connect(db_path) as con:
+                total_updates = relink_scores_by_name(con, db_updates)
             logger.info(f"Database update completed. Processed {total_updates} difficulty hash updates.")
-
         except sqlite3.Error as e:
             logger.error(f"Database error: {e}")
         except Exception as e:
             logger.error(f"Error updating database: {e}")
     elif db_updates:
-        logger.warning(f"Warning: scores.db not found, skipping {len(db_updates)} database updates")
-
-    # Save both files
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(song_hashes, f, indent=2, ensure_ascii=False)
-    with open(index_path, "w", encoding="utf-8") as f:
-        json.dump(path_to_hash, f, indent=2, ensure_ascii=False)
-    with open(output_dir / 'timestamp.txt', 'w') as f:
-        f.write(str(current_timestamp))
-
-    return song_hashes
+        logger.warning(f"Warning: {global_data.score_db or 'scores.db'} not found, skipping {len(db_updates)} database updates")
+    _end_phase(stats, "score relink", phase_start)
+
+    if old_hashes:
+        with open(migration_path, "w", encoding="utf-8") as f:
+            json.dump(hash_migration, f, indent=2)
+    with open(output_dir / 'hash_version.txt', 'w') as f:
+        f.write(str(HASH_VERSION))
+
+    return song_index
+
+def update_song_index(song_index: SongIndex) -> set[str]:
+    """Reindex only the TJA files that were added, changed or removed since the song index was last updated.
+    The files are parsed one at a time in the calling thread, and the scores database is left alone,
+    so it can run from a background thread while the game plays. Returns the paths whose entry changed."""
+    found_files = scan_tja_files(get_config()["paths"]["tja_path"])
+    manifest = song_index.manifest()
+    deleted_paths = (manifest.keys() | song_index.paths().keys()) - found_files.keys()
+    for deleted_path in deleted_paths:
+        song_index.remove(deleted_path)
+    changed_paths = set(deleted_paths)
+
+    for tja_path_str in sorted(found_files):
+        if manifest.get(tja_path_str) == found_files[tja_path_str]:
+            continue
+        changed_paths.add(tja_path_str)
+        try:
+            result = hash_tja_file(Path(tja_path_str), song_index.get_encoding(tja_path_str))
+        except Exception as e:
+            logger.error(f"Failed to parse TJA {tja_path_str}: {e}")
+            result = None
+        if result is None:
+            song_index.remove(tja_path_str, found_files[tja_path_str])
+        else:
+            song_index.put(*result, found_files[tja_path_str])
+    return changed_paths
 
 def process_tja_file(tja_file):
     """Process a single TJA file and return hash or None if error"""
     tja = TJAParser(tja_file)
     all_notes = NoteList()
-    for diff in tja.metadata.course_data:
-        notes, branch_m, branch_e, branch_n = TJAParser.notes_to_position(TJAParser(tja.file_path), diff)
+    for notes, branch_m, branch_e, branch_n in tja.all_notes_to_position().values():
         all_notes.play_notes.extend(notes.play_notes)
         if branch_m:
             for branch in branch_m:
@@ -0,0 +1,364 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the tables change, an index of an older version is rebuilt from scratch
+SONG_INDEX_VERSION = 5
+SONG_INDEX_PATH = Path('cache/song_index.db')
+
+# A near title match needs at least this share of trigrams in common with the searched title
+SIMILAR_TITLE_THRESHOLD = 0.5
+
+# Size, mtime_ns and inode of a TJA file, if any of them changes the file is parsed again
+FileStat = tuple[int, int, int]
+
+def scan_tja_files(roots: Iterable[Path | str], score_files: Optional[dict[str, int]] = None) -> dict[str, FileStat]:
+    """Find every TJA file under the given folders with a single os.scandir walk, following symlinks.
+    Returns the FileStat of every file, keyed by the same path string Path would give.
+    If score_files is given, the mtime_ns of every TJAPlayer3 .tja.score.ini file found on the way is added to it."""
+    found: dict[str, FileStat] = dict()
+    visited: set[tuple[int, int]] = set()
+    stack = [str(Path(root)) for root in roots]
+    while stack:
+        directory = stack.pop()
+        try:
+            dir_stat = os.stat(directory)
+            # Symlinked folders can loop back on themselves
+            if (dir_stat.st_dev, dir_stat.st_ino) in visited:
+                continue
+            visited.add((dir_stat.st_dev, dir_stat.st_ino))
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif entry.name.endswith('.tja') and entry.is_file():
+                        stat = entry.stat()
+                        found[entry.path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                    elif score_files is not None and entry.name.endswith('.tja.score.ini') and entry.is_file():
+                        score_files[entry.path] = entry.stat().st_mtime_ns
+        except OSError as e:
+            logger.warning(f"Could not scan {directory}: {e}")
+    return found
+
+def normalize_title(text: str) -> str:
+    """Fold case, full and half width characters and whitespace so differently typed titles compare equal."""
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+def title_trigrams(title_key: str) -> set[str]:
+    """Get the trigrams of a normalized title, padded so short titles still have some."""
+    padded = f"  {title_key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SongIndex:
+    """SQLite index of every TJA file in the song folders, keyed by path and by hash.
+    Entries are returned as dicts with file_path, last_modified, title, subtitle, genre, encoding, diff_hashes and levels.
+    The connection is shared between the loading threads and the main thread, every access holds the lock."""
+    def __init__(self, path: Path | str = SONG_INDEX_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        if path != ':memory:':
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.row_factory = sqlite3.Row
+        self.con.execute('PRAGMA journal_mode = WAL')
+        self.con.execute('PRAGMA synchronous = NORMAL')
+        self.created = False
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.lock, self.con:
+            version = self.con.execute('PRAGMA user_version').fetchone()[0]
+            if version == SONG_INDEX_VERSION:
+                return
+            if version != 0:
+                logger.info(f"Song index version changed from {version} to {SONG_INDEX_VERSION}, rebuilding it")
+            self.con.execute('DROP TABLE IF EXISTS meta')
+            self.con.execute('DROP TABLE IF EXISTS font_codepoints')
+            self.con.execute('DROP TABLE IF EXISTS title_trigrams')
+            self.con.execute('DROP TABLE IF EXISTS score_imports')
+            self.con.execute('DROP TABLE IF EXISTS files')
+            self.con.execute('DROP TABLE IF EXISTS courses')
+            self.con.execute('DROP TABLE IF EXISTS songs')
+            self.con.execute('''
+                CREATE TABLE songs (
+                    path TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    subtitle TEXT NOT NULL,
+                    titles TEXT NOT NULL,
+                    subtitles TEXT NOT NULL,
+                    title_key TEXT NOT NULL,
+                    subtitle_key TEXT NOT NULL,
+                    trigram_count INTEGER NOT NULL,
+                    genre TEXT NOT NULL,
+                    encoding TEXT,
+                    last_modified REAL NOT NULL
+                )
+            ''')
+            self.con.execute('CREATE INDEX songs_hash ON songs (hash)')
+            self.con.execute('CREATE INDEX songs_title_key ON songs (title_key, subtitle_key)')
+            self.con.execute('CREATE INDEX songs_genre ON songs (genre)')
+            self.con.execute('''
+                CREATE TABLE courses (
+                    path TEXT NOT NULL,
+                    diff INTEGER NOT NULL,
+                    hash TEXT NOT NULL,
+                    level INTEGER NOT NULL,
+                    PRIMARY KEY (path, diff)
+                )
+            ''')
+            self.con.execute('CREATE INDEX courses_hash ON courses (hash)')
+            self.con.execute('CREATE INDEX courses_level ON courses (diff, level)')
+            # Every scanned TJA file, including the ones that failed to parse and have no song
+            self.con.execute('''
+                CREATE TABLE files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL
+                )
+            ''')
+            # Trigrams of every normalized English title, for finding songs whose title was typed a little differently
+            self.con.execute('''
+                CREATE TABLE title_trigrams (
+                    trigram TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    PRIMARY KEY (trigram, path)
+                ) WITHOUT ROWID
+            ''')
+            self.con.execute('CREATE INDEX title_trigrams_path ON title_trigrams (path)')
+            # TJAPlayer3 score.ini files whose scores were copied into the scores database, by mtime_ns
+            self.con.execute('''
+                CREATE TABLE score_imports (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL
+                )
+            ''')
+            # Every character the font has to contain, from song titles and any other text drawn so far.
+            # Characters of removed songs are kept, a few unused glyphs are cheaper than rebuilding the font atlas
+            self.con.execute('''
+                CREATE TABLE font_codepoints (
+                    codepoint TEXT PRIMARY KEY
+                ) WITHOUT ROWID
+            ''')
+            self.con.execute('''
+                CREATE TABLE meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+            self.con.execute(f'PRAGMA user_version = {SONG_INDEX_VERSION}')
+            self.created = True
+
+    def close(self):
+        with self.lock:
+            self.con.close()
+
+    def put(self, hash_val: str, entry: dict, file_stat: Optional[FileStat] = None):
+        """Add or replace the entry of one TJA file in a single transaction, along with the stat it was parsed at."""
+        levels = entry.get("levels", dict())
+        title = entry["title"].get("en", "").strip()
+        subtitle = entry["subtitle"].get("en", "").strip()
+        title_key = normalize_title(title)
+        trigrams = title_trigrams(title_key)
+        with self.lock, self.con:
+            if file_stat is not None:
+                self.con.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, inode) VALUES (?, ?, ?, ?)',
+                                 (entry["file_path"], *file_stat))
+            self.con.execute('DELETE FROM courses WHERE path = ?', (entry["file_path"],))
+            self.con.execute('DELETE FROM title_trigrams WHERE path = ?', (entry["file_path"],))
+            self.con.execute('''
+                INSERT OR REPLACE INTO songs (path, hash, title, subtitle, titles, subtitles, title_key, subtitle_key,
+                                              trigram_count, genre, encoding, last_modified)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (entry["file_path"], hash_val, title, subtitle,
+                  json.dumps(entry["title"], ensure_ascii=False), json.dumps(entry["subtitle"], ensure_ascii=False),
+                  title_key, normalize_title(subtitle), len(trigrams),
+                  entry.get("genre", ""), entry.get("encoding"), entry["last_modified"]))
+            self.con.executemany('INSERT INTO title_trigrams (trigram, path) VALUES (?, ?)',
+                                 [(trigram, entry["file_path"]) for trigram in trigrams])
+            self._add_codepoints(''.join((*entry["title"].values(), *entry["subtitle"].values())))
+            self.con.executemany('INSERT INTO courses (path, diff, hash, level) VALUES (?, ?, ?, ?)',
+                                 [(entry["file_path"], int(diff), diff_hash, levels.get(diff, 0))
+                                  for diff, diff_hash in entry["diff_hashes"].items()])
+
+    def remove(self, path: Path | str, file_stat: Optional[FileStat] = None):
+        """Remove the entry of one TJA file in a single transaction.
+        With a stat the file is remembered as having no song until it changes, without one it is forgotten."""
+        with self.lock, self.con:
+            self.con.execute('DELETE FROM courses WHERE path = ?', (str(path),))
+            self.con.execute('DELETE FROM title_trigrams WHERE path = ?', (str(path),))
+            self.con.execute('DELETE FROM songs WHERE path = ?', (str(path),))
+            if file_stat is not None:
+                self.con.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, inode) VALUES (?, ?, ?, ?)',
+                                 (str(path), *file_stat))
+            else:
+                self.con.execute('DELETE FROM files WHERE path = ?', (str(path),))
+
+    def manifest(self) -> dict[str, FileStat]:
+        """Get the stat every scanned TJA file had when it was last parsed."""
+        with self.lock:
+            return {row["path"]: (row["size"], row["mtime_ns"], row["inode"])
+                    for row in self.con.execute('SELECT path, size, mtime_ns, inode FROM files')}
+
+    def imported_score_files(self) -> dict[str, int]:
+        """Get the mtime_ns every score.ini file had when its scores were imported."""
+        with self.lock:
+            return {row["path"]: row["mtime_ns"] for row in self.con.execute('SELECT path, mtime_ns FROM score_imports')}
+
+    def mark_scores_imported(self, score_files: dict[str, int]):
+        """Remember score.ini files as imported at the given mtime_ns, so they are not read again until they change."""
+        with self.lock, self.con:
+            self.con.executemany('INSERT OR REPLACE INTO score_imports (path, mtime_ns) VALUES (?, ?)', score_files.items())
+
+    def _entries(self, rows: Iterable[sqlite3.Row], courses: Optional[dict[str, list[sqlite3.Row]]] = None) -> list[dict]:
+        entries = []
+        for row in rows:
+            diff_hashes = dict()
+            levels = dict()
+            if courses is not None:
+                path_courses = courses.get(row["path"], [])
+            else:
+                path_courses = self.con.execute('SELECT diff, hash, level FROM courses WHERE path = ? ORDER BY diff', (row["path"],))
+            for course in path_courses:
+                diff_hashes[course["diff"]] = course["hash"]
+                levels[course["diff"]] = course["level"]
+            entries.append({
+                "file_path": row["path"],
+                "last_modified": row["last_modified"],
+                "title": json.loads(row["titles"]),
+                "subtitle": json.loads(row["subtitles"]),
+                "genre": row["genre"],
+                "encoding": row["encoding"],
+                "diff_hashes": diff_hashes,
+                "levels": levels,
+            })
+        return entries
+
+    def get_hash(self, path: Path | str) -> Optional[str]:
+        """Get the song hash of a TJA file, or None if it isn't indexed."""
+        with self.lock:
+            row = self.con.execute('SELECT hash FROM songs WHERE path = ?', (str(path),)).fetchone()
+        return row["hash"] if row is not None else None
+
+    def get_entry(self, path: Path | str) -> Optional[dict]:
+        """Get the entry of a TJA file, or None if it isn't indexed."""
+        with self.lock:
+            entries = self._entries(self.con.execute('SELECT * FROM songs WHERE path = ?', (str(path),)))
+        return entries[0] if entries else None
+
+    def get_entries(self, hash_val: str) -> list[dict]:
+        """Get the entries of every TJA file with the given song hash, in path order."""
+        with self.lock:
+            return self._entries(self.con.execute('SELECT * FROM songs WHERE hash = ? ORDER BY path', (hash_val,)))
+
+    def get_diff_hashes(self, hash_val: str) -> dict[int, str]:
+        """Get the hash of every course of a song, by difficulty."""
+        entries = self.get_entries(hash_val)
+        return entries[0]["diff_hashes"] if entries else dict()
+
+    def get_encoding(self, path: Path | str) -> Optional[str]:
+        """Get the encoding a TJA file was parsed with, if it is indexed."""
+        with self.lock:
+            row = self.con.execute('SELECT encoding FROM songs WHERE path = ?', (str(path),)).fetchone()
+        return row["encoding"] if row is not None else None
+
+    def find_by_title(self, title: str, subtitle: str) -> list[tuple[str, dict]]:
+        """Get the hash and entry of every song with the given English title and subtitle, ignoring case, width and spacing."""
+        with self.lock:
+            rows = self.con.execute('SELECT * FROM songs WHERE title_key = ? AND subtitle_key = ? ORDER BY path',
+                                    (normalize_title(title), normalize_title(subtitle))).fetchall()
+            return [(row["hash"], entry) for row, entry in zip(rows, self._entries(rows))]
+
+    def find_similar_titles(self, title: str, subtitle: str, limit: int = 5) -> list[tuple[str, dict]]:
+        """Get the hash and entry of the songs whose English title is closest to the given one by trigram similarity.
+        Songs with the same subtitle come first, songs below SIMILAR_TITLE_THRESHOLD are left out."""
+        trigrams = title_trigrams(normalize_title(title))
+        # A song can't reach the threshold with fewer shared trigrams than this, whatever its own trigram count
+        min_shared = math.ceil(SIMILAR_TITLE_THRESHOLD * len(trigrams))
+        with self.lock:
+            rows = self.con.execute(f'''
+                SELECT songs.path, songs.hash, songs.last_modified, songs.titles, songs.subtitles, songs.genre, songs.encoding,
+                       songs.subtitle_key = ? AS same_subtitle,
+                       CAST(matched.shared AS REAL) / (? + songs.trigram_count - matched.shared) AS similarity
+                FROM (
+                    SELECT path, COUNT(*) AS shared FROM title_trigrams
+                    WHERE trigram IN ({', '.join('?' * len(trigrams))})
+                    GROUP BY path
+                    HAVING shared >= ?
+                ) AS matched JOIN songs ON songs.path = matched.path
+                WHERE similarity >= ?
+                ORDER BY same_subtitle DESC, similarity DESC, songs.path
+                LIMIT ?
+            ''', (normalize_title(subtitle), len(trigrams), *trigrams, min_shared, SIMILAR_TITLE_THRESHOLD, limit)).fetchall()
+            return [(row["hash"], entry) for row, entry in zip(rows, self._entries(rows))]
+
+    def lookup_title(self, title: str, subtitle: str) -> list[tuple[str, dict]]:
+        """Resolve a song by title and subtitle when its hash is stale.
+        Returns the exact matches after folding case and width. Near titles are only logged as suggestions,
+        picking one could swap in a different song."""
+        matches = self.find_by_title(title, subtitle)
+        if not matches:
+            suggestions = [entry["title"].get("en", "") for _, entry in self.find_similar_titles(title, subtitle)]
+            if suggestions:
+                logger.warning(f"No song titled {title} {subtitle}, did you mean: {', '.join(suggestions)}")
+            else:
+                logger.warning(f"No song titled {title} {subtitle}")
+        return matches
+
+    def all_entries(self) -> list[tuple[str, dict]]:
+        """Get the hash and entry of every indexed TJA file, in path order."""
+        with self.lock:
+            courses: dict[str, list[sqlite3.Row]] = dict()
+            for course in self.con.execute('SELECT path, diff, hash, level FROM courses ORDER BY path, diff'):
+                courses.setdefault(course["path"], []).append(course)
+            rows = self.con.execute('SELECT * FROM songs ORDER BY path').fetchall()
+            return [(row["hash"], entry) for row, entry in zip(rows, self._entries(rows, courses))]
+
+    def paths(self) -> dict[str, str]:
+        """Get the hash of every indexed path."""
+        with self.lock:
+            return {row["path"]: row["hash"] for row in self.con.execute('SELECT path, hash FROM songs')}
+
+    def _add_codepoints(self, text: str):
+        cursor = self.con.executemany('INSERT OR IGNORE INTO font_codepoints (codepoint) VALUES (?)', [(character,) for character in set(text)])
+        if cursor.rowcount > 0:
+            self.con.execute("DELETE FROM meta WHERE key = 'font_codepoints_hash'")
+
+    def add_codepoints(self, text: str):
+        """Remember the characters of text drawn outside of song titles, so the next font atlas contains them."""
+        with self.lock, self.con:
+            self._add_codepoints(text)
+
+    def codepoints(self) -> set[str]:
+        """Get every character the font has to contain."""
+        with self.lock:
+            return {row["codepoint"] for row in self.con.execute('SELECT codepoint FROM font_codepoints')}
+
+    def codepoints_hash(self) -> str:
+        """Get the content hash of the characters returned by codepoints, computed again only after they change."""
+        with self.lock, self.con:
+            row = self.con.execute("SELECT value FROM meta WHERE key = 'font_codepoints_hash'").fetchone()
+            if row is not None:
+                return row["value"]
+            codepoints = ''.join(sorted(self.codepoints()))
+            content_hash = hashlib.sha256(codepoints.encode('utf-8', 'surrogatepass')).hexdigest()
+            self.con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('font_codepoints_hash', ?)", (content_hash,))
+            return content_hash
+
+    def __contains__(self, hash_val: str) -> bool:
+        with self.lock:
+            return self.con.execute('SELECT 1 FROM songs WHERE hash = ? LIMIT 1', (hash_val,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.con.execute('SELECT COUNT(*) FROM songs').fetchone()[0]
@@ -0,0 +1,194 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+from pathlib import Path
+from typing import Optional
+
+from libs.song_hash import update_song_index
+from libs.global_data import global_data
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+INOTIFY_EVENT = struct.Struct('iIII')
+
+class Inotify:
+    """Minimal ctypes binding of the Linux inotify API that watches every folder under the song folders."""
+    def __init__(self, roots: list[Path]):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: dict[int, str] = dict()
+        try:
+            for root in roots:
+                self.add_tree(str(root))
+        except Exception:
+            self.close()
+            raise
+
+    def add_tree(self, path: str):
+        """Watch a folder and every folder under it, following symlinks but not their loops."""
+        visited: set[tuple[int, int]] = set()
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            try:
+                dir_stat = os.stat(directory)
+                if (dir_stat.st_dev, dir_stat.st_ino) in visited:
+                    continue
+                visited.add((dir_stat.st_dev, dir_stat.st_ino))
+                wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+                self.watches[wd] = directory
+                with os.scandir(directory) as entries:
+                    stack.extend(entry.path for entry in entries if entry.is_dir())
+            except FileNotFoundError:
+                continue
+
+    def read(self, timeout: float) -> Optional[bool]:
+        """Wait up to timeout seconds for events.
+        Returns None if nothing happened, otherwise whether any of the events can change the song index."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return None
+        data = os.read(self.fd, 64 * 1024)
+        relevant = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0'))
+            offset += INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                relevant = True
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                relevant = True
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.add_tree(path)
+                    except OSError as e:
+                        logger.warning(f"Could not watch {path}, its changes will be picked up with the next event: {e}")
+            elif name.endswith('.tja') or mask & IN_DELETE_SELF:
+                relevant = True
+        return relevant
+
+    def close(self):
+        os.close(self.fd)
+
+class SongWatcher:
+    """Keeps the song index up to date with the song folders while the game runs.
+    Uses inotify on Linux and polls the folders elsewhere or when inotify is unavailable.
+    The paths of added, changed and removed TJA files are picked up by the main thread with pop_changes.
+    While a song is played the watcher is paused, changes made meanwhile are indexed once it resumes."""
+    POLL_INTERVAL = 5.0
+    # Copying a song pack in sends events for every file, wait for the folders to be quiet this long
+    SETTLE_TIME = 1.0
+
+    def __init__(self):
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.resumed = threading.Event()
+        self.resumed.set()
+        self.changes: queue.Queue[set[Path]] = queue.Queue()
+
+    def start(self, roots: list[Path]):
+        """Start watching the given song folders in a background thread."""
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, args=([Path(root) for root in roots],), daemon=True)
+        self.thread.start()
+        logger.info(f"Watching song folders: {roots}")
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join(timeout=self.POLL_INTERVAL)
+        self.thread = None
+
+    def pause(self):
+        """Stop scanning and reindexing the song folders until resume is called."""
+        self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+
+    def pop_changes(self) -> set[Path]:
+        """Get every TJA path that was added, changed or removed since the last call."""
+        changed: set[Path] = set()
+        while not self.changes.empty():
+            changed |= self.changes.get_nowait()
+        return changed
+
+    def _run(self, roots: list[Path]):
+        inotify = None
+        if sys.platform.startswith('linux'):
+            try:
+                inotify = Inotify(roots)
+            except OSError as e:
+                logger.warning(f"Could not watch the song folders with inotify, polling them instead: {e}")
+        try:
+            while not self.stop_event.is_set():
+                if inotify is None:
+                    if self.stop_event.wait(self.POLL_INTERVAL):
+                        break
+                elif not inotify.read(self.POLL_INTERVAL):
+                    continue
+                else:
+                    while inotify.read(self.SETTLE_TIME) is not None and not self.stop_event.is_set():
+                        pass
+                while not self.resumed.is_set():
+                    if self.stop_event.wait(self.SETTLE_TIME):
+                        return
+                self._update_index()
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def _update_index(self):
+        """Reindex the changed TJA files and queue their paths."""
+        song_index = global_data.song_index
+        if song_index is None:
+            return
+        try:
+            changed = update_song_index(song_index)
+        except Exception as e:
+            logger.error(f"Failed to update the song index: {e}")
+            return
+        if changed:
+            logger.info(f"{len(changed)} songs changed in the song folders")
+            # Scores already saved for the courses of new songs aren't in the score map yet
+            course_hashes = []
+            for path in changed:
+                entry = song_index.get_entry(path)
+                if entry is not None:
+                    course_hashes.extend(entry["diff_hashes"].values())
+            global_data.score_repository.load(course_hashes)
+            self.changes.put({Path(path) for path in changed})
+
+song_watcher = SongWatcher()
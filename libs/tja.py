@@ -1,18 +1,46 @@
+import argparse
+import codecs
+import copy
 import hashlib
+import heapq
 import logging
 import math
+import os
+import pickle
 import random
+import re
+import shutil
+import struct
+import sys
+import time
+import tracemalloc
+from array import array
 from collections import deque
 from dataclasses import dataclass, field, fields
 from enum import IntEnum
 from functools import lru_cache
+from itertools import chain
 from pathlib import Path
-from typing import Optional
+from typing import Callable, ClassVar, Iterable, Optional
+
+import numpy as np
 
 from libs.global_data import Modifiers
-from libs.utils import strip_comments
 
 
+def strip_comments(code: str) -> str:
+    """Strip comments from a string of code"""
+    result = ''
+    index = 0
+    for line in code.splitlines():
+        comment_index = line.find('//')
+        if comment_index == -1:
+            result += line
+        elif comment_index != 0 and not line[:comment_index].isspace():
+            result += line[:comment_index]
+        index += 1
+    return result
+
 @lru_cache(maxsize=64)
 def get_ms_per_measure(bpm_val: float, time_sig: float):
     """Calculate the number of milliseconds per measure."""
@@ -62,34 +90,41 @@ class TimelineObject:
         return self.load_ms < other.load_ms
 
 
-@dataclass()
+@dataclass(slots=True, eq=False)
 class Note:
     """A note in a TJA file.
 
     Attributes:
         type (int): The type (color) of the note.
         hit_ms (float): The time at which the note should be hit.
+        load_ms (float): The time at which the note enters the lane, None until computed by the player.
+        unload_ms (float): The time at which the note leaves the lane, None until computed by the player.
         bpm (float): The beats per minute of the note.
         scroll_x (float): The horizontal scroll speed of the note.
         scroll_y (float): The vertical scroll speed of the note.
+        sudden_appear_ms (float): How long before hit_ms the note appears, inf when not set by #SUDDEN.
+        sudden_moving_ms (float): How long before hit_ms the note starts moving, inf when not set by #SUDDEN.
         display (bool): Whether the note should be displayed.
         index (int): The index of the note.
         moji (int): The text drawn below the note.
+        branch_params (str): The branch condition starting at this bar, empty if there is none.
+        is_branch_start (bool): Whether this bar starts a branch.
     """
-    type: int = field(init=False)
-    hit_ms: float = field(init=False)
-    load_ms: float = field(init=False)
-    unload_ms: float = field(init=False)
-    bpm: float = field(init=False)
-    scroll_x: float = field(init=False)
-    scroll_y: float = field(init=False)
-    sudden_appear_ms: float = field(init=False)
-    sudden_moving_ms: float = field(init=False)
-    display: bool = field(init=False)
-    index: int = field(init=False)
-    moji: int = field(init=False)
-    branch_params: str = field(init=False)
-    is_branch_start: bool = field(init=False)
+    HASH_TAG: ClassVar[int] = 0
+    type: int = 0
+    hit_ms: float = 0.0
+    load_ms: Optional[float] = None
+    unload_ms: Optional[float] = None
+    bpm: float = 120.0
+    scroll_x: float = 1.0
+    scroll_y: float = 0.0
+    sudden_appear_ms: float = float('inf')
+    sudden_moving_ms: float = float('inf')
+    display: bool = True
+    index: int = 0
+    moji: int = 0
+    branch_params: str = ''
+    is_branch_start: bool = False
 
     def __lt__(self, other):
         return self.hit_ms < other.hit_ms
@@ -106,91 +141,56 @@ class Note:
     def __eq__(self, other):
         return self.hit_ms == other.hit_ms
 
-    def _get_hash_data(self) -> bytes:
-        hash_fields = ['type', 'hit_ms', 'bpm', 'scroll_x', 'scroll_y']
-        field_values = []
-
-        for field_name in sorted(hash_fields):
-            value = getattr(self, field_name, None)
-            field_values.append((field_name, value))
-
-        field_values.append(('__class__', self.__class__.__name__))
-        hash_string = str(field_values)
-        return hash_string.encode('utf-8')
-
-    def get_hash(self, algorithm='sha256') -> str:
-        """Generate hash of the note"""
-        hash_obj = hashlib.new(algorithm)
-        hash_obj.update(self._get_hash_data())
-        return hash_obj.hexdigest()
+    def get_hash_data(self) -> bytes:
+        """Get the canonical binary form of the note used for chart hashing"""
+        return NOTE_HASH_STRUCT.pack(self.HASH_TAG, self.type, self.hit_ms, self.bpm, self.scroll_x, self.scroll_y)
 
     def __hash__(self) -> int:
-        """Make instances hashable for use in sets/dicts"""
-        return int(self.get_hash('md5')[:8], 16)  # Use first 8 chars of MD5 as int
+        """Hash by hit_ms, the same key notes compare equal by"""
+        return hash(self.hit_ms)
 
-    def __repr__(self):
-        return str(self.__dict__)
+NOTE_FIELDS = tuple(f.name for f in fields(Note))
+# Class tag, type, hit_ms, bpm, scroll_x, scroll_y (and count for balloons), little endian
+NOTE_HASH_STRUCT = struct.Struct('<BBdddd')
+BALLOON_HASH_STRUCT = struct.Struct('<BBddddi')
 
-@dataclass
+@dataclass(slots=True, eq=False)
 class Drumroll(Note):
     """A drumroll note in a TJA file.
 
     Attributes:
-        _source_note (Note): The source note.
         color (int): The color of the drumroll. (0-255 where 255 is red)
     """
-    _source_note: Note
-    color: int = field(init=False)
+    color: int = 255
+    HASH_TAG: ClassVar[int] = 1
 
-    def __repr__(self):
-        return str(self.__dict__)
+    @classmethod
+    def from_note(cls, note: Note, **kwargs) -> 'Drumroll':
+        """Create a drumroll with the fields of the given note."""
+        return cls(**{name: getattr(note, name) for name in NOTE_FIELDS}, **kwargs)
 
-    def __eq__(self, other):
-        return self.hit_ms == other.hit_ms
-
-    def __post_init__(self):
-        for field_name in [f.name for f in fields(Note)]:
-            if hasattr(self._source_note, field_name):
-                setattr(self, field_name, getattr(self._source_note, field_name))
-
-@dataclass
+@dataclass(slots=True, eq=False)
 class Balloon(Note):
     """A balloon note in a TJA file.
 
     Attributes:
-        _source_note (Note): The source note.
         count (int): The number of hits it takes to pop.
         popped (bool): Whether the balloon has been popped.
         is_kusudama (bool): Whether the balloon is a kusudama.
     """
-    _source_note: Note
-    count: int = field(init=False)
+    count: int = 1
     popped: bool = False
     is_kusudama: bool = False
+    HASH_TAG: ClassVar[int] = 2
 
-    def __repr__(self):
-        return str(self.__dict__)
+    @classmethod
+    def from_note(cls, note: Note, **kwargs) -> 'Balloon':
+        """Create a balloon with the fields of the given note."""
+        return cls(**{name: getattr(note, name) for name in NOTE_FIELDS}, **kwargs)
 
-    def __eq__(self, other):
-        return self.hit_ms == other.hit_ms
-
-    def __post_init__(self):
-        for field_name in [f.name for f in fields(Note)]:
-            if hasattr(self._source_note, field_name):
-                setattr(self, field_name, getattr(self._source_note, field_name))
-
-    def _get_hash_data(self) -> bytes:
-        """Override to include source note and balloon-specific data"""
-        hash_fields = ['type', 'hit_ms', 'load_ms', 'count']
-        field_values = []
-
-        for field_name in sorted(hash_fields):
-            value = getattr(self, field_name, None)
-            field_values.append((field_name, value))
-
-        field_values.append(('__class__', self.__class__.__name__))
-        hash_string = str(field_values)
-        return hash_string.encode('utf-8')
+    def get_hash_data(self) -> bytes:
+        """Override to include the number of hits it takes to pop"""
+        return BALLOON_HASH_STRUCT.pack(self.HASH_TAG, self.type, self.hit_ms, self.bpm, self.scroll_x, self.scroll_y, self.count)
 
 @dataclass
 class NoteList:
@@ -218,6 +218,184 @@ class NoteList:
         self.timeline += other.timeline
         return self
 
+def splice_sorted(target: deque, segment: list, key: Callable) -> None:
+    """Merge a sorted segment into a sorted deque in place.
+    Only the items that sort after the start of the segment are touched, ties keep the items already in target first."""
+    if not segment:
+        return
+    start = key(segment[0])
+    tail = []
+    while target and key(target[-1]) > start:
+        tail.append(target.pop())
+    tail.reverse()
+    target.extend(heapq.merge(tail, segment, key=key))
+
+def _note_key(note: Note) -> tuple:
+    """Every field of a note except its load times, which are only known once it is on a lane"""
+    return (type(note), *(getattr(note, f.name) for f in fields(note) if f.name not in ('load_ms', 'unload_ms')))
+
+def first_difference_ms(old: NoteList, new: NoteList) -> Optional[float]:
+    """Find the earliest time at which two parses of the same course differ, or None if they are identical."""
+    first = None
+    for old_items, new_items, key in ((old.play_notes, new.play_notes, _note_key),
+                                      (old.bars, new.bars, _note_key),
+                                      (old.timeline, new.timeline, vars)):
+        for i in range(max(len(old_items), len(new_items))):
+            if i < len(old_items) and i < len(new_items) and key(old_items[i]) == key(new_items[i]):
+                continue
+            diff_ms = min(item.hit_ms for item in [*old_items[i:i+1], *new_items[i:i+1]])
+            first = diff_ms if first is None else min(first, diff_ms)
+            break
+    return first
+
+ROLL_HEAD_TYPES = (NoteType.ROLL_HEAD, NoteType.ROLL_HEAD_L, NoteType.BALLOON_HEAD, NoteType.KUSUDAMA)
+
+@dataclass
+class NoteArrays:
+    """Columnar view of a list of notes backed by NumPy arrays, one per attribute, in the order the notes were given.
+    notes: The note objects themselves, the object view for code that still works per note
+    hit_ms, load_ms, unload_ms: Per note timing, the load times are NaN until compute_load_times runs
+    bpm, scroll_x, scroll_y: Per note scrolling, see pixels_per_ms for the speed on screen
+    sudden_appear_ms, sudden_moving_ms: Per note #SUDDEN times, inf when not set
+    type, index, moji: Per note type, parse index and moji
+    gogo: Whether each note is in go-go time, from the timeline given to from_notes
+    tail: Row of the tail of each drumroll or balloon head, -1 for every other note
+    count: Hit count of each balloon, 0 for every other note
+    end_ms: Running maximum of the time each note stops being relevant, a drumroll or balloon lasting until its tail.
+        With the notes sorted by hit_ms this makes the columns binary searchable, see window"""
+    notes: list[Note | Drumroll | Balloon] = field(default_factory=lambda: [])
+    hit_ms: np.ndarray = field(default_factory=lambda: np.empty(0))
+    load_ms: np.ndarray = field(default_factory=lambda: np.empty(0))
+    unload_ms: np.ndarray = field(default_factory=lambda: np.empty(0))
+    bpm: np.ndarray = field(default_factory=lambda: np.empty(0))
+    scroll_x: np.ndarray = field(default_factory=lambda: np.empty(0))
+    scroll_y: np.ndarray = field(default_factory=lambda: np.empty(0))
+    sudden_appear_ms: np.ndarray = field(default_factory=lambda: np.empty(0))
+    sudden_moving_ms: np.ndarray = field(default_factory=lambda: np.empty(0))
+    type: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int8))
+    index: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int32))
+    moji: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int8))
+    gogo: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.bool_))
+    tail: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    count: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int32))
+    end_ms: np.ndarray = field(default_factory=lambda: np.empty(0))
+
+    @classmethod
+    def from_notes(cls, notes: Iterable[Note | Drumroll | Balloon], timeline: Optional[list[TimelineObject]] = None) -> 'NoteArrays':
+        """Build the columns for the given notes, with go-go time taken from the timeline if one is given."""
+        notes = list(notes)
+        size = len(notes)
+        def column(name: str, dtype, default=None) -> np.ndarray:
+            return np.fromiter((getattr(note, name, default) for note in notes), dtype=dtype, count=size)
+        arrays = cls(notes=notes,
+                     hit_ms=column('hit_ms', np.float64),
+                     load_ms=np.full(size, np.nan),
+                     unload_ms=np.full(size, np.nan),
+                     bpm=column('bpm', np.float64),
+                     scroll_x=column('scroll_x', np.float64),
+                     scroll_y=column('scroll_y', np.float64),
+                     sudden_appear_ms=column('sudden_appear_ms', np.float64),
+                     sudden_moving_ms=column('sudden_moving_ms', np.float64),
+                     type=column('type', np.int8),
+                     index=column('index', np.int32),
+                     moji=column('moji', np.int8),
+                     count=column('count', np.int32, 0),
+                     tail=np.full(size, -1, dtype=np.int64))
+
+        # A head pairs with the first tail after it, unless another head comes first
+        heads = np.flatnonzero(np.isin(arrays.type, ROLL_HEAD_TYPES))
+        tails = np.flatnonzero(arrays.type == NoteType.TAIL)
+        next_tail = np.searchsorted(tails, heads, side='right')
+        has_tail = next_tail < len(tails)
+        next_head = np.append(heads[1:], size)
+        heads, next_tail = heads[has_tail], tails[next_tail[has_tail]]
+        paired = next_tail < next_head[has_tail]
+        arrays.tail[heads[paired]] = next_tail[paired]
+
+        end_ms = arrays.hit_ms.copy()
+        rolls = arrays.tail != -1
+        end_ms[rolls] = np.maximum(end_ms[rolls], arrays.hit_ms[arrays.tail[rolls]])
+        arrays.end_ms = np.maximum.accumulate(end_ms) if size else end_ms
+
+        arrays.gogo = np.zeros(size, dtype=np.bool_)
+        gogo_changes = [(o.hit_ms, o.gogo_time) for o in timeline or [] if hasattr(o, 'gogo_time')]
+        if gogo_changes:
+            change_ms = np.array([hit_ms for hit_ms, _ in gogo_changes])
+            change_gogo = np.array([gogo for _, gogo in gogo_changes], dtype=np.bool_)
+            change = np.searchsorted(change_ms, arrays.hit_ms, side='right') - 1
+            arrays.gogo = np.where(change >= 0, change_gogo[np.maximum(change, 0)], False)
+        return arrays
+
+    def __len__(self) -> int:
+        return len(self.notes)
+
+    def pixels_per_ms(self, travel_distance: float) -> tuple[np.ndarray, np.ndarray]:
+        """Get the horizontal and vertical speed of every note on screen, in pixels per ms."""
+        base = self.bpm / 240000
+        return base * self.scroll_x * travel_distance, base * self.scroll_y * travel_distance
+
+    def compute_load_times(self, travel_distance: float, note_half_w: float, link_tails: bool = False):
+        """Compute when each note enters and leaves the lane for the whole list at once, and store it in the columns and the notes.
+
+        Args:
+            travel_distance (float): The distance in pixels from the right edge of the screen to the judge circle.
+            note_half_w (float): Half the width of a note in pixels.
+            link_tails (bool): Whether tails load with the note before them, which in turn unloads with the tail.
+        """
+        # The same operations in the same order as Player.get_load_time, so the results are identical
+        with np.errstate(divide='ignore', invalid='ignore'):
+            base_pixels_per_ms = self.bpm / 240000 * np.abs(self.scroll_x) * travel_distance
+            base_pixels_per_ms = np.where(base_pixels_per_ms == 0, self.bpm / 240000 * np.abs(self.scroll_y) * travel_distance, base_pixels_per_ms)
+            normal_travel_ms = (travel_distance + note_half_w) / base_pixels_per_ms
+            movement_duration = np.where(self.sudden_moving_ms <= 0, normal_travel_ms, self.sudden_moving_ms)
+            no_sudden = self.sudden_appear_ms == np.inf
+            self.load_ms = np.where(no_sudden, self.hit_ms - normal_travel_ms, self.hit_ms - self.sudden_appear_ms)
+            self.unload_ms = np.where(no_sudden, self.hit_ms + normal_travel_ms,
+                                      self.hit_ms + travel_distance / (travel_distance / movement_duration))
+
+        if link_tails and len(self.notes) > 1:
+            is_tail = self.type == NoteType.TAIL
+            rows = np.flatnonzero(is_tail[1:]) + 1
+            # A run of tails all load with the last note before the run
+            previous_note = np.maximum.accumulate(np.where(is_tail, 0, np.arange(len(self.notes))))
+            self.load_ms[rows] = self.load_ms[previous_note[rows]]
+            self.unload_ms[rows - 1] = self.unload_ms[rows]
+
+        for note, load_ms, unload_ms in zip(self.notes, self.load_ms.tolist(), self.unload_ms.tolist()):
+            note.load_ms = load_ms
+            note.unload_ms = unload_ms
+
+    def sorted_by_load_ms(self) -> list[Note | Drumroll | Balloon]:
+        """Get the notes sorted by load_ms, keeping the original order for ties."""
+        return [self.notes[i] for i in np.argsort(self.load_ms, kind='stable').tolist()]
+
+    def roll_tails(self) -> list[tuple[Note, Note]]:
+        """Get every drumroll and balloon head with the tail that ends it, in row order."""
+        heads = np.flatnonzero(self.tail != -1)
+        return [(self.notes[head], self.notes[tail]) for head, tail in zip(heads.tolist(), self.tail[heads].tolist())]
+
+    def window(self, current_ms: float, distance: float, travel_distance: float) -> range:
+        """Get the rows of the notes that can be within the given distance in pixels of the judge circle at current_ms.
+        The notes must be sorted by hit_ms.
+
+        Args:
+            current_ms (float): The time to look around.
+            distance (float): The distance in pixels from the judge circle.
+            travel_distance (float): The distance in pixels a note at scroll 1 travels in one measure.
+
+        Returns:
+            range: The rows in notes, a superset of the notes in reach.
+        """
+        speed_x, speed_y = self.pixels_per_ms(travel_distance)
+        speed = np.maximum(np.abs(speed_x), np.abs(speed_y))
+        speed = speed[speed > 0]
+        if not len(speed):
+            return range(len(self.notes))
+        reach_ms = distance / speed.min()
+        start = int(np.searchsorted(self.end_ms, current_ms - reach_ms, side='left'))
+        end = int(np.searchsorted(self.hit_ms, current_ms + reach_ms, side='right'))
+        return range(start, max(start, end))
+
 @dataclass
 class CourseData:
     """A collection of course metadata
@@ -303,29 +481,70 @@ def calculate_base_score(notes: NoteList) -> int:
         return 1000000
     return math.ceil((1000000 - (balloon_count * 100) - (16.920079999994086 * drumroll_msec / 1000 * 100)) / total_notes / 10) * 10
 
-def test_encodings(file_path: Path):
-    """Test the encoding of a file by trying different encodings.
+ENCODINGS = ['utf-8-sig', 'shift-jis', 'utf-16', 'mac_roman']
+ENCODING_SNIFF_SIZE = 4096
+
+def detect_encoding(data: bytes, hint: Optional[str] = None) -> tuple[str, str]:
+    """Detect the encoding of a file's bytes and decode them.
+
+    A BOM always wins, then a bounded prefix is sniffed: non-ASCII text that decodes as utf-8
+    is decoded as utf-8, and a prefix that cannot decode as utf-8 skips it.
+    Only when the sniff is inconclusive is the hint, usually the encoding remembered in the song
+    index, tried first, so a file re-saved in another encoding is not decoded with a stale hint.
+    The remaining encodings are tried in the same order test_encodings always used.
 
     Args:
-        file_path (Path): The path to the file to test.
+        data (bytes): The contents of the file.
+        hint (str, optional): The encoding the file was previously decoded with.
 
     Returns:
-        str: The encoding that successfully decoded the file.
+        tuple[str, str]: The decoded text and the encoding that decoded it.
     """
-    encodings = ['utf-8-sig', 'shift-jis', 'utf-8', 'utf-16', 'mac_roman']
-    final_encoding = None
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')):
+        if data.startswith(bom):
+            try:
+                return data.decode(encoding), encoding
+            except UnicodeDecodeError:
+                break
+
+    encodings = ENCODINGS.copy()
+    prefix = data[:ENCODING_SNIFF_SIZE]
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+        utf8_sniffed = not prefix.isascii()
+    except UnicodeDecodeError:
+        encodings.remove('utf-8-sig')
+        utf8_sniffed = False
+    # A hint the sniff already ruled out is not worth a full decode attempt
+    if hint is not None and not utf8_sniffed and (hint in encodings or hint not in ENCODINGS):
+        encodings = [hint] + [encoding for encoding in encodings if encoding != hint]
 
     for encoding in encodings:
         try:
-            _ = file_path.read_text(encoding=encoding).splitlines()
-            final_encoding = encoding
-            break
-        except UnicodeDecodeError:
+            return data.decode(encoding), encoding
+        except (UnicodeDecodeError, LookupError):
             continue
-    return final_encoding
+    return data.decode('mac_roman'), 'mac_roman'
+
+def test_encodings(file_path: Path):
+    """Test the encoding of a file.
+
+    Args:
+        file_path (Path): The path to the file to test.
+
+    Returns:
+        str: The encoding that successfully decoded the file.
+    """
+    return detect_encoding(file_path.read_bytes())[1]
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever the output of notes_to_position or the compiled chart file names change so stale compiled charts are removed
+PARSER_VERSION = 4
+# Bump whenever hash_note_data changes, build_song_hashes migrates the stored hashes
+HASH_VERSION = 2
+COMPILED_CHART_DIR = Path('cache/charts')
+
 @dataclass
 class ParserState:
     time_signature: float = 4/4
@@ -360,6 +579,44 @@ class ParserState:
     start_branch_barline: bool = False
     branch_balloon_index: int = 0
     section_bar: Optional[Note] = None
+    note_measure_ms: dict[int, tuple[list[Note | Drumroll | Balloon], array]] = field(default_factory=lambda: dict())
+
+# 口唱歌 of each note type when it is not part of a faster pattern
+MOJI_BY_TYPE = {1: 0, 2: 3, 3: 5, 4: 6, 5: 7, 6: 8, 7: 9, 8: 10, 9: 11}
+
+def assign_moji(play_notes: list[Note | Drumroll | Balloon], ms_per_measure: Iterable[float]) -> None:
+    """
+    Assign 口唱歌 (note phoneticization) to a finished list of notes in one pass.
+    Args:
+        play_notes (list[Note]): The notes to process, in the order they were parsed.
+        ms_per_measure (Iterable[float]): The duration of the measure each note was parsed in.
+    Returns:
+        None
+    """
+    count = len(play_notes)
+    if count <= 1:
+        return
+    types = [note.type for note in play_notes]
+    hit_ms = [note.hit_ms for note in play_notes]
+    eighth = [measure_ms / 8 for measure_ms in ms_per_measure]
+    for i in range(count):
+        note_type = types[i]
+        # A don in a fast run of three dons is a "ko", judged by the measure of the note after the run
+        if note_type == 1 and 1 <= i < count - 2 and types[i - 1] == 1 and types[i + 1] == 1:
+            limit = eighth[i + 2]
+            if hit_ms[i] - hit_ms[i - 1] < limit and hit_ms[i + 1] - hit_ms[i] < limit:
+                if i < 3 or (hit_ms[i - 1] - hit_ms[i - 2] >= limit and hit_ms[i + 2] - hit_ms[i + 1] >= limit):
+                    play_notes[i].moji = 2
+                    continue
+        if i + 1 < count and note_type in (1, 2):
+            # Dons and kas followed quickly by another note get the short callout
+            is_fast = hit_ms[i + 1] - hit_ms[i] <= eighth[i + 1] - 1
+            if note_type == 1:
+                play_notes[i].moji = 1 if is_fast else 0
+            else:
+                play_notes[i].moji = 4 if is_fast else 3
+        else:
+            play_notes[i].moji = MOJI_BY_TYPE[note_type]
 
 class TJAParser:
     """Parse a TJA file and extract metadata and data.
@@ -373,22 +630,35 @@ class TJAParser:
         metadata (TJAMetadata): The metadata extracted from the TJA file.
         ex_data (TJAEXData): The extended data extracted from the TJA file.
         data (list): The data extracted from the TJA file.
+        header_only (bool): Whether only the header of each course was kept.
+        encoding (str): The encoding the TJA file was decoded with.
+        file_hash (str): The sha256 of the TJA file's contents.
     """
     DIFFS = {0: "easy", 1: "normal", 2: "hard", 3: "oni", 4: "edit", 5: "tower", 6: "dan"}
-    def __init__(self, path: Path, start_delay: int = 0):
+    def __init__(self, path: Path, start_delay: int = 0, encoding: Optional[str] = None, header_only: bool = False):
         """
         Initialize a TJA object.
 
         Args:
             path (Path): The path to the TJA file.
             start_delay (int): The delay in milliseconds before the first note.
+            encoding (str, optional): The encoding the file was last decoded with, tried first.
+            header_only (bool): Only keep the header of each course, skipping everything between
+                #START and #END except #BRANCH lines. Metadata is complete, but notes cannot be parsed.
         """
         self.file_path: Path = path
-
-        encoding = test_encodings(self.file_path)
-        lines = self.file_path.read_text(encoding=encoding).splitlines()
-        self.data = [cleaned for line in lines
-                     if (cleaned := strip_comments(line).strip())]
+        self.start_delay = start_delay
+        self.header_only = header_only
+
+        raw_data = self.file_path.read_bytes()
+        self.file_hash = hashlib.sha256(raw_data).hexdigest()
+        text, self.encoding = detect_encoding(raw_data, encoding)
+        lines = text.splitlines()
+        if header_only:
+            self.data = self._header_data(lines)
+        else:
+            self.data = [cleaned for line in lines
+                         if (cleaned := strip_comments(line).strip())]
 
         self.metadata = TJAMetadata()
         self.ex_data = TJAEXData()
@@ -402,14 +672,41 @@ class TJAParser:
         self.branch_e: list[NoteList] = []
         self.branch_n: list[NoteList] = []
 
-    def _build_command_registry(self):
-        """Auto-discover command handlers based on naming convention."""
-        registry = {}
-        for name in dir(self):
-            if name.startswith('handle_'):
-                cmd_name = '#' + name[7:].upper()
-                registry[cmd_name] = getattr(self, name)
-        return registry
+    def _header_data(self, lines: list[str]) -> list[str]:
+        """Strip comments from header lines only, keeping just the #BRANCH lines of note sections."""
+        data = []
+        in_notes = False
+        for line in lines:
+            if in_notes:
+                line = line.strip()
+                if line.startswith('#END'):
+                    in_notes = False
+                elif line.startswith('#BRANCH'):
+                    data.append(strip_comments(line).strip())
+                continue
+            cleaned = strip_comments(line).strip()
+            if cleaned:
+                data.append(cleaned)
+                in_notes = cleaned.startswith('#START')
+        return data
+
+    @classmethod
+    def _build_command_registry(cls) -> tuple[dict[str, Callable], re.Pattern]:
+        """Auto-discover command handlers based on naming convention, once per class.
+
+        Returns:
+            tuple: The handlers accessed by command, and a pattern matching the longest command a line starts with.
+        """
+        if '_command_registry' not in cls.__dict__:
+            registry = {}
+            for name in dir(cls):
+                if name.startswith('handle_'):
+                    cmd_name = '#' + name[7:].upper()
+                    registry[cmd_name] = getattr(cls, name)
+            # Alternatives are tried in order, so longer commands must come first (#MEASURE before #M)
+            cls._command_registry = registry
+            cls._command_pattern = re.compile('|'.join(re.escape(cmd) for cmd in sorted(registry, key=len, reverse=True)))
+        return cls._command_registry, cls._command_pattern
 
     def get_metadata(self):
         """
@@ -444,7 +741,6 @@ class TJAParser:
             elif item.startswith('WAVE'):
                 data = item.split(':')[1]
                 if not Path(self.file_path.parent / data.strip()).exists():
-                    logger.error(f'{data}, {self.file_path}')
                     logger.warning(f"Invalid WAVE value: {data} in TJA file {self.file_path}")
                     self.metadata.wave = Path()
                 else:
@@ -479,6 +775,8 @@ class TJAParser:
                     self.metadata.movieoffset = float(data)
             elif item.startswith('SCENEPRESET'):
                 self.metadata.scene_preset = item.split(':')[1]
+            elif item.startswith('GENRE'):
+                self.metadata.genre = ''.join(item.split(':')[1:]).strip()
             elif item.startswith('COURSE'):
                 course = str(item.split(':')[1]).lower().strip()
 
@@ -560,51 +858,55 @@ class TJAParser:
             elif '限定' in self.metadata.title[region_code]:
                 self.ex_data.limited_time = True
 
-    def data_to_notes(self, diff) -> list[list[str]]:
-        """
-        Convert the data to notes.
+    def _course_to_diff(self, course_value: str) -> Optional[int]:
+        """Get the difficulty a COURSE: value refers to, or None if it does not name one."""
+        for diff, diff_name in self.DIFFS.items():
+            if (course_value.isdigit() and int(course_value) == diff) or course_value == diff_name:
+                return diff
+        return None
 
-        Args:
-            diff (int): The difficulty level.
+    def _find_course_sections(self) -> dict[int, tuple[int, int, ScrollType]]:
+        """
+        Find the note section of every course in a single pass over the data.
 
         Returns:
-            list[list[str]]: The notes.
+            dict[int, tuple[int, int, ScrollType]]: The start and end line indices and
+            scroll type of each course's note section, accessed by diff number.
         """
-        diff_name = self.DIFFS.get(diff, "").lower()
-
-        # Use enumerate for single iteration
-        note_start = note_end = -1
-        target_found = False
+        sections: dict[int, tuple[int, int, ScrollType]] = dict()
+        current_diff = None
+        note_start = -1
         scroll_type = ScrollType.NMSCROLL
+        pending: dict[int, tuple[int, ScrollType]] = dict()
 
-        # Find the section boundaries
         for i, line in enumerate(self.data):
             if line.startswith("COURSE:"):
-                course_value = line[7:].strip().lower()
-                target_found = (course_value.isdigit() and int(course_value) == diff) or course_value == diff_name
-            elif target_found:
+                if current_diff is not None:
+                    pending[current_diff] = (note_start, scroll_type)
+                current_diff = self._course_to_diff(line[7:].strip().lower())
+                if current_diff in sections:
+                    current_diff = None
+                if current_diff is not None:
+                    note_start, scroll_type = pending.get(current_diff, (-1, ScrollType.NMSCROLL))
+            elif current_diff is not None:
                 if note_start == -1 and line in ("#START", "#START P1"):
                     note_start = i + 1
                 elif line == "#END" and note_start != -1:
-                    note_end = i
-                    break
+                    sections[current_diff] = (note_start, i, scroll_type)
+                    current_diff = None
                 elif '#NMSCROLL' in line:
                     scroll_type = ScrollType.NMSCROLL
-                    continue
                 elif '#BMSCROLL' in line:
                     scroll_type = ScrollType.BMSCROLL
-                    continue
                 elif '#HBSCROLL' in line:
                     scroll_type = ScrollType.HBSCROLL
-                    continue
 
-        if note_start == -1 or note_end == -1:
-            return []
+        return sections
 
-        # Process the section with minimal string operations
+    def _split_bars(self, section_data: list[str], scroll_type: ScrollType) -> list[list[str]]:
+        """Split a course's note section into bars, prepending the scroll type."""
         notes = []
         bar = []
-        section_data = self.data[note_start:note_end]
 
         # Prepend scroll type
         if scroll_type == ScrollType.NMSCROLL:
@@ -635,72 +937,31 @@ class TJAParser:
 
         return notes
 
-    def get_moji(self, play_note_list: list[Note], ms_per_measure: float) -> None:
+    def data_to_notes(self, diff) -> list[list[str]]:
         """
-        Assign 口唱歌 (note phoneticization) to notes.
+        Convert the data to notes.
+
         Args:
-            play_note_list (list[Note]): The list of notes to process.
-            ms_per_measure (float): The duration of a measure in milliseconds.
+            diff (int): The difficulty level.
+
         Returns:
-            None
+            list[list[str]]: The notes.
         """
-        se_notes = {
-            1: 0,
-            2: 3,
-            3: 5,
-            4: 6,
-            5: 7,
-            6: 8,
-            7: 9,
-            8: 10,
-            9: 11
-        }
-        if len(play_note_list) <= 1:
-            return
-        current_note = play_note_list[-1]
-        if current_note.type == 1:
-            current_note.moji = 0
-        elif current_note.type == 2:
-            current_note.moji = 3
-        else:
-            current_note.moji = se_notes[current_note.type]
-        prev_note = play_note_list[-2]
-        if prev_note.type == 1:
-            timing_threshold = ms_per_measure / 8 - 1
-            if current_note.hit_ms - prev_note.hit_ms <= timing_threshold:
-                prev_note.moji = 1
-            else:
-                prev_note.moji = 0
-        elif prev_note.type == 2:
-            timing_threshold = ms_per_measure / 8 - 1
-            if current_note.hit_ms - prev_note.hit_ms <= timing_threshold:
-                prev_note.moji = 4
-            else:
-                prev_note.moji = 3
-        else:
-            prev_note.moji = se_notes[prev_note.type]
-        if len(play_note_list) > 3:
-            notes_minus_4 = play_note_list[-4]
-            notes_minus_3 = play_note_list[-3]
-            notes_minus_2 = play_note_list[-2]
-            consecutive_ones = (
-                notes_minus_4.type == 1 and
-                notes_minus_3.type == 1 and
-                notes_minus_2.type == 1
-            )
-            if consecutive_ones:
-                rapid_timing = (
-                    notes_minus_3.hit_ms - notes_minus_4.hit_ms < (ms_per_measure / 8) and
-                    notes_minus_2.hit_ms - notes_minus_3.hit_ms < (ms_per_measure / 8)
-                )
-                if rapid_timing:
-                    if len(play_note_list) > 5:
-                        spacing_before = play_note_list[-4].hit_ms - play_note_list[-5].hit_ms >= (ms_per_measure / 8)
-                        spacing_after = play_note_list[-1].hit_ms - play_note_list[-2].hit_ms >= (ms_per_measure / 8)
-                        if spacing_before and spacing_after:
-                            play_note_list[-3].moji = 2
-                    else:
-                        play_note_list[-3].moji = 2
+        section = self._find_course_sections().get(diff)
+        if section is None:
+            return []
+        note_start, note_end, scroll_type = section
+        return self._split_bars(self.data[note_start:note_end], scroll_type)
+
+    def data_to_courses(self) -> dict[int, list[list[str]]]:
+        """
+        Convert the data to notes for every course at once.
+
+        Returns:
+            dict[int, list[list[str]]]: The notes, accessed by diff number.
+        """
+        return {diff: self._split_bars(self.data[note_start:note_end], scroll_type)
+                for diff, (note_start, note_end, scroll_type) in self._find_course_sections().items()}
 
     def apply_easing(self, t, easing_point, easing_function):
         """Apply easing function to normalized time value t (0 to 1)"""
@@ -804,6 +1065,9 @@ class TJAParser:
                 bar_line.hit_ms = self.current_ms
                 bar_line.type = 0
                 bar_line.display = False
+                bar_line.bpm = state.bpm
+                bar_line.scroll_x = state.scroll_x_modifier
+                bar_line.scroll_y = state.scroll_y_modifier
                 bar_line.branch_params = branch_params
                 bar_list.append(bar_line)
 
@@ -1007,11 +1271,10 @@ class TJAParser:
             note.sudden_moving_ms = state.sudden_moving
 
         if item in ('5', '6'):
-            note = Drumroll(note)
-            note.color = 255
+            note = Drumroll.from_note(note)
         elif item in ('7', '9'):
             state.balloon_index += 1
-            note = Balloon(note, is_kusudama=item == '9')
+            note = Balloon.from_note(note, is_kusudama=item == '9')
             note.count = 1 if not state.balloons else state.balloons.pop(0)
         elif item == '8':
             if state.prev_note is None:
@@ -1019,10 +1282,18 @@ class TJAParser:
 
         return note
 
-    def notes_to_position(self, diff: int):
-        """Parse a TJA's notes into a NoteList."""
-        commands = self._build_command_registry()
-        notes = self.data_to_notes(diff)
+    def notes_to_position(self, diff: int, notes: Optional[list[list[str]]] = None):
+        """Parse a TJA's notes into a NoteList.
+
+        Args:
+            diff (int): The difficulty to parse.
+            notes (list[list[str]], optional): The course's bars, if already split by data_to_courses.
+        """
+        if self.header_only:
+            raise Exception(f"Cannot parse notes of {self.file_path}, it was parsed header only")
+        commands, command_pattern = self._build_command_registry()
+        if notes is None:
+            notes = self.data_to_notes(diff)
 
         state = ParserState()
         state.bpm = self.metadata.bpm
@@ -1047,11 +1318,9 @@ class TJAParser:
 
             for part in bar:
                 if part.startswith('#'):
-                    for cmd_prefix, handler in sorted(commands.items(), key=lambda x: len(x[0]), reverse=True):
-                        if part.startswith(cmd_prefix):
-                            value = part[len(cmd_prefix):].strip()
-                            handler(value, state)
-                            break
+                    command = command_pattern.match(part)
+                    if command is not None:
+                        commands[command.group()](self, part[command.end():].strip(), state)
                     continue
                 elif len(part) > 0 and not part[0].isdigit():
                     logger.warning(f"Unrecognized command: {part} in TJA {self.file_path}")
@@ -1091,12 +1360,85 @@ class TJAParser:
                     self.current_ms += increment
                     state.curr_note_list.append(note)
                     state.curr_draw_list.append(note)
-                    self.get_moji(state.curr_note_list, ms_per_measure)
+                    state.note_measure_ms.setdefault(id(state.curr_note_list), (state.curr_note_list, array('d')))[1].append(ms_per_measure)
                     state.index += 1
                     state.prev_note = note
 
+        for play_notes, ms_per_measure in state.note_measure_ms.values():
+            assign_moji(play_notes, ms_per_measure)
+
         return self.master_notes, self.branch_m, self.branch_e, self.branch_n
 
+    def _reset_notes(self):
+        """Discard the notes of a previous parse so the next one starts from scratch."""
+        self.current_ms = self.start_delay
+        self.master_notes = NoteList()
+        self.branch_m, self.branch_e, self.branch_n = [], [], []
+
+    def all_notes_to_position(self) -> dict[int, tuple[NoteList, list[NoteList], list[NoteList], list[NoteList]]]:
+        """Parse the notes of every course from a single pass over the data.
+
+        Returns:
+            dict: The master NoteList and the m, e and n branch NoteLists, accessed by diff number.
+        """
+        courses = self.data_to_courses()
+        all_notes = dict()
+        for diff in self.metadata.course_data:
+            self._reset_notes()
+            all_notes[diff] = self.notes_to_position(diff, courses.get(diff, []))
+        return all_notes
+
+    def _compiled_chart_prefix(self, diff: int) -> str:
+        """Get the start of the compiled chart file names of this TJA file's difficulty, whatever its contents."""
+        path_hash = hashlib.sha256(str(self.file_path.resolve()).encode('utf-8')).hexdigest()[:16]
+        return f'{path_hash}_{diff}_'
+
+    def _compiled_chart_path(self, diff: int) -> Path:
+        """Get the compiled chart path for the given difficulty, keyed by path, file contents and parser version."""
+        return COMPILED_CHART_DIR / f'v{PARSER_VERSION}' / f'{self._compiled_chart_prefix(diff)}{self.file_hash}_{self.start_delay}.pickle'
+
+    def load_notes(self, diff: int) -> tuple[NoteList, list[NoteList], list[NoteList], list[NoteList]]:
+        """Get the parsed notes for the given difficulty, using the compiled chart cache when possible.
+
+        Unlike notes_to_position, every call returns freshly built objects, so the result
+        can be mutated by the caller without affecting later loads.
+
+        Args:
+            diff (int): The difficulty to load.
+
+        Returns:
+            tuple: The master NoteList and the m, e and n branch NoteLists.
+        """
+        chart_path = self._compiled_chart_path(diff)
+        if chart_path.exists():
+            try:
+                with open(chart_path, 'rb') as f:
+                    return pickle.load(f)
+            except Exception as e:
+                logger.warning(f"Failed to load compiled chart {chart_path}, recompiling: {e}")
+                chart_path.unlink(missing_ok=True)
+
+        self._reset_notes()
+        result = self.notes_to_position(diff)
+
+        try:
+            if not chart_path.parent.exists():
+                # Charts compiled by older parser versions can never be loaded again
+                if COMPILED_CHART_DIR.exists():
+                    for old_dir in COMPILED_CHART_DIR.iterdir():
+                        shutil.rmtree(old_dir, ignore_errors=True)
+                chart_path.parent.mkdir(parents=True, exist_ok=True)
+            # Only the latest compile of a file's difficulty is kept, older edits of it are never loaded again
+            for old_path in chart_path.parent.glob(f'{self._compiled_chart_prefix(diff)}*.pickle'):
+                old_path.unlink(missing_ok=True)
+            temp_path = chart_path.with_suffix('.tmp')
+            with open(temp_path, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, chart_path)
+        except OSError as e:
+            logger.warning(f"Failed to write compiled chart {chart_path}: {e}")
+        return result
+
     def hash_note_data(self, notes: NoteList):
         """Hashes the note data for the given NoteList."""
         n = hashlib.sha256()
@@ -1114,56 +1456,396 @@ class TJAParser:
                 j += 1
         merged.extend(list1[i:])
         merged.extend(list2[j:])
-        for item in merged:
-            n.update(item.get_hash().encode('utf-8'))
+        n.update(b''.join([item.get_hash_data() for item in merged]))
 
         return n.hexdigest()
 
-def modifier_speed(notes: NoteList, value: float):
-    """Modifies the speed of the notes in the given NoteList."""
-    modded_notes = notes.draw_notes.copy()
-    modded_bars = notes.bars.copy()
-    for note in modded_notes:
-        note.scroll_x *= value
-    for bar in modded_bars:
-        bar.scroll_x *= value
-    return modded_notes, modded_bars
-
-def modifier_display(notes: NoteList):
-    """Modifies the display of the notes in the given NoteList."""
-    modded_notes = notes.draw_notes.copy()
-    for note in modded_notes:
-        note.display = False
-    return modded_notes
-
-def modifier_inverse(notes: NoteList):
-    """Inverts the type of the notes in the given NoteList."""
-    modded_notes = notes.play_notes.copy()
-    type_mapping = {1: 2, 2: 1, 3: 4, 4: 3}
-    for note in modded_notes:
-        if note.type in type_mapping:
-            note.type = type_mapping[note.type]
-    return modded_notes
-
-def modifier_random(notes: NoteList, value: int):
-    """Randomly modifies the type of the notes in the given NoteList.
-    value: 1 == kimagure, 2 == detarame"""
-    #value: 1 == kimagure, 2 == detarame
-    modded_notes = notes.play_notes.copy()
-    percentage = int(len(modded_notes) / 5) * value
-    selected_notes = random.sample(range(len(modded_notes)), percentage)
-    type_mapping = {1: 2, 2: 1, 3: 4, 4: 3}
-    for i in selected_notes:
-        if modded_notes[i].type in type_mapping:
-            modded_notes[i].type = type_mapping[modded_notes[i].type]
-    return modded_notes
-
-def apply_modifiers(notes: NoteList, modifiers: Modifiers):
-    """Applies all selected modifiers from global_data to the given NoteList."""
-    if modifiers.display:
-        draw_notes = modifier_display(notes)
-    if modifiers.inverse:
-        play_notes = modifier_inverse(notes)
-    play_notes = modifier_random(notes, modifiers.random)
-    draw_notes, bars = modifier_speed(notes, modifiers.speed)
+@dataclass
+class ScrollTransform:
+    """Cumulative hit_ms transform of the #BPMCHANGE and #DELAY commands of a HBSCROLL/BMSCROLL chart.
+    The transform is piecewise affine, a note at hit_ms x in piece i moves to x * scale[i] + offset[i].
+    thresholds: Sorted original hit_ms the pieces end at, a note exactly on a threshold belongs to the piece before it
+    scale: Factor of every piece, one more than there are thresholds
+    offset: Offset of every piece, one more than there are thresholds"""
+    thresholds: list[float] = field(default_factory=lambda: [])
+    scale: list[float] = field(default_factory=lambda: [1.0])
+    offset: list[float] = field(default_factory=lambda: [0.0])
+
+    # How far apart two times may be to still be counted as the same time, covering the rounding of the transform
+    SNAP_MS: ClassVar[float] = 1e-6
+
+    def add_step(self, original_ms: float, hit_ms: float, bpmchange: float = 1.0, delay: float = 0.0):
+        """Apply one more command to every note that is transformed past hit_ms so far.
+        The transform only ever increases with hit_ms, so those notes are the pieces after one threshold.
+        Like the per command fallback, a note transformed exactly onto hit_ms is not moved."""
+        # First piece whose transformed end is past hit_ms, the last piece never ends
+        lo, hi = 0, len(self.thresholds)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.thresholds[mid] * self.scale[mid] + self.offset[mid] > hit_ms + self.SNAP_MS:
+                hi = mid
+            else:
+                lo = mid + 1
+        start = self.thresholds[lo - 1] if lo else -math.inf
+        end = self.thresholds[lo] if lo < len(self.thresholds) else math.inf
+        # Notes transformed to within SNAP_MS of hit_ms count as on it, the rounding of the pieces can't move them
+        threshold = max(start, (hit_ms + self.SNAP_MS - self.offset[lo]) / self.scale[lo])
+        if abs(threshold - original_ms) <= self.SNAP_MS and start <= original_ms < end:
+            threshold = original_ms
+        if threshold > start:
+            self.thresholds.insert(lo, threshold)
+            self.scale.insert(lo, self.scale[lo])
+            self.offset.insert(lo, self.offset[lo])
+            lo += 1
+        shift = hit_ms - hit_ms / bpmchange + delay
+        self.scale[lo:] = [scale / bpmchange for scale in self.scale[lo:]]
+        self.offset[lo:] = [offset / bpmchange + shift for offset in self.offset[lo:]]
+
+    @classmethod
+    def from_timeline(cls, timeline: list[TimelineObject]) -> 'ScrollTransform':
+        """Build the transform of a timeline, moving its #BPMCHANGE and #DELAY objects to their transformed hit_ms.
+        Each command only moves the commands of its own kind that come after it."""
+        transform = cls()
+        # Every command moves all later commands of its kind, so those are a running scale and offset
+        bpm_scale, bpm_offset = 1.0, 0.0
+        delay_offset = 0.0
+        for timeline_object in timeline:
+            if hasattr(timeline_object, 'bpmchange'):
+                bpmchange = timeline_object.bpmchange
+                if bpmchange <= 0:
+                    raise ValueError(f"Scroll command at {timeline_object.hit_ms}ms has a bpm change of {bpmchange}")
+                original_ms = timeline_object.hit_ms
+                timeline_object.hit_ms = original_ms * bpm_scale + bpm_offset
+                transform.add_step(original_ms, timeline_object.hit_ms, bpmchange=bpmchange)
+                hit_ms = timeline_object.hit_ms
+                bpm_scale, bpm_offset = bpm_scale / bpmchange, bpm_offset / bpmchange + hit_ms - hit_ms / bpmchange
+            elif hasattr(timeline_object, 'delay'):
+                original_ms = timeline_object.hit_ms
+                timeline_object.hit_ms = original_ms + delay_offset
+                if timeline_object.delay < 0:
+                    raise ValueError(f"Scroll command at {original_ms}ms has a negative delay of {timeline_object.delay}")
+                transform.add_step(original_ms, timeline_object.hit_ms, delay=timeline_object.delay)
+                delay_offset += timeline_object.delay
+        return transform
+
+    def apply(self, notes: Iterable[Note]):
+        """Move the hit_ms of every given note, walking the notes in hit_ms order alongside the thresholds."""
+        if not self.thresholds:
+            return
+        i = 0
+        for note in sorted(notes, key=lambda note: note.hit_ms):
+            while i < len(self.thresholds) and self.thresholds[i] < note.hit_ms:
+                i += 1
+            note.hit_ms = note.hit_ms * self.scale[i] + self.offset[i]
+
+def apply_scroll_commands_legacy(timeline: list[TimelineObject], notes: list[Note]):
+    """Apply every #BPMCHANGE and #DELAY to every note one command at a time.
+    Kept as the fallback for timelines ScrollTransform can't represent and as the reference it is checked against."""
+    for i, o in enumerate(timeline):
+        if hasattr(o, 'bpmchange'):
+            hit_ms = o.hit_ms
+            bpmchange = o.bpmchange
+            for note in notes:
+                if note.hit_ms > hit_ms:
+                    note.hit_ms = (note.hit_ms - hit_ms) / bpmchange + hit_ms
+            for i2 in range(i + 1, len(timeline)):
+                o2 = timeline[i2]
+                if not hasattr(o2, 'bpmchange'):
+                    continue
+                o2.hit_ms = (o2.hit_ms - hit_ms) / bpmchange + hit_ms
+        elif hasattr(o, 'delay'):
+            hit_ms = o.hit_ms
+            delay = o.delay
+            for note in notes:
+                if note.hit_ms > hit_ms:
+                    note.hit_ms += delay
+            for i2 in range(i + 1, len(timeline)):
+                o2 = timeline[i2]
+                if not hasattr(o2, 'delay'):
+                    continue
+                o2.hit_ms += delay
+
+def apply_scroll_commands(timeline: list[TimelineObject], notes: Iterable[Note]) -> bool:
+    """Pre-modify the hit_ms of HBSCROLL/BMSCROLL notes and bars with the #BPMCHANGE and #DELAY commands of the timeline.
+    Returns False if the timeline needed the per command fallback."""
+    notes = list(notes)
+    original_ms = [o.hit_ms for o in timeline]
+    try:
+        transform = ScrollTransform.from_timeline(timeline)
+    except ValueError as e:
+        logger.debug(f"Falling back to per command scroll transform: {e}")
+        for o, hit_ms in zip(timeline, original_ms):
+            o.hit_ms = hit_ms
+        apply_scroll_commands_legacy(timeline, notes)
+        return False
+    transform.apply(notes)
+    return True
+
+INVERSE_TYPES = {NoteType.DON: NoteType.KAT, NoteType.KAT: NoteType.DON, NoteType.DON_L: NoteType.KAT_L, NoteType.KAT_L: NoteType.DON_L}
+
+@dataclass
+class ModifierOverlay:
+    """The changes the selected modifiers make to a parsed chart, kept apart from the chart itself.
+    types: The type of every play note after inverse and random, in play_notes order
+    scroll_scale: Factor applied to the scroll_x of every drawn note and bar
+    display: Whether the notes are drawn"""
+    types: array = field(default_factory=lambda: array('b'))
+    scroll_scale: float = 1.0
+    display: bool = True
+
+    @classmethod
+    def from_modifiers(cls, notes: NoteList, modifiers: Modifiers, seed: int) -> 'ModifierOverlay':
+        """Build the overlay of the given modifiers, the same seed always picks the same notes for random."""
+        types = array('b', [note.type for note in notes.play_notes])
+        if modifiers.inverse:
+            types = array('b', [INVERSE_TYPES.get(note_type, note_type) for note_type in types])
+        if modifiers.random:
+            #value: 1 == kimagure, 2 == detarame
+            percentage = int(len(types) / 5) * modifiers.random
+            for i in random.Random(seed).sample(range(len(types)), percentage):
+                types[i] = INVERSE_TYPES.get(types[i], types[i])
+        return cls(types=types, scroll_scale=modifiers.speed, display=not modifiers.display)
+
+    def apply(self, notes: NoteList) -> tuple[list[Note | Drumroll | Balloon], list[Note | Drumroll | Balloon], list[Note]]:
+        """Get the play notes, draw notes and bars with the overlay applied.
+        Notes the overlay changes are copied, so the given NoteList is left as it was."""
+        # Play and draw lists share note objects, a copy has to replace the note in both
+        copies: dict[int, Note] = dict()
+        for note, note_type in zip(notes.play_notes, self.types):
+            if note_type != note.type:
+                copies[id(note)] = copy.copy(note)
+                copies[id(note)].type = note_type
+        if self.scroll_scale != 1.0 or not self.display:
+            for note in notes.draw_notes:
+                if id(note) not in copies:
+                    copies[id(note)] = copy.copy(note)
+                copied = copies[id(note)]
+                copied.scroll_x *= self.scroll_scale
+                if not self.display:
+                    copied.display = False
+        play_notes = [copies.get(id(note), note) for note in notes.play_notes]
+        draw_notes = [copies.get(id(note), note) for note in notes.draw_notes]
+        bars = list(notes.bars)
+        if self.scroll_scale != 1.0:
+            bars = [copy.copy(bar) for bar in bars]
+            for bar in bars:
+                bar.scroll_x *= self.scroll_scale
+        return play_notes, draw_notes, bars
+
+def apply_modifiers(notes: NoteList, modifiers: Modifiers, seed: int = 0):
+    """Applies the given modifiers to a NoteList without changing it, seed decides which notes random swaps."""
+    play_notes, draw_notes, bars = ModifierOverlay.from_modifiers(notes, modifiers, seed).apply(notes)
     return deque(play_notes), deque(draw_notes), deque(bars)
+
+class _RecordCollector(logging.Handler):
+    """Logging handler that keeps the messages logged while a chart is parsed."""
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages: list[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(record.getMessage())
+
+def _find_tja_files(paths: Iterable[Path]) -> list[Path]:
+    """Expand the given files and directories into a sorted list of TJA files."""
+    tja_files: list[Path] = []
+    for path in paths:
+        if path.is_dir():
+            tja_files.extend(sorted(path.rglob("*.tja", recurse_symlinks=True)))
+        else:
+            tja_files.append(path)
+    return tja_files
+
+def _lint_commands(tja: TJAParser) -> list[str]:
+    """Check the commands of every note section: unknown or malformed commands, and #START/#END and
+    #BRANCHSTART/#N/#E/#M/#BRANCHEND that don't pair up."""
+    problems: list[str] = []
+    commands, command_pattern = tja._build_command_registry()
+    # Courses without a COURSE: line are Oni
+    course: int | str = 3
+    in_notes = False
+    in_branch = False
+    branch_sections: list[str] = []
+
+    def close_branch():
+        if in_branch and not branch_sections:
+            problems.append(f"#BRANCHSTART without any #N, #E or #M section in course {course}")
+
+    for line in tja.data:
+        if line.startswith('COURSE:'):
+            if in_notes:
+                problems.append(f"#START without an #END in course {course}")
+            in_notes = False
+            course_value = line[7:].strip()
+            diff = tja._course_to_diff(course_value.lower())
+            course = diff if diff is not None else course_value
+            continue
+        if not line.startswith('#'):
+            continue
+        command = line.split()[0]
+        if command == '#START':
+            if in_notes:
+                problems.append(f"#START without an #END before it in course {course}")
+            in_notes = True
+            in_branch = False
+            continue
+        if command == '#END':
+            if not in_notes:
+                problems.append(f"#END without a #START in course {course}")
+            close_branch()
+            in_notes = False
+            in_branch = False
+            continue
+        if not in_notes:
+            continue
+        if command not in commands:
+            match = command_pattern.match(line)
+            if match is not None:
+                problems.append(f"Malformed command {line} in course {course}, read as {match.group()}")
+            else:
+                problems.append(f"Unknown command {line} in course {course}, it is ignored")
+            continue
+        if command == '#BRANCHSTART':
+            close_branch()
+            in_branch = True
+            branch_sections = []
+        elif command == '#BRANCHEND':
+            if not in_branch:
+                problems.append(f"#BRANCHEND without a #BRANCHSTART in course {course}")
+            close_branch()
+            in_branch = False
+        elif command in ('#N', '#E', '#M'):
+            if not in_branch:
+                problems.append(f"{command} outside of a #BRANCHSTART section in course {course}")
+            elif command in branch_sections:
+                problems.append(f"{command} appears twice in one #BRANCHSTART section in course {course}")
+            else:
+                branch_sections.append(command)
+    if in_notes:
+        problems.append(f"#START without an #END in course {course}")
+    return problems
+
+def lint_tja(path: Path) -> list[str]:
+    """Parse a TJA file and return a description of every problem found in it."""
+    collector = _RecordCollector()
+    logger.addHandler(collector)
+    propagate = logger.propagate
+    logger.propagate = False
+    problems: list[str] = []
+    try:
+        tja = TJAParser(path)
+        all_notes = tja.all_notes_to_position()
+    except Exception as e:
+        return collector.messages + [f"Failed to parse: {e}"]
+    finally:
+        logger.removeHandler(collector)
+        logger.propagate = propagate
+    problems.extend(collector.messages)
+
+    if tja.metadata.wave == Path() and not any('WAVE' in message for message in problems):
+        problems.append("No WAVE file given")
+
+    problems.extend(_lint_commands(tja))
+
+    for diff, (notes, branch_m, branch_e, branch_n) in all_notes.items():
+        balloons = [note for section in [notes, *branch_m, *branch_e, *branch_n]
+                    for note in section.play_notes if isinstance(note, Balloon)]
+        counts = tja.metadata.course_data[diff].balloon
+        if len(balloons) != len(counts):
+            problems.append(f"Course {diff} has {len(balloons)} balloons but {len(counts)} BALLOON counts")
+        if any(count <= 0 for count in counts):
+            problems.append(f"Course {diff} has a BALLOON count below 1: {counts}")
+    return problems
+
+def bench_tja(path: Path) -> tuple[float, int, int]:
+    """Parse every course of a TJA file and return the parse time in ms, the number of play notes and the peak memory in bytes."""
+    start = time.perf_counter()
+    all_notes = TJAParser(path).all_notes_to_position()
+    parse_ms = (time.perf_counter() - start) * 1000
+    note_count = sum(len(section.play_notes) for notes, branch_m, branch_e, branch_n in all_notes.values()
+                     for section in [notes, *branch_m, *branch_e, *branch_n])
+    del all_notes
+
+    # Measured in a second pass, tracemalloc slows parsing down too much to time it at the same time
+    tracemalloc.start()
+    TJAParser(path).all_notes_to_position()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return parse_ms, note_count, peak
+
+SCROLL_TOLERANCE_MS = 1e-6
+
+def compare_scroll_tja(path: Path) -> list[tuple[str, float, bool]]:
+    """Apply the scroll commands of every course of a TJA file with both ScrollTransform and the per command loop.
+    Returns the course, the largest hit_ms difference found and whether the fallback was used, for every course."""
+    results = []
+    for diff, (notes, branch_m, branch_e, branch_n) in TJAParser(path).all_notes_to_position().items():
+        legacy = copy.deepcopy(notes)
+        apply_scroll_commands_legacy(legacy.timeline, list(chain(legacy.draw_notes, legacy.bars)))
+        transformed = apply_scroll_commands(notes.timeline, chain(notes.draw_notes, notes.bars))
+        deviation = 0.0
+        for old, new in zip(chain(legacy.draw_notes, legacy.bars, legacy.timeline), chain(notes.draw_notes, notes.bars, notes.timeline)):
+            deviation = max(deviation, abs(old.hit_ms - new.hit_ms))
+        results.append((str(diff), deviation, not transformed))
+    return results
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Lint, benchmark or check the scroll transform of TJA files from the command line, without a window or audio device."""
+    parser = argparse.ArgumentParser(prog='python -m libs.tja', description='Check and time the parsing of TJA files')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    lint_parser = subparsers.add_parser('lint', help='Report malformed commands, branches, WAVE files and BALLOON counts')
+    lint_parser.add_argument('paths', nargs='+', type=Path, help='TJA files or directories to search for them')
+    bench_parser = subparsers.add_parser('bench', help='Print the parse time, note count and peak memory of each file')
+    bench_parser.add_argument('paths', nargs='+', type=Path, help='TJA files or directories to search for them')
+    bench_parser.add_argument('--top', type=int, default=0, help='Only print the slowest files')
+    scroll_parser = subparsers.add_parser('scroll', help='Check the HBSCROLL/BMSCROLL transform against the per command loop')
+    scroll_parser.add_argument('paths', nargs='+', type=Path, help='TJA files or directories to search for them')
+    args = parser.parse_args(argv)
+
+    tja_files = _find_tja_files(args.paths)
+    if args.command == 'lint':
+        bad_files = 0
+        for tja_path in tja_files:
+            problems = lint_tja(tja_path)
+            if problems:
+                bad_files += 1
+                for problem in problems:
+                    print(f"{tja_path}: {problem}")
+        print(f"{bad_files} of {len(tja_files)} files have problems")
+        return 1 if bad_files else 0
+
+    if args.command == 'scroll':
+        logger.setLevel(logging.ERROR)
+        mismatches = 0
+        for tja_path in tja_files:
+            try:
+                results = compare_scroll_tja(tja_path)
+            except Exception as e:
+                print(f"{tja_path}: Failed to parse: {e}")
+                continue
+            for diff, deviation, fallback in results:
+                if deviation > SCROLL_TOLERANCE_MS:
+                    mismatches += 1
+                    print(f"{tja_path}: course {diff} differs by up to {deviation}ms")
+                elif fallback:
+                    print(f"{tja_path}: course {diff} uses the per command fallback")
+        print(f"{mismatches} courses in {len(tja_files)} files differ by more than {SCROLL_TOLERANCE_MS}ms")
+        return 1 if mismatches else 0
+
+    # Parser warnings are what lint is for, keep them out of the timings table
+    logger.setLevel(logging.ERROR)
+    results = []
+    for tja_path in tja_files:
+        try:
+            results.append((*bench_tja(tja_path), tja_path))
+        except Exception as e:
+            print(f"{tja_path}: Failed to parse: {e}")
+    results.sort(key=lambda result: result[0], reverse=True)
+    print(f"{'ms':>9} {'notes':>7} {'peak KiB':>9}  file")
+    for parse_ms, note_count, peak, tja_path in results[:args.top or None]:
+        print(f"{parse_ms:9.2f} {note_count:7} {peak / 1024:9.0f}  {tja_path}")
+    print(f"{sum(result[0] for result in results):9.2f} ms total for {len(results)} files")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
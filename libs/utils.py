@@ -16,6 +16,7 @@ from raylib import (
     SHADER_UNIFORM_VEC4,
 )
 
+from libs.font_cache import load_font
 from libs.texture import TextureWrapper
 
 logger = logging.getLogger(__name__)
@@ -44,19 +45,6 @@ def get_current_ms() -> int:
     """Get the current time in milliseconds"""
     return rounded(time.time() * 1000)
 
-def strip_comments(code: str) -> str:
-    """Strip comments from a string of code"""
-    result = ''
-    index = 0
-    for line in code.splitlines():
-        comment_index = line.find('//')
-        if comment_index == -1:
-            result += line
-        elif comment_index != 0 and not line[:comment_index].isspace():
-            result += line[:comment_index]
-        index += 1
-    return result
-
 def is_input_key_pressed(keys: list[int], gamepad_buttons: list[int]):
     if global_data.input_locked:
         return False
@@ -160,6 +148,9 @@ class OutlinedText:
                 self.texture = self._create_text_vertical(text, font_size, color, ray.BLANK, self.font)
             else:
                 self.texture = self._create_text_horizontal(text, font_size, color, ray.BLANK, self.font, spacing=spacing)
+            if self.font is not global_data.font:
+                ray.unload_font(self.font)
+                self.font = global_data.font
         ray.gen_texture_mipmaps(self.texture)
         ray.set_texture_filter(self.texture, ray.TextureFilter.TEXTURE_FILTER_TRILINEAR)
         outline_size = ray.ffi.new('float*', self.outline_thickness)
@@ -193,17 +184,14 @@ class OutlinedText:
         return n.hexdigest()
 
     def _load_font_for_text(self, text: str) -> ray.Font:
-        reload_font = False
-        for character in text:
-            if character not in global_data.font_codepoints:
-                global_data.font_codepoints.add(character)
-                reload_font = True
-        if reload_font:
-            codepoint_count = ray.ffi.new('int *', 0)
-            codepoints = ray.load_codepoints(''.join(global_data.font_codepoints), codepoint_count)
-            global_data.font = ray.load_font_ex(str(Path(f'Skins/{global_data.config["paths"]["skin"]}/Graphics/Modified-DFPKanteiryu-XB.ttf')), 40, codepoints, len(global_data.font_codepoints))
-            logger.info(f"Reloaded font with {len(global_data.font_codepoints)} codepoints")
-        return global_data.font
+        """Get the shared font, or a font of just the characters of text if the shared one lacks some of them.
+        The missing characters are saved to the song index when the screen ends, so the next launch's atlas has them."""
+        new_characters = set(text) - global_data.font_codepoints
+        if not new_characters:
+            return global_data.font
+        global_data.pending_codepoints.update(new_characters)
+        logger.info(f"Loading a font for {len(new_characters)} characters missing from the font atlas")
+        return load_font(set(text))
 
     def _create_text_vertical(self, text: str, font_size: int, color: ray.Color, bg_color: ray.Color, font: Optional[ray.Font]=None, padding: int=10):
         rotate_chars = {'-', '‐', '|', '/', '\\', 'ー', '～', '~', '（', '）', '(', ')',
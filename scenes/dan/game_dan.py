@@ -15,6 +15,7 @@ from libs.global_data import (
     global_data,
 )
 from libs.global_objects import AllNetIcon
+from libs.song_watcher import song_watcher
 from libs.texture import tex
 from libs.tja import TJAParser
 from libs.transition import Transition
@@ -36,6 +37,7 @@ class DanGameScreen(GameScreen):
 
     @override
     def on_screen_start(self):
+        song_watcher.pause()
         self.mask_shader = ray.load_shader("shader/dummy.vs", "shader/mask.fs")
         self.current_ms = 0
         self.end_ms = 0
@@ -70,11 +72,11 @@ class DanGameScreen(GameScreen):
 
     def init_dan(self):
         session_data = global_data.session_data[global_data.player_num]
-        songs = copy.deepcopy(session_data.selected_dan)
+        songs = session_data.selected_dan
         self.exams = copy.deepcopy(session_data.selected_dan_exam)
         self.total_notes = 0
         for song, genre_index, difficulty, level in songs:
-            notes, branch_m, branch_e, branch_n = song.notes_to_position(difficulty)
+            notes, branch_m, branch_e, branch_n = song.load_notes(difficulty)
             self.total_notes += sum(1 for note in notes.play_notes if note.type < 5)
             for branch in branch_m:
                 self.total_notes += sum(1 for note in branch.play_notes if note.type < 5)
@@ -1,12 +1,11 @@
 import bisect
 import logging
 import math
-import sqlite3
 from collections import deque
 from enum import IntEnum
 from itertools import chain
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional
 
 import pyray as ray
 
@@ -23,17 +22,22 @@ from libs.global_data import (
 )
 from libs.global_objects import AllNetIcon, Nameplate
 from libs.screen import Screen
+from libs.song_watcher import song_watcher
 from libs.texture import tex
 from libs.tja import (
     Balloon,
     Drumroll,
     Note,
+    NoteArrays,
     NoteList,
     NoteType,
     TimelineObject,
     TJAParser,
     apply_modifiers,
+    apply_scroll_commands,
     calculate_base_score,
+    first_difference_ms,
+    splice_sorted,
 )
 from libs.transition import Transition
 from libs.utils import (
@@ -67,8 +71,10 @@ class Judgments(IntEnum):
 class GameScreen(Screen):
     JUDGE_X = 414 * tex.screen_scale
     JUDGE_Y = 256 * tex.screen_scale
+    HOT_RELOAD_INTERVAL = 500
     def on_screen_start(self):
         super().on_screen_start()
+        song_watcher.pause()
         self.mask_shader = ray.load_shader("shader/dummy.vs", "shader/mask.fs")
         self.current_ms = 0
         self.end_ms = 0
@@ -93,6 +99,8 @@ class GameScreen(Screen):
         session_data = global_data.session_data[global_data.player_num]
         self.init_tja(session_data.selected_song)
         logger.info(f"TJA initialized for song: {session_data.selected_song}")
+        self.chart_mtime = session_data.selected_song.stat().st_mtime
+        self.last_reload_check = 0
         self.load_hitsounds()
         self.song_info = SongInfo(session_data.song_title, session_data.genre_index)
         self.result_transition = ResultTransition(global_data.player_num)
@@ -118,6 +126,7 @@ class GameScreen(Screen):
         if self.background is not None:
             self.background.unload()
             logger.info("Background unloaded")
+        song_watcher.resume()
         return super().on_screen_end(next_screen)
 
     def load_hitsounds(self):
@@ -158,40 +167,22 @@ class GameScreen(Screen):
         """Write the score to the database"""
         if global_data.modifiers[global_data.player_num].auto:
             return
-        with sqlite3.connect(global_data.score_db) as con:
-            session_data = global_data.session_data[global_data.player_num]
-            cursor = con.cursor()
-            hash = session_data.song_hash
-            check_query = "SELECT score, clear FROM Scores WHERE hash = ? LIMIT 1"
-            cursor.execute(check_query, (hash,))
-            result = cursor.fetchone()
-            existing_score = result[0] if result is not None else None
-            existing_crown = result[1] if result is not None and len(result) > 1 and result[1] is not None else 0
-            crown = Crown.NONE
-            if session_data.result_data.bad and session_data.result_data.ok == 0:
-                crown = Crown.DFC
-            elif session_data.result_data.bad == 0:
-                crown = Crown.FC
-            elif self.player_1.gauge.is_clear:
-                crown = Crown.CLEAR
-            logger.info(f"Existing score: {existing_score}, Existing crown: {existing_crown}, New score: {session_data.result_data.score}, New crown: {crown}")
-            if result is None or (existing_score is not None and session_data.result_data.score > existing_score):
-                insert_query = '''
-                INSERT OR REPLACE INTO Scores (hash, en_name, jp_name, diff, score, good, ok, bad, drumroll, combo, clear)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-                '''
-                data = (hash, self.tja.metadata.title['en'],
-                        self.tja.metadata.title.get('ja', ''), self.player_1.difficulty,
-                        session_data.result_data.score, session_data.result_data.good,
-                        session_data.result_data.ok, session_data.result_data.bad,
-                        session_data.result_data.total_drumroll, session_data.result_data.max_combo, crown)
-                cursor.execute(insert_query, data)
-                session_data.result_data.prev_score = existing_score if existing_score is not None else 0
-                logger.info(f"Wrote score {session_data.result_data.score} for {self.tja.metadata.title['en']}")
-                con.commit()
-            if result is None or (existing_crown is not None and crown > existing_crown):
-                cursor.execute("UPDATE Scores SET clear = ? WHERE hash = ?", (crown, hash))
-                con.commit()
+        session_data = global_data.session_data[global_data.player_num]
+        crown = Crown.NONE
+        if session_data.result_data.bad and session_data.result_data.ok == 0:
+            crown = Crown.DFC
+        elif session_data.result_data.bad == 0:
+            crown = Crown.FC
+        elif self.player_1.gauge.is_clear:
+            crown = Crown.CLEAR
+        existing_score = global_data.score_repository.write_score(
+            session_data.song_hash, self.tja.metadata.title['en'],
+            self.tja.metadata.title.get('ja', ''), self.player_1.difficulty,
+            session_data.result_data.score, session_data.result_data.good,
+            session_data.result_data.ok, session_data.result_data.bad,
+            session_data.result_data.total_drumroll, session_data.result_data.max_combo, crown)
+        if existing_score is None or session_data.result_data.score > existing_score:
+            session_data.result_data.prev_score = existing_score if existing_score is not None else 0
 
     def start_song(self, ms_from_start):
         if (ms_from_start >= self.tja.metadata.offset*1000 + self.start_delay - global_data.config["general"]["audio_offset"]) and not self.song_started:
@@ -216,13 +207,48 @@ class GameScreen(Screen):
                 audio.seek_music_stream(self.song_music, self.audio_time)
             self.start_ms = get_current_ms() - self.pause_time
 
+    def restart_song(self):
+        if self.song_music is not None:
+            audio.stop_music_stream(self.song_music)
+        self.init_tja(global_data.session_data[global_data.player_num].selected_song)
+        audio.play_sound('restart', 'sound')
+        self.song_started = False
+
+    def check_hot_reload(self, current_time):
+        """Reload the chart when the TJA is saved, if hot_reload is enabled for charting"""
+        if not global_data.config["general"].get("hot_reload", False):
+            return
+        if current_time - self.last_reload_check < GameScreen.HOT_RELOAD_INTERVAL:
+            return
+        self.last_reload_check = current_time
+        song = global_data.session_data[global_data.player_num].selected_song
+        try:
+            mtime = song.stat().st_mtime
+        except OSError:
+            return
+        if mtime == self.chart_mtime:
+            return
+        self.chart_mtime = mtime
+        try:
+            tja = TJAParser(song, start_delay=self.start_delay)
+            self.reload_chart(tja)
+        except Exception as e:
+            logger.error(f"Failed to reload {song}: {e}")
+
+    def reload_chart(self, tja: TJAParser) -> bool:
+        """Apply a re-parsed chart to the song being played, restarting it if that can't be done in place.
+        Returns whether the chart was applied in place."""
+        if self.player_1.reload_chart(tja, self.current_ms):
+            self.tja = tja
+            logger.info(f"Hot reloaded {tja.file_path}")
+            return True
+        logger.info(f"Restarting to reload {tja.file_path}")
+        self.restart_song()
+        return False
+
     def global_keys(self):
         if ray.is_key_pressed(global_data.config["keys"]["restart_key"]):
-            if self.song_music is not None:
-                audio.stop_music_stream(self.song_music)
-            self.init_tja(global_data.session_data[global_data.player_num].selected_song)
-            audio.play_sound('restart', 'sound')
-            self.song_started = False
+            self.restart_song()
 
         if ray.is_key_pressed(global_data.config["keys"]["back_key"]):
             if self.song_music is not None:
@@ -264,6 +290,7 @@ class GameScreen(Screen):
         if self.song_music is not None:
             audio.update_music_stream(self.song_music)
 
+        self.check_hot_reload(current_time)
         self.player_1.update(self.current_ms, current_time, self.background)
         self.song_info.update(current_time)
         self.result_transition.update(current_time)
@@ -322,6 +349,7 @@ class Player:
         self.visual_offset = global_data.config["general"]["visual_offset"]
         self.score_method = global_data.config["general"]["score_method"]
         self.modifiers = modifiers
+        self.modifier_seed = global_data.session_data[player_num].modifier_seed
         self.tja = tja
 
         self.reset_chart()
@@ -383,7 +411,7 @@ class Player:
 
         normal_travel_ms = (travel_distance + note_half_w) / base_pixels_per_ms
 
-        if not hasattr(note, "sudden_appear_ms") or not hasattr(note, "sudden_moving_ms") or note.sudden_appear_ms == float("inf"):
+        if note.sudden_appear_ms == float("inf"):
             note.load_ms   = note.hit_ms - normal_travel_ms
             note.unload_ms = note.hit_ms + normal_travel_ms
             return
@@ -400,8 +428,8 @@ class Player:
 
 
     def reset_chart(self):
-        notes, self.branch_m, self.branch_e, self.branch_n = self.tja.notes_to_position(self.difficulty)
-        self.play_notes, self.draw_note_list, self.draw_bar_list = apply_modifiers(notes, self.modifiers)
+        notes, self.branch_m, self.branch_e, self.branch_n = self.tja.load_notes(self.difficulty)
+        self.play_notes, self.draw_note_list, self.draw_bar_list = apply_modifiers(notes, self.modifiers, self.modifier_seed)
 
         self.don_notes = deque([note for note in self.play_notes if note.type in {NoteType.DON, NoteType.DON_L}])
         self.kat_notes = deque([note for note in self.play_notes if note.type in {NoteType.KAT, NoteType.KAT_L}])
@@ -449,40 +477,12 @@ class Player:
         self.bpm = 120
         if self.timeline and hasattr(self.timeline[self.timeline_index], 'bpm'):
             self.bpm = self.timeline[self.timeline_index].bpm
-        last_note = self.draw_note_list[0]
-        for note in chain(self.draw_note_list, self.draw_bar_list):
-            self.get_load_time(note)
-            if note.type == NoteType.TAIL:
-                note.load_ms = last_note.load_ms
-                last_note.unload_ms = note.unload_ms
-            last_note = note
-
-        self.draw_note_list = deque(sorted(self.draw_note_list, key=lambda n: n.load_ms))
+        note_half_w = tex.textures["notes"]["1"].width // 2
+        travel_distance = tex.screen_width - GameScreen.JUDGE_X
+        self.draw_note_list, self.draw_bar_list = self.sort_by_load_time(self.draw_note_list, self.draw_bar_list)
 
         # Handle HBSCROLL, BMSCROLL (pre-modify hit_ms, so that notes can't be literally hit, but are still visually different) - basically it applies the transformations of #BPMCHANGE and #DELAY to hit_ms, so that notes can't be hit even if its visaulyl
-        for i, o in enumerate(self.timeline):
-            if hasattr(o, 'bpmchange'):
-                hit_ms = o.hit_ms
-                bpmchange = o.bpmchange
-                for note in chain(self.draw_note_list, self.draw_bar_list):
-                    if note.hit_ms > hit_ms:
-                        note.hit_ms = (note.hit_ms - hit_ms) / bpmchange + hit_ms
-                for i2 in range(i + 1, len(self.timeline)):
-                    o2 = self.timeline[i2]
-                    if not hasattr(o2, 'bpmchange'):
-                        continue
-                    o2.hit_ms = (o2.hit_ms - hit_ms) / bpmchange + hit_ms
-            elif hasattr(o, 'delay'):
-                hit_ms = o.hit_ms
-                delay = o.delay
-                for note in chain(self.draw_note_list, self.draw_bar_list):
-                    if note.hit_ms > hit_ms:
-                        note.hit_ms += delay
-                for i2 in range(i + 1, len(self.timeline)):
-                    o2 = self.timeline[i2]
-                    if not hasattr(o2, 'delay'):
-                        continue
-                    o2.hit_ms += delay
+        apply_scroll_commands(self.timeline, chain(self.draw_note_list, self.draw_bar_list))
 
         # Decide end_time after all transforms have been applied
         self.end_time = self.play_notes[-1].hit_ms if self.play_notes else 0
@@ -491,31 +491,103 @@ class Player:
             if branch:
                 for section in branch:
                     if section.draw_notes:
-                        for note in section.draw_notes:
-                            self.get_load_time(note)
-                        section.draw_notes = sorted(section.draw_notes, key=lambda n: n.load_ms)
+                        section_arrays = NoteArrays.from_notes(section.draw_notes)
+                        section_arrays.compute_load_times(travel_distance, note_half_w)
+                        section.draw_notes = section_arrays.sorted_by_load_ms()
                     if section.bars:
-                        for note in section.bars:
-                            self.get_load_time(note)
-                        section.bars = sorted(section.bars, key=lambda n: n.load_ms)
+                        section_arrays = NoteArrays.from_notes(section.bars)
+                        section_arrays.compute_load_times(travel_distance, note_half_w)
+                        section.bars = section_arrays.sorted_by_load_ms()
                     if section.play_notes:
                         self.end_time = max(self.end_time, section.play_notes[-1].hit_ms)
 
     def merge_branch_section(self, branch_section: NoteList, current_ms: float):
-        """Merges the branch notes into the current notes"""
-        self.play_notes.extend(branch_section.play_notes)
-        self.draw_note_list.extend(branch_section.draw_notes)
-        self.draw_bar_list.extend(branch_section.bars)
-        self.play_notes = deque(sorted(self.play_notes))
-        self.draw_note_list = deque(sorted(self.draw_note_list, key=lambda x: x.hit_ms))
-        self.draw_bar_list = deque(sorted(self.draw_bar_list, key=lambda x: x.hit_ms))
-        total_don = [note for note in self.play_notes if note.type in {NoteType.DON, NoteType.DON_L}]
-        total_kat = [note for note in self.play_notes if note.type in {NoteType.KAT, NoteType.KAT_L}]
-        total_other = [note for note in self.play_notes if note.type not in {NoteType.DON, NoteType.DON_L, NoteType.KAT, NoteType.KAT_L}]
-
-        self.don_notes = deque([note for note in total_don if note.hit_ms > current_ms])
-        self.kat_notes = deque([note for note in total_kat if note.hit_ms > current_ms])
-        self.other_notes = deque([note for note in total_other if note.hit_ms > current_ms])
+        """Merges the branch notes into the current notes
+
+        Every list involved is already sorted, so the section is spliced in
+        behind the notes that come before it instead of re-sorting the chart."""
+        upcoming = [note for note in branch_section.play_notes if note.hit_ms > current_ms]
+        splice_sorted(self.play_notes, branch_section.play_notes, key=lambda x: x.hit_ms)
+        splice_sorted(self.draw_note_list, branch_section.draw_notes, key=lambda x: x.load_ms)
+        splice_sorted(self.draw_bar_list, branch_section.bars, key=lambda x: x.load_ms)
+        splice_sorted(self.don_notes, [note for note in upcoming if note.type in {NoteType.DON, NoteType.DON_L}], key=lambda x: x.hit_ms)
+        splice_sorted(self.kat_notes, [note for note in upcoming if note.type in {NoteType.KAT, NoteType.KAT_L}], key=lambda x: x.hit_ms)
+        splice_sorted(self.other_notes, [note for note in upcoming if note.type not in {NoteType.DON, NoteType.DON_L, NoteType.KAT, NoteType.KAT_L}], key=lambda x: x.hit_ms)
+
+    def sort_by_load_time(self, draw_notes: Iterable[Note], bars: Iterable[Note]) -> tuple[deque, deque]:
+        """Computes when the notes and bars enter and leave the lane and sorts them in that order"""
+        note_half_w = tex.textures["notes"]["1"].width // 2
+        travel_distance = tex.screen_width - GameScreen.JUDGE_X
+        draw_note_arrays = NoteArrays.from_notes(draw_notes)
+        draw_note_arrays.compute_load_times(travel_distance, note_half_w, link_tails=True)
+        draw_bar_arrays = NoteArrays.from_notes(bars)
+        draw_bar_arrays.compute_load_times(travel_distance, note_half_w)
+        return deque(draw_note_arrays.sorted_by_load_ms()), deque(draw_bar_arrays.sorted_by_load_ms())
+
+    def reload_chart(self, tja: TJAParser, current_ms: float) -> bool:
+        """Splices the measures of a re-parsed chart that changed into the running chart
+
+        Everything before the first changed measure, or before the measure being played, is kept,
+        so score, combo and gauge carry on. Returns False if the change can't be applied in place
+        (a header, branch or HBSCROLL/BMSCROLL chart change) and the song has to be restarted."""
+        if (tja.metadata.bpm != self.tja.metadata.bpm or tja.metadata.offset != self.tja.metadata.offset
+                or self.difficulty not in tja.metadata.course_data):
+            return False
+        old_notes, *old_branches = self.tja.load_notes(self.difficulty)
+        new_notes, *new_branches = tja.load_notes(self.difficulty)
+        if any(old_branches) or any(new_branches):
+            return False
+        # The scroll types rewrite hit_ms of everything after a change in reset_chart, so nothing can be kept
+        if any(hasattr(o, 'bpmchange') or hasattr(o, 'delay') for o in chain(old_notes.timeline, new_notes.timeline)):
+            return False
+
+        self.tja = tja
+        changed_ms = first_difference_ms(old_notes, new_notes)
+        if changed_ms is None:
+            return True
+
+        # Cut at a measure boundary that is still ahead and not in the middle of a drumroll or balloon
+        rolls = [(head.hit_ms, tail.hit_ms)
+                 for notes in (old_notes.play_notes, new_notes.play_notes)
+                 for head, tail in NoteArrays.from_notes(notes).roll_tails()]
+        bar_times = sorted({bar.hit_ms for bar in chain(old_notes.bars, new_notes.bars)})
+        measure_start = bisect.bisect_right(bar_times, changed_ms) - 1
+        start_ms = bar_times[measure_start] if measure_start >= 0 else changed_ms
+        cut_ms = next((bar_ms for bar_ms in sorted({start_ms, *bar_times})
+                       if bar_ms >= start_ms and bar_ms > current_ms
+                       and not any(head < bar_ms <= tail for head, tail in rolls)), None)
+        if cut_ms is None:
+            logger.info(f"Chart changed at {changed_ms}ms, which has already been played")
+            return True
+
+        play_notes, draw_notes, bars = apply_modifiers(new_notes, self.modifiers, self.modifier_seed)
+        draw_notes, bars = self.sort_by_load_time(draw_notes, bars)
+        new_play_notes = [note for note in play_notes if note.hit_ms >= cut_ms]
+
+        self.play_notes = deque(note for note in self.play_notes if note.hit_ms < cut_ms)
+        self.play_notes.extend(new_play_notes)
+        self.don_notes = deque(note for note in self.don_notes if note.hit_ms < cut_ms)
+        self.don_notes.extend(note for note in new_play_notes if note.type in {NoteType.DON, NoteType.DON_L})
+        self.kat_notes = deque(note for note in self.kat_notes if note.hit_ms < cut_ms)
+        self.kat_notes.extend(note for note in new_play_notes if note.type in {NoteType.KAT, NoteType.KAT_L})
+        self.other_notes = deque(note for note in self.other_notes if note.hit_ms < cut_ms)
+        self.other_notes.extend(note for note in new_play_notes if note.type not in {NoteType.DON, NoteType.DON_L, NoteType.KAT, NoteType.KAT_L})
+
+        self.current_notes_draw = [note for note in self.current_notes_draw if note.hit_ms < cut_ms]
+        self.current_bars = [bar for bar in self.current_bars if bar.hit_ms < cut_ms]
+        self.draw_note_list = deque(note for note in self.draw_note_list if note.hit_ms < cut_ms)
+        splice_sorted(self.draw_note_list, [note for note in draw_notes if note.hit_ms >= cut_ms], key=lambda x: x.load_ms)
+        self.draw_bar_list = deque(bar for bar in self.draw_bar_list if bar.hit_ms < cut_ms)
+        splice_sorted(self.draw_bar_list, [bar for bar in bars if bar.hit_ms >= cut_ms], key=lambda x: x.load_ms)
+
+        self.timeline = new_notes.timeline
+        self.timeline_index = len([o for o in self.timeline if o.hit_ms < current_ms])
+        self.total_notes = len([note for note in self.play_notes if 0 < note.type < 5])
+        if self.score_method == ScoreMethod.SHINUCHI:
+            self.base_score = calculate_base_score(new_notes)
+        self.end_time = self.play_notes[-1].hit_ms if self.play_notes else 0
+        logger.info(f"Reloaded chart from {cut_ms}ms, first change at {changed_ms}ms")
+        return True
 
     def get_result_score(self):
         """Returns the score, good count, ok count, bad count, max combo, and total drumroll"""
@@ -673,9 +745,9 @@ class Player:
         bar = self.current_bars[0]
         if current_ms >= bar.unload_ms:
             self.current_bars.pop(0)
-        if self.current_bars and hasattr(self.current_bars[-1], 'branch_params'):
+        if self.current_bars and self.current_bars[-1].branch_params:
             self.branch_condition, e_req, m_req = self.current_bars[-1].branch_params.split(',')
-            delattr(self.current_bars[-1], 'branch_params')
+            self.current_bars[-1].branch_params = ''
             e_req = float(e_req)
             m_req = float(m_req)
             logger.info(f'branch condition measures started with conditions {self.branch_condition}, {e_req}, {m_req}, {self.current_bars[-1].hit_ms}')
@@ -696,11 +768,12 @@ class Player:
                         self.draw_note_list if self.draw_note_list else []
                     ]
 
+                    # Notes at the same time with the same type and scroll count once, even across branches
                     seen_notes = set()
                     for notes in note_lists:
                         for note in notes:
                             if note.type <= 4 and start_time <= note.hit_ms < branch_start_time:
-                                seen_notes.add(note)
+                                seen_notes.add((note.hit_ms, note.type, note.bpm, note.scroll_x, note.scroll_y, type(note)))
 
                     self.curr_branch_reqs = [e_req, m_req, branch_start_time, max(len(seen_notes), 1)]
     def play_note_manager(self, current_ms: float, background: Optional[Background]):
@@ -1156,13 +1229,12 @@ class Player:
 
     def draw_drumroll(self, current_ms: float, head: Drumroll, current_eighth: int):
         """Draws a drumroll in the player's lane"""
-        if hasattr(head, 'sudden_appear_ms') and hasattr(head, 'sudden_moving_ms'):
-            appear_ms = head.hit_ms - head.sudden_appear_ms
-            moving_start_ms = head.hit_ms - head.sudden_moving_ms
-            if current_ms < appear_ms:
-                return
-            if current_ms < moving_start_ms:
-                current_ms = moving_start_ms
+        appear_ms = head.hit_ms - head.sudden_appear_ms
+        moving_start_ms = head.hit_ms - head.sudden_moving_ms
+        if current_ms < appear_ms:
+            return
+        if current_ms < moving_start_ms:
+            current_ms = moving_start_ms
         start_position = self.get_position_x(head, current_ms)
         tail = next((note for note in self.current_notes_draw[1:] if note.type == NoteType.TAIL and note.index > head.index), self.current_notes_draw[1])
         is_big = int(head.type == NoteType.ROLL_HEAD_L)
@@ -1188,13 +1260,12 @@ class Player:
     def draw_balloon(self, current_ms: float, head: Balloon, current_eighth: int):
         """Draws a balloon in the player's lane"""
         offset = tex.skin_config["balloon_offset"].x
-        if hasattr(head, 'sudden_appear_ms') and hasattr(head, 'sudden_moving_ms'):
-            appear_ms = head.hit_ms - head.sudden_appear_ms
-            moving_start_ms = head.hit_ms - head.sudden_moving_ms
-            if current_ms < appear_ms:
-                return
-            if current_ms < moving_start_ms:
-                current_ms = moving_start_ms
+        appear_ms = head.hit_ms - head.sudden_appear_ms
+        moving_start_ms = head.hit_ms - head.sudden_moving_ms
+        if current_ms < appear_ms:
+            return
+        if current_ms < moving_start_ms:
+            current_ms = moving_start_ms
         start_position = self.get_position_x(head, current_ms)
         tail = next((note for note in self.current_notes_draw[1:] if note.type == NoteType.TAIL and note.index > head.index), self.current_notes_draw[1])
         end_position = self.get_position_x(tail, current_ms)
@@ -1244,22 +1315,19 @@ class Player:
             current_eighth = 0
             if self.combo >= 50 and eighth_in_ms != 0:
                 current_eighth = int(current_ms // eighth_in_ms)
-            if hasattr(note, 'sudden_appear_ms') and hasattr(note, 'sudden_moving_ms'):
-                appear_ms = note.hit_ms - note.sudden_appear_ms
-                moving_start_ms = note.hit_ms - note.sudden_moving_ms
+            # Without #SUDDEN both times are inf, so notes are always shown and moving
+            appear_ms = note.hit_ms - note.sudden_appear_ms
+            moving_start_ms = note.hit_ms - note.sudden_moving_ms
 
-                if current_ms < appear_ms:
-                    continue
+            if current_ms < appear_ms:
+                continue
 
-                if current_ms < moving_start_ms:
-                    effective_ms = moving_start_ms
-                else:
-                    effective_ms = current_ms
-                x_position = self.get_position_x(note, effective_ms)
-                y_position = self.get_position_y(note, current_ms)
+            if current_ms < moving_start_ms:
+                effective_ms = moving_start_ms
             else:
-                x_position = self.get_position_x(note, current_ms)
-                y_position = self.get_position_y(note, current_ms)
+                effective_ms = current_ms
+            x_position = self.get_position_x(note, effective_ms)
+            y_position = self.get_position_y(note, current_ms)
             x_position += self.judge_x
             y_position += self.judge_y
             if isinstance(note, Drumroll):
@@ -1,14 +1,15 @@
 import logging
 import threading
-from pathlib import Path
 
 import pyray as ray
 
 from libs.animation import Animation
 from libs.file_navigator import navigator
+from libs.font_cache import load_font
 from libs.global_objects import AllNetIcon
 from libs.screen import Screen
 from libs.song_hash import build_song_hashes
+from libs.song_watcher import song_watcher
 from libs.texture import tex
 from libs.utils import get_current_ms, global_data
 
@@ -39,29 +40,20 @@ class LoadScreen(Screen):
 
     def _load_song_hashes(self):
         """Background thread function to load song hashes"""
-        global_data.song_hashes = build_song_hashes()
+        global_data.song_index = build_song_hashes()
         self.songs_loaded = True
         logger.info("Song hashes loaded")
 
     def _load_font(self):
-        for hash in global_data.song_hashes:
-            song_entry = global_data.song_hashes[hash]
-            for song in song_entry:
-                titles = song.get('title', dict())
-                subtitles = song.get('subtitle', dict())
-                for title in titles.values():
-                    for character in title:
-                        global_data.font_codepoints.add(character)
-                for subtitle in subtitles.values():
-                    for character in subtitle:
-                        global_data.font_codepoints.add(character)
-        codepoint_count = ray.ffi.new('int *', 0)
-        codepoints = ray.load_codepoints(''.join(global_data.font_codepoints), codepoint_count)
-        global_data.font = ray.load_font_ex(str(Path(f'Skins/{global_data.config["paths"]["skin"]}/Graphics/Modified-DFPKanteiryu-XB.ttf')), 40, codepoints, len(global_data.font_codepoints))
+        global_data.song_index.add_codepoints(''.join(global_data.font_codepoints))
+        global_data.font_codepoints.update(global_data.song_index.codepoints())
+        global_data.font = load_font(global_data.font_codepoints, global_data.song_index.codepoints_hash())
 
     def _load_navigator(self):
         """Background thread function to load navigator"""
         self.navigator.initialize(global_data.config["paths"]["tja_path"])
+        if global_data.config["general"].get("watch_songs", False):
+            song_watcher.start(global_data.config["paths"]["tja_path"])
         self.loading_complete = True
         logger.info("Navigator initialized")
 
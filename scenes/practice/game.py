@@ -1,4 +1,3 @@
-import copy
 import logging
 import math
 from collections import deque
@@ -15,6 +14,7 @@ from libs.texture import tex
 from libs.tja import (
     Balloon,
     Drumroll,
+    NoteArrays,
     NoteType,
     TimelineObject,
     TJAParser,
@@ -47,21 +47,35 @@ class PracticeGameScreen(GameScreen):
     def init_tja(self, song: Path):
         """Initialize the TJA file"""
         self.tja = TJAParser(song, start_delay=self.start_delay)
-        self.scrobbling_tja = TJAParser(song, start_delay=self.start_delay)
         global_data.session_data[global_data.player_num].song_title = self.tja.metadata.title.get(global_data.config['general']['language'].lower(), self.tja.metadata.title['en'])
         if self.tja.metadata.wave.exists() and self.tja.metadata.wave.is_file() and self.song_music is None:
             self.song_music = audio.load_music_stream(self.tja.metadata.wave, 'song')
         self.player_1 = PracticePlayer(self.tja, global_data.player_num, global_data.session_data[global_data.player_num].selected_difficulty, False, global_data.modifiers[global_data.player_num])
-        notes, branch_m, branch_e, branch_n = self.tja.notes_to_position(self.player_1.difficulty)
-        self.scrobble_timeline = notes.timeline
-        _, self.scrobble_note_list, self.bars = apply_modifiers(notes, self.player_1.modifiers)
         self.start_ms = (get_current_ms() - self.tja.metadata.offset*1000)
         self.scrobble_index = 0
+        self.init_scrobble()
+
+    def init_scrobble(self):
+        """Build the paused view of the whole chart"""
+        notes, branch_m, branch_e, branch_n = self.tja.load_notes(self.player_1.difficulty)
+        self.scrobble_timeline = notes.timeline
+        _, self.scrobble_note_list, self.bars = apply_modifiers(notes, self.player_1.modifiers, self.player_1.modifier_seed)
+        self.scrobble_note_arrays = NoteArrays.from_notes(sorted(self.scrobble_note_list, key=lambda n: n.hit_ms), self.scrobble_timeline)
+        self.scrobble_bar_arrays = NoteArrays.from_notes(sorted(self.bars, key=lambda n: n.hit_ms))
+        self.scrobble_tails = {id(head): tail for head, tail in self.scrobble_note_arrays.roll_tails()}
+        self.scrobble_index = min(self.scrobble_index, len(self.bars) - 1)
         self.scrobble_time = self.bars[self.scrobble_index].hit_ms
         self.scrobble_move = Animation.create_move(200, total_distance=0)
 
         self.markers = self.get_gogotime_markers(self.scrobble_timeline)
 
+    def reload_chart(self, tja: TJAParser) -> bool:
+        # A restart already rebuilt the paused view through init_tja
+        if not super().reload_chart(tja):
+            return False
+        self.init_scrobble()
+        return True
+
     def get_gogotime_markers(self, timeline: list[TimelineObject]):
         marker_list = []
         for obj in timeline:
@@ -97,8 +111,6 @@ class PracticeGameScreen(GameScreen):
             resume_time = self.bars[resume_bar_index].hit_ms - first_bar_time + self.start_delay
             start_time = self.bars[previous_bar_index].hit_ms - first_bar_time + self.start_delay
 
-            tja_copy = copy.deepcopy(self.scrobbling_tja)
-            self.player_1.tja = tja_copy
             self.player_1.reset_chart()
 
             self.player_1.don_notes = deque([note for note in self.player_1.don_notes if note.hit_ms > resume_time])
@@ -116,11 +128,7 @@ class PracticeGameScreen(GameScreen):
 
     def global_keys(self):
         if ray.is_key_pressed(global_data.config["keys"]["restart_key"]):
-            if self.song_music is not None:
-                audio.stop_music_stream(self.song_music)
-            self.init_tja(global_data.session_data[global_data.player_num].selected_song)
-            audio.play_sound('restart', 'sound')
-            self.song_started = False
+            self.restart_song()
 
         if ray.is_key_pressed(global_data.config["keys"]["back_key"]):
             if self.song_music is not None:
@@ -166,6 +174,7 @@ class PracticeGameScreen(GameScreen):
             self.scrobble_time = self.bars[self.scrobble_index].hit_ms
             self.scrobble_move.reset()
 
+        self.check_hot_reload(current_time)
         self.player_1.update(self.current_ms, current_time, self.background)
         self.song_info.update(current_time)
 
@@ -183,7 +192,7 @@ class PracticeGameScreen(GameScreen):
     def draw_drumroll(self, current_ms: float, head: Drumroll):
         """Draws a drumroll in the player's lane"""
         start_position = self.get_position_x(head, current_ms)
-        tail = next((note for note in self.scrobble_note_list if note.type == NoteType.TAIL and note.index > head.index), self.scrobble_note_list[1])
+        tail = self.scrobble_tails.get(id(head), self.scrobble_note_list[1])
         is_big = int(head.type == NoteType.ROLL_HEAD_L)
         end_position = self.get_position_x(tail, current_ms)
         length = end_position - start_position
@@ -205,15 +214,14 @@ class PracticeGameScreen(GameScreen):
     def draw_balloon(self, current_ms: float, head: Balloon):
         """Draws a balloon in the player's lane"""
         offset = tex.skin_config["balloon_offset"].x
-        if hasattr(head, 'sudden_appear_ms') and hasattr(head, 'sudden_moving_ms'):
-            appear_ms = head.hit_ms - head.sudden_appear_ms
-            moving_start_ms = head.hit_ms - head.sudden_moving_ms
-            if current_ms < appear_ms:
-                return
-            if current_ms < moving_start_ms:
-                current_ms = moving_start_ms
+        appear_ms = head.hit_ms - head.sudden_appear_ms
+        moving_start_ms = head.hit_ms - head.sudden_moving_ms
+        if current_ms < appear_ms:
+            return
+        if current_ms < moving_start_ms:
+            current_ms = moving_start_ms
         start_position = self.get_position_x(head, current_ms)
-        tail = next((note for note in self.scrobble_note_list if note.type == NoteType.TAIL and note.index > head.index), self.scrobble_note_list[1])
+        tail = self.scrobble_tails.get(id(head), self.scrobble_note_list[1])
         end_position = self.get_position_x(tail, current_ms)
         pause_position = GameScreen.JUDGE_X
         y = tex.skin_config["notes"].y + self.get_position_y(head, current_ms)
@@ -269,8 +277,13 @@ class PracticeGameScreen(GameScreen):
         self.background.draw()
         self.player_1.draw(self.current_ms, self.start_ms, self.mask_shader)
         if self.paused:
-            self.draw_bars(self.scrobble_time, self.bars)
-            self.draw_notes(self.scrobble_time, self.scrobble_note_list)
+            # Only the notes that can reach the screen are drawn, including the scrobble move offset
+            distance = tex.screen_width + abs(self.scrobble_move.attribute)
+            travel_distance = tex.screen_width - GameScreen.JUDGE_X
+            bars = self.scrobble_bar_arrays.window(self.scrobble_time, distance, travel_distance)
+            notes = self.scrobble_note_arrays.window(self.scrobble_time, distance, travel_distance)
+            self.draw_bars(self.scrobble_time, self.scrobble_bar_arrays.notes[bars.start:bars.stop])
+            self.draw_notes(self.scrobble_time, self.scrobble_note_arrays.notes[notes.start:notes.stop])
         tex.draw_texture('practice', 'large_drum', index=0)
         tex.draw_texture('practice', 'large_drum', index=1)
         self.player_1.draw_overlays(self.mask_shader)
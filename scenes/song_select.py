@@ -27,6 +27,7 @@ from libs.global_objects import (
     Timer,
 )
 from libs.screen import Screen
+from libs.song_watcher import song_watcher
 from libs.texture import tex
 from libs.transition import Transition
 from libs.utils import (
@@ -116,7 +117,7 @@ class SongSelectScreen(Screen):
 
     def finalize_song(self, current_item: SongFile):
         global_data.session_data[global_data.player_num].selected_song = current_item.path
-        global_data.session_data[global_data.player_num].song_hash = global_data.song_hashes[current_item.hash][0]["diff_hashes"][self.player_1.selected_difficulty]
+        global_data.session_data[global_data.player_num].song_hash = global_data.song_index.get_diff_hashes(current_item.hash)[self.player_1.selected_difficulty]
         global_data.session_data[global_data.player_num].selected_difficulty = self.player_1.selected_difficulty
         global_data.session_data[global_data.player_num].genre_index = current_item.box.genre_index
 
@@ -311,6 +312,11 @@ class SongSelectScreen(Screen):
             if self.game_transition.is_finished:
                 return self.on_screen_end(next_screen)
         else:
+            if self.state == State.BROWSING:
+                # Songs added or removed while the game is running, only picked up between selections
+                changed_songs = song_watcher.pop_changes()
+                if changed_songs:
+                    self.navigator.refresh_songs(changed_songs)
             self.handle_input()
 
         if self.demo_song is not None:
@@ -1,4 +1,3 @@
-import copy
 import logging
 from pathlib import Path
 
@@ -68,11 +67,7 @@ class TwoPlayerGameScreen(GameScreen):
 
     def global_keys(self):
         if ray.is_key_pressed(ray.KeyboardKey.KEY_F1):
-            if self.song_music is not None:
-                audio.stop_music_stream(self.song_music)
-            self.init_tja(global_data.session_data[global_data.player_num].selected_song)
-            audio.play_sound('restart', 'sound')
-            self.song_started = False
+            self.restart_song()
             logger.info("F1 pressed: song restarted")
 
         if ray.is_key_pressed(ray.KeyboardKey.KEY_ESCAPE):
@@ -93,12 +88,21 @@ class TwoPlayerGameScreen(GameScreen):
         if self.tja.metadata.wave.exists() and self.tja.metadata.wave.is_file() and self.song_music is None:
             self.song_music = audio.load_music_stream(self.tja.metadata.wave, 'song')
 
-        tja_copy = copy.deepcopy(self.tja)
         self.player_1 = Player(self.tja, PlayerNum.P1, global_data.session_data[PlayerNum.P1].selected_difficulty, False, global_data.modifiers[PlayerNum.P1])
-        self.player_2 = Player(tja_copy, PlayerNum.P2, global_data.session_data[PlayerNum.P2].selected_difficulty, True, global_data.modifiers[PlayerNum.P2])
+        self.player_2 = Player(self.tja, PlayerNum.P2, global_data.session_data[PlayerNum.P2].selected_difficulty, True, global_data.modifiers[PlayerNum.P2])
         self.start_ms = (get_current_ms() - self.tja.metadata.offset*1000)
         logger.info(f"TJA initialized for two-player song: {song}")
 
+    def reload_chart(self, tja: TJAParser) -> bool:
+        """Apply a re-parsed chart to both players, restarting the song if either can't take it in place"""
+        if self.player_1.reload_chart(tja, self.current_ms) and self.player_2.reload_chart(tja, self.current_ms):
+            self.tja = tja
+            logger.info(f"Hot reloaded {tja.file_path}")
+            return True
+        logger.info(f"Restarting to reload {tja.file_path}")
+        self.restart_song()
+        return False
+
     def spawn_ending_anims(self):
         if global_data.session_data[PlayerNum.P1].result_data.bad == 0:
             self.player_1.ending_anim = FCAnimation(self.player_1.is_2p)
@@ -128,6 +132,7 @@ class TwoPlayerGameScreen(GameScreen):
         if self.song_music is not None:
             audio.update_music_stream(self.song_music)
 
+        self.check_hot_reload(current_time)
         self.player_1.update(self.current_ms, current_time, self.background)
         self.player_2.update(self.current_ms, current_time, self.background)
         self.song_info.update(current_time)
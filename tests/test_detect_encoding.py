@@ -0,0 +1,36 @@
+import codecs
+import unittest
+
+from libs.tja import ENCODING_SNIFF_SIZE, detect_encoding
+
+TEXT = 'TITLE:さいたま2000\nSUBTITLE:--ワンダーモモーイ\nBPM:200\n'
+
+
+class DetectEncodingTest(unittest.TestCase):
+    def test_utf8_bom(self):
+        self.assertEqual(detect_encoding(codecs.BOM_UTF8 + TEXT.encode('utf-8')), (TEXT, 'utf-8-sig'))
+
+    def test_utf16_bom(self):
+        self.assertEqual(detect_encoding(TEXT.encode('utf-16')), (TEXT, 'utf-16'))
+
+    def test_shift_jis(self):
+        self.assertEqual(detect_encoding(TEXT.encode('shift-jis')), (TEXT, 'shift-jis'))
+
+    def test_utf8_character_split_at_sniff_boundary(self):
+        text = 'a' * (ENCODING_SNIFF_SIZE - 1) + 'あ' + TEXT
+        data = text.encode('utf-8')
+        # The prefix ends in the middle of the three bytes of あ
+        self.assertRaises(UnicodeDecodeError, data[:ENCODING_SNIFF_SIZE].decode, 'utf-8')
+        self.assertEqual(detect_encoding(data), (text, 'utf-8-sig'))
+
+    def test_wrong_hint(self):
+        # A utf-8 file re-saved from shift-jis is not decoded with the stale hint
+        self.assertEqual(detect_encoding(TEXT.encode('utf-8'), 'shift-jis'), (TEXT, 'utf-8-sig'))
+        # A hint the bytes cannot be is skipped
+        self.assertEqual(detect_encoding(TEXT.encode('shift-jis'), 'utf-8-sig'), (TEXT, 'shift-jis'))
+        # An ascii file cannot tell them apart, so the hint is kept
+        self.assertEqual(detect_encoding(b'BPM:200\n', 'shift-jis'), ('BPM:200\n', 'shift-jis'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from libs.global_data import Modifiers
+from libs.tja import ModifierOverlay, Note, NoteList, NoteType, apply_modifiers
+
+
+def make_notes() -> NoteList:
+    types = [NoteType.DON, NoteType.KAT, NoteType.DON_L, NoteType.KAT_L] * 25
+    play_notes = [Note(type=note_type, hit_ms=i * 100, index=i) for i, note_type in enumerate(types)]
+    # Draw notes are the same objects as the play notes, in their own order
+    draw_notes = sorted(play_notes, key=lambda note: note.index % 7)
+    bars = [Note(type=NoteType.NONE, hit_ms=i * 400) for i in range(25)]
+    return NoteList(play_notes=play_notes, draw_notes=draw_notes, bars=bars)
+
+
+def snapshot(notes: NoteList) -> list[tuple]:
+    return [(id(note), note.type, note.scroll_x, note.display)
+            for note in notes.play_notes + notes.draw_notes + notes.bars]
+
+
+class ModifierOverlayTest(unittest.TestCase):
+    def test_same_seed_same_result(self):
+        notes = make_notes()
+        modifiers = Modifiers(random=2)
+        first = ModifierOverlay.from_modifiers(notes, modifiers, seed=42)
+        second = ModifierOverlay.from_modifiers(notes, modifiers, seed=42)
+        self.assertEqual(first, second)
+        self.assertNotEqual(list(first.types), [note.type for note in notes.play_notes])
+        play_a, _, _ = apply_modifiers(notes, modifiers, seed=42)
+        play_b, _, _ = apply_modifiers(notes, modifiers, seed=42)
+        self.assertEqual([note.type for note in play_a], [note.type for note in play_b])
+
+    def test_source_unchanged(self):
+        notes = make_notes()
+        before = snapshot(notes)
+        apply_modifiers(notes, Modifiers(speed=2.0, display=True, inverse=True, random=1), seed=7)
+        self.assertEqual(snapshot(notes), before)
+
+    def test_play_and_draw_share_copies(self):
+        notes = make_notes()
+        play_notes, draw_notes, bars = apply_modifiers(notes, Modifiers(speed=1.5, inverse=True), seed=0)
+        play_by_index = {note.index: note for note in play_notes}
+        for note in draw_notes:
+            self.assertIs(play_by_index[note.index], note)
+            self.assertEqual(note.scroll_x, 1.5)
+        for note, source in zip(play_notes, notes.play_notes):
+            self.assertIsNot(note, source)
+        self.assertTrue(all(bar.scroll_x == 1.5 for bar in bars))
+
+    def test_no_modifiers_keeps_notes(self):
+        notes = make_notes()
+        play_notes, draw_notes, bars = apply_modifiers(notes, Modifiers())
+        self.assertTrue(all(a is b for a, b in zip(play_notes, notes.play_notes)))
+        self.assertTrue(all(a is b for a, b in zip(bars, notes.bars)))
+
+
+if __name__ == '__main__':
+    unittest.main()
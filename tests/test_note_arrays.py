@@ -0,0 +1,76 @@
+import unittest
+
+from libs.tja import Note, NoteArrays, NoteType, TimelineObject
+
+
+def get_load_time(note: Note, travel_distance: float, note_half_w: float):
+    """Player.get_load_time without the skin lookups, the reference the columns are checked against"""
+    base_pixels_per_ms = note.bpm / 240000 * abs(note.scroll_x) * travel_distance
+    if base_pixels_per_ms == 0:
+        base_pixels_per_ms = note.bpm / 240000 * abs(note.scroll_y) * travel_distance
+    normal_travel_ms = (travel_distance + note_half_w) / base_pixels_per_ms
+    if note.sudden_appear_ms == float('inf'):
+        note.load_ms = note.hit_ms - normal_travel_ms
+        note.unload_ms = note.hit_ms + normal_travel_ms
+        return
+    note.load_ms = note.hit_ms - note.sudden_appear_ms
+    movement_duration = note.sudden_moving_ms
+    if movement_duration <= 0:
+        movement_duration = normal_travel_ms
+    note.unload_ms = note.hit_ms + travel_distance / (travel_distance / movement_duration)
+
+
+def make_notes() -> list[Note]:
+    return [
+        Note(type=NoteType.DON, hit_ms=0, bpm=120, index=0),
+        Note(type=NoteType.ROLL_HEAD, hit_ms=500, bpm=150, scroll_x=2, index=1),
+        Note(type=NoteType.TAIL, hit_ms=1500, bpm=150, scroll_x=0.5, index=2),
+        Note(type=NoteType.KAT, hit_ms=1600, bpm=90, scroll_x=0, scroll_y=1, index=3),
+        Note(type=NoteType.DON, hit_ms=2000, bpm=200, sudden_appear_ms=800, sudden_moving_ms=400, index=4),
+        Note(type=NoteType.KAT, hit_ms=2100, bpm=200, sudden_appear_ms=800, sudden_moving_ms=0, index=5),
+    ]
+
+
+class NoteArraysTest(unittest.TestCase):
+    def test_load_times_match_per_note(self):
+        expected = make_notes()
+        for note in expected:
+            get_load_time(note, 1200.0, 51)
+        notes = make_notes()
+        NoteArrays.from_notes(notes).compute_load_times(1200.0, 51)
+        self.assertEqual([(note.load_ms, note.unload_ms) for note in notes],
+                         [(note.load_ms, note.unload_ms) for note in expected])
+
+    def test_tails_load_with_their_head(self):
+        notes = make_notes()
+        arrays = NoteArrays.from_notes(notes)
+        arrays.compute_load_times(1200.0, 51, link_tails=True)
+        self.assertEqual(notes[2].load_ms, notes[1].load_ms)
+        self.assertEqual(notes[1].unload_ms, notes[2].unload_ms)
+        self.assertEqual(arrays.sorted_by_load_ms(), sorted(notes, key=lambda note: note.load_ms))
+
+    def test_roll_columns(self):
+        arrays = NoteArrays.from_notes(make_notes())
+        self.assertEqual(arrays.tail.tolist(), [-1, 2, -1, -1, -1, -1])
+        self.assertEqual(arrays.end_ms.tolist(), [0, 1500, 1500, 1600, 2000, 2100])
+
+    def test_gogo_from_timeline(self):
+        start, end = TimelineObject(), TimelineObject()
+        start.hit_ms, start.gogo_time = 500, True
+        end.hit_ms, end.gogo_time = 1600, False
+        arrays = NoteArrays.from_notes(make_notes(), [start, end])
+        self.assertEqual(arrays.gogo.tolist(), [False, True, True, False, False, False])
+
+    def test_window_holds_every_note_in_reach(self):
+        notes = [Note(type=NoteType.DON, hit_ms=ms, bpm=120, index=i) for i, ms in enumerate(range(0, 60000, 250))]
+        arrays = NoteArrays.from_notes(notes)
+        speed_x, _ = arrays.pixels_per_ms(1200.0)
+        window = arrays.window(30000, 1920, 1200.0)
+        for row, note in enumerate(notes):
+            if abs((note.hit_ms - 30000) * speed_x[row]) <= 1920:
+                self.assertIn(row, window)
+        self.assertLess(len(window), len(notes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from libs.global_data import Crown, global_data
+from libs.song_hash import create_song_db, remap_score_hashes
+
+
+class RemapScoreHashesTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        old_score_db = global_data.score_db
+        self.addCleanup(setattr, global_data, 'score_db', old_score_db)
+        global_data.score_db = str(Path(tmp.name) / 'scores.db')
+        create_song_db()
+        self.con = sqlite3.connect(global_data.score_db)
+        self.addCleanup(self.con.close)
+
+    def add_score(self, hash: str, score: int, clear: int, good: int = 0):
+        self.con.execute('INSERT INTO scores (hash, en_name, jp_name, diff, score, good, ok, bad, drumroll, combo, clear) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (hash, 'Dogbite', 'Dogbite', 3, score, good, 0, 0, 0, 0, clear))
+
+    def get_scores(self) -> dict[str, tuple[int, int, int]]:
+        rows = self.con.execute('SELECT hash, score, good, clear FROM scores').fetchall()
+        return {hash: (score, good, clear) for hash, score, good, clear in rows}
+
+    def test_rename_without_conflict(self):
+        self.add_score('old', 900000, Crown.CLEAR, good=500)
+        count = remap_score_hashes(self.con, [('old', 'new')])
+        self.assertEqual(count, 1)
+        self.assertEqual(self.get_scores(), {'new': (900000, 500, Crown.CLEAR)})
+
+    def test_merge_keeps_higher_new_score_and_upgrades_crown(self):
+        self.add_score('old', 800000, Crown.FC, good=400)
+        self.add_score('new', 950000, Crown.CLEAR, good=600)
+        count = remap_score_hashes(self.con, [('old', 'new')])
+        self.assertEqual(count, 1)
+        self.assertEqual(self.get_scores(), {'new': (950000, 600, Crown.FC)})
+
+    def test_merge_replaces_lower_new_score_and_keeps_best_crown(self):
+        self.add_score('old', 990000, Crown.CLEAR, good=700)
+        self.add_score('new', 700000, Crown.DFC, good=300)
+        count = remap_score_hashes(self.con, [('old', 'new')])
+        self.assertEqual(count, 1)
+        self.assertEqual(self.get_scores(), {'new': (990000, 700, Crown.DFC)})
+
+    def test_old_rows_deleted_and_counted(self):
+        self.add_score('a', 100000, Crown.NONE)
+        self.add_score('b', 200000, Crown.CLEAR)
+        self.add_score('b2', 300000, Crown.NONE)
+        self.add_score('untouched', 400000, Crown.FC)
+        count = remap_score_hashes(self.con, [('a', 'a2'), ('b', 'b2'), ('missing', 'c2'), ('same', 'same')])
+        self.assertEqual(count, 2)
+        self.assertEqual(self.get_scores(), {
+            'a2': (100000, 0, Crown.NONE),
+            'b2': (300000, 0, Crown.CLEAR),
+            'untouched': (400000, 0, Crown.FC),
+        })
+        self.assertIsNone(self.con.execute("SELECT name FROM sqlite_temp_master WHERE name = 'hash_remap'").fetchone())
+
+
+if __name__ == '__main__':
+    unittest.main()
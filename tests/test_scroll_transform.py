@@ -0,0 +1,47 @@
+import unittest
+
+from libs.tja import Note, TimelineObject, apply_scroll_commands, apply_scroll_commands_legacy
+
+
+def make_timeline(commands: list[tuple[float, str, float]]) -> list[TimelineObject]:
+    timeline = []
+    for hit_ms, kind, value in commands:
+        timeline_object = TimelineObject()
+        timeline_object.hit_ms = hit_ms
+        setattr(timeline_object, kind, value)
+        timeline.append(timeline_object)
+    return timeline
+
+
+class ScrollTransformTest(unittest.TestCase):
+    def assert_matches_legacy(self, commands: list[tuple[float, str, float]], hit_ms: list[float]):
+        legacy = [Note(hit_ms=ms) for ms in hit_ms]
+        notes = [Note(hit_ms=ms) for ms in hit_ms]
+        apply_scroll_commands_legacy(make_timeline(commands), legacy)
+        self.assertTrue(apply_scroll_commands(make_timeline(commands), notes))
+        for old, new in zip(legacy, notes):
+            self.assertAlmostEqual(old.hit_ms, new.hit_ms, delta=1e-6)
+
+    def test_note_transformed_onto_a_command_is_not_moved(self):
+        commands = [(100, 'delay', 100), (200, 'bpmchange', 2), (300, 'bpmchange', 0.75), (550, 'delay', 100)]
+        notes = [Note(hit_ms=800)]
+        apply_scroll_commands(make_timeline(commands), notes)
+        self.assertAlmostEqual(notes[0].hit_ms, 650)
+        self.assert_matches_legacy(commands, [800])
+
+    def test_note_on_a_command_is_not_moved(self):
+        commands = [(200, 'bpmchange', 2), (300, 'bpmchange', 1.5), (300, 'delay', 50)]
+        self.assert_matches_legacy(commands, [200, 250, 300, 350, 400])
+
+    def test_notes_between_ties_are_moved(self):
+        commands = [(100, 'bpmchange', 3), (250, 'delay', 25), (250, 'bpmchange', 0.5), (400, 'delay', 100)]
+        self.assert_matches_legacy(commands, [ms * 25 for ms in range(40)])
+
+    def test_negative_delay_falls_back(self):
+        commands = [(100, 'delay', -50), (200, 'bpmchange', 2)]
+        notes = [Note(hit_ms=ms) for ms in (50, 150, 250)]
+        self.assertFalse(apply_scroll_commands(make_timeline(commands), notes))
+
+
+if __name__ == '__main__':
+    unittest.main()
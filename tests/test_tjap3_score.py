@@ -0,0 +1,76 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from libs.global_data import Crown
+from libs.song_hash import get_tjap3_score_records, read_tjap3_score
+
+# A score.ini as written by TJAPlayer3, trimmed to the sections PyTaiko reads
+SCORE_INI = """[File]
+Title=さいたま2000
+Name=
+
+[HiScore.Drums]
+HiScore1=0
+HiScore2=512340
+HiScore3=884020
+HiScore4=1002360
+HiScore5=0
+Clear0=0
+Clear1=1
+Clear2=2
+Clear3=0
+Clear4=0
+PerfectRange=25
+GoodRange=75
+PoorRange=108
+Perfect=612
+Great=21
+Miss=3
+"""
+
+
+class ReadTJAP3ScoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_ini(self, text: str, encoding: str = 'utf-8') -> Path:
+        path = Path(self.tmp.name) / 'song.tja.score.ini'
+        path.write_bytes(text.encode(encoding))
+        return path
+
+    def test_reads_scores_clears_and_judgements(self):
+        scores, clears, judgements = read_tjap3_score(self.write_ini(SCORE_INI))
+        self.assertEqual(scores, [0, 512340, 884020, 1002360, 0])
+        self.assertEqual(clears, [0, 1, 2, 0, 0])
+        self.assertEqual(judgements, [612, 21, 3])
+
+    def test_reads_shift_jis(self):
+        scores, _, _ = read_tjap3_score(self.write_ini(SCORE_INI, 'shift_jis'))
+        self.assertEqual(scores[3], 1002360)
+
+    def test_other_judgement_windows_are_skipped(self):
+        scores, clears, judgements = read_tjap3_score(self.write_ini(SCORE_INI.replace('GoodRange=75', 'GoodRange=90')))
+        self.assertEqual((scores, clears, judgements), ([0], [0], None))
+
+    def test_missing_clears_and_ranges_use_defaults(self):
+        text = '\n'.join(line for line in SCORE_INI.splitlines()
+                         if not line.startswith(('Clear', 'PerfectRange', 'GoodRange', 'PoorRange', 'Perfect', 'Great', 'Miss')))
+        scores, clears, judgements = read_tjap3_score(self.write_ini(text))
+        self.assertEqual(scores, [0, 512340, 884020, 1002360, 0])
+        self.assertEqual(clears, [0] * 5)
+        self.assertIsNone(judgements)
+
+    def test_records(self):
+        diff_hashes = {1: 'hash1', 2: 'hash2', 3: 'hash3', 4: 'hash4'}
+        records = get_tjap3_score_records(self.write_ini(SCORE_INI), diff_hashes, 'Saitama 2000', 'さいたま2000')
+        self.assertEqual(records, [
+            ('hash1', 'Saitama 2000', 'さいたま2000', 1, 512340, Crown.CLEAR, None),
+            ('hash2', 'Saitama 2000', 'さいたま2000', 2, 884020, Crown.FC, 0),
+            ('hash3', 'Saitama 2000', 'さいたま2000', 3, 1002360, Crown.NONE, None),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()